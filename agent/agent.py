@@ -1,8 +1,8 @@
 import argparse
 import json
+from collections import Counter
 from typing import Any
 
-import tiktoken
 from beartype import beartype
 
 from agent.prompts import *
@@ -15,13 +15,7 @@ from browser_env.actions import (
     create_playwright_action,
 )
 from browser_env.utils import Observation, StateInfo
-from llms import (
-    call_llm,
-    generate_from_huggingface_completion,
-    generate_from_openai_chat_completion,
-    generate_from_openai_completion,
-    lm_config,
-)
+from llms import call_llm, call_llm_n, lm_config
 from llms.tokenizers import Tokenizer
 
 
@@ -115,6 +109,38 @@ class PromptAgent(Agent):
     def set_action_set_tag(self, tag: str) -> None:
         self.action_set_tag = tag
 
+    def parse_response(self, response: str) -> Action:
+        """Parse a single model response into an action"""
+        parsed_response = self.prompt_constructor.extract_action(response)
+        if self.action_set_tag == "id_accessibility_tree":
+            action = create_id_based_action(parsed_response)
+        elif self.action_set_tag == "playwright":
+            action = create_playwright_action(parsed_response)
+        else:
+            raise ValueError(f"Unknown action type {self.action_set_tag}")
+        action["raw_prediction"] = response
+        return action
+
+    def select_action(self, candidates: list[Action]) -> Action:
+        """Select one action among the candidates that were parsed successfully"""
+        if (
+            self.lm_config.gen_config.get("sample_selection", "first")
+            != "vote"
+        ):
+            return candidates[0]
+        # majority vote over the parsed actions, ties go to the earliest
+        keys = [
+            " ".join(
+                self.prompt_constructor.extract_action(
+                    action["raw_prediction"]
+                ).split()
+            )
+            for action in candidates
+        ]
+        votes = Counter(keys)
+        best_key = max(keys, key=lambda k: votes[k])
+        return candidates[keys.index(best_key)]
+
     @beartype
     def next_action(
         self, trajectory: Trajectory, intent: str, meta_data: dict[str, Any]
@@ -123,33 +149,32 @@ class PromptAgent(Agent):
             trajectory, intent, meta_data
         )
         lm_config = self.lm_config
+        n_samples = lm_config.gen_config.get("n_samples", 1)
+        force_prefix = self.prompt_constructor.instruction["meta_data"].get(
+            "force_prefix", ""
+        )
         n = 0
         while True:
-            response = call_llm(lm_config, prompt)
-            force_prefix = self.prompt_constructor.instruction[
-                "meta_data"
-            ].get("force_prefix", "")
-            response = f"{force_prefix}{response}"
+            # all the samples of one round come back from a single call
+            if n_samples > 1:
+                responses = call_llm_n(lm_config, prompt, n_samples)
+            else:
+                responses = [call_llm(lm_config, prompt)]
+            responses = [f"{force_prefix}{r}" for r in responses]
             n += 1
-            try:
-                parsed_response = self.prompt_constructor.extract_action(
-                    response
-                )
-                if self.action_set_tag == "id_accessibility_tree":
-                    action = create_id_based_action(parsed_response)
-                elif self.action_set_tag == "playwright":
-                    action = create_playwright_action(parsed_response)
-                else:
-                    raise ValueError(
-                        f"Unknown action type {self.action_set_tag}"
-                    )
-                action["raw_prediction"] = response
+            candidates: list[Action] = []
+            for response in responses:
+                try:
+                    candidates.append(self.parse_response(response))
+                except ActionParsingError:
+                    continue
+            if candidates:
+                action = self.select_action(candidates)
+                break
+            if n >= lm_config.gen_config["max_retry"]:
+                action = create_none_action()
+                action["raw_prediction"] = responses[0]
                 break
-            except ActionParsingError as e:
-                if n >= lm_config.gen_config["max_retry"]:
-                    action = create_none_action()
-                    action["raw_prediction"] = response
-                    break
 
         return action
 
@@ -1,13 +1,14 @@
+import functools
 import json
 import re
 from pathlib import Path
-from typing import Any, TypedDict
+from typing import Any, Callable, TypedDict
 
 from browser_env import Action, ActionParsingError, Trajectory
 from browser_env.env_config import URL_MAPPINGS
 from browser_env.utils import StateInfo
 from llms import lm_config
-from llms.tokenizers import Tokenizer
+from llms.tokenizers import TokenCounter, Tokenizer
 from llms.utils import APIInput
 
 
@@ -20,6 +21,57 @@ class Instruction(TypedDict):
     meta_data: dict[str, Any]
 
 
+@functools.lru_cache(maxsize=None)
+def load_instruction(instruction_path: Path) -> Instruction:
+    """Load an instruction file once, the result is shared and read-only"""
+    with open(instruction_path) as f:
+        instruction = json.load(f)
+    instruction["examples"] = [tuple(e) for e in instruction["examples"]]
+    return instruction  # type: ignore[no-any-return]
+
+
+def compile_url_rewriter(mapping: dict[str, str]) -> Callable[[str], str]:
+    """Return a function replacing every key of `mapping` by its value
+
+    All keys are matched by one regex in a single pass, longer keys first so
+    that a key that is a prefix of another does not shadow it.
+    """
+    sources = sorted([src for src in mapping if src], key=len, reverse=True)
+    if not sources:
+        return lambda url: url
+    pattern = re.compile("|".join(re.escape(src) for src in sources))
+
+    def rewrite(url: str) -> str:
+        return pattern.sub(lambda m: mapping[m.group(0)], url)
+
+    return rewrite
+
+
+@functools.lru_cache(maxsize=None)
+def get_url_rewriters() -> tuple[Callable[[str], str], Callable[[str], str]]:
+    """Rewriters from local to real urls and from real to local urls"""
+    to_real = compile_url_rewriter(URL_MAPPINGS)
+    real_to_local = {}
+    for local, real in URL_MAPPINGS.items():
+        real_to_local[real] = local
+        # https
+        real_to_local[real.replace("http", "https")] = local
+    to_local = compile_url_rewriter(real_to_local)
+    return to_real, to_local
+
+
+def find_between(text: str, splitter: str) -> str | None:
+    """Return the stripped text between the first two occurrences of `splitter`"""
+    start = text.find(splitter)
+    if start == -1:
+        return None
+    start += len(splitter)
+    end = text.find(splitter, start)
+    if end == -1:
+        return None
+    return text[start:end].strip()
+
+
 class PromptConstructor(object):
     def __init__(
         self,
@@ -30,16 +82,20 @@ class PromptConstructor(object):
         self.instruction_path = Path(instruction_path)
         self.obs_modality = "text"
         self.lm_config = lm_config
-        instruction = json.load(open(self.instruction_path))
-        instruction["examples"] = [tuple(e) for e in instruction["examples"]]
-        self.instruction: Instruction = instruction
+        self.instruction: Instruction = load_instruction(self.instruction_path)
         self.tokenizer = tokenizer
-
-    def get_lm_api_input(
-        self, intro: str, examples: list[tuple[str, str]], current: str
-    ) -> APIInput:
-
-        """Return the require format for an API"""
+        self.token_counter = TokenCounter(tokenizer)
+        # tokens of the intro and the examples, counted once
+        self._static_prompt_tokens: int | None = None
+        # token counts of the last constructed prompt
+        self.prompt_stats: dict[str, int] = {}
+        # the part of the prompt before the current input, built once
+        self._static_prefix: list[dict[str, str]] | str | None = None
+
+    def get_static_prefix(
+        self, intro: str, examples: list[tuple[str, str]]
+    ) -> list[dict[str, str]] | str:
+        """Return the part of the prompt before the current input"""
         message: list[dict[str, str]] | str
         if "openai" in self.lm_config.provider:
             if self.lm_config.mode == "chat":
@@ -59,7 +115,6 @@ class PromptConstructor(object):
                             "content": y,
                         }
                     )
-                message.append({"role": "user", "content": current})
                 return message
             elif self.lm_config.mode == "completion":
                 message = f"{intro}\n\n"
@@ -68,8 +123,6 @@ class PromptConstructor(object):
                     message += f"Observation\n:{example[0]}\n\n"
                     message += f"Action: {example[1]}\n\n"
                 message += "Now make prediction given the observation\n\n"
-                message += f"Observation\n:{current}\n\n"
-                message += "Action:"
                 return message
             else:
                 raise ValueError(
@@ -96,9 +149,6 @@ class PromptConstructor(object):
                             for (x, y) in examples
                         ]
                     )
-                    # add the current observation
-                    message += f"{BOS}{B_INST} {current.strip()} {E_INST} {self.instruction['meta_data'].get('force_prefix', '')}"
-
                     return message
                 else:
                     raise ValueError("Only chat mode is supported for Llama-2")
@@ -111,6 +161,39 @@ class PromptConstructor(object):
                 f"Provider {self.lm_config.provider} not implemented"
             )
 
+    def append_current(
+        self, prefix: list[dict[str, str]] | str, current: str
+    ) -> APIInput:
+        """Complete the static prefix with the current input"""
+        if isinstance(prefix, list):
+            return [*prefix, {"role": "user", "content": current}]
+        if "huggingface" in self.lm_config.provider:
+            force_prefix = self.instruction["meta_data"].get(
+                "force_prefix", ""
+            )
+            return (
+                f"{prefix}<s>[INST] {current.strip()} [/INST] {force_prefix}"
+            )
+        return f"{prefix}Observation\n:{current}\n\nAction:"
+
+    def get_prompt(self, current: str) -> APIInput:
+        """Return the prompt of the instruction's intro and examples and
+        the current input, reusing the static prefix across steps"""
+        if self._static_prefix is None:
+            self._static_prefix = self.get_static_prefix(
+                self.instruction["intro"], self.instruction["examples"]
+            )
+        return self.append_current(self._static_prefix, current)
+
+    def get_lm_api_input(
+        self, intro: str, examples: list[tuple[str, str]], current: str
+    ) -> APIInput:
+
+        """Return the require format for an API"""
+        return self.append_current(
+            self.get_static_prefix(intro, examples), current
+        )
+
     def construct(
         self,
         trajectory: Trajectory,
@@ -119,22 +202,95 @@ class PromptConstructor(object):
     ) -> APIInput:
         raise NotImplementedError
 
+    def count_prompt_tokens(self, prompt: APIInput) -> int:
+        """Count the tokens of a prompt in the format returned by `get_lm_api_input`"""
+        if isinstance(prompt, str):
+            return self.token_counter.count_text(prompt)
+        assert isinstance(prompt, list)
+        # every chat message carries a few formatting tokens besides its fields
+        # https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+        num_tokens = 3
+        for message in prompt:
+            num_tokens += 4
+            for value in message.values():
+                num_tokens += self.token_counter.count_text(value)
+        return num_tokens
+
+    @property
+    def static_prompt_tokens(self) -> int:
+        """Tokens of the prompt when the current input is empty"""
+        if self._static_prompt_tokens is None:
+            self._static_prompt_tokens = self.count_prompt_tokens(
+                self.get_prompt("")
+            )
+        return self._static_prompt_tokens
+
+    def get_observation_budget(self, current_without_obs: str) -> int | None:
+        """Number of observation tokens that fill the rest of the context
+
+        `current_without_obs` is the template filled with an empty observation.
+        Without a known `context_length`, fall back to `max_obs_length`.
+        None means the observation is not truncated.
+        """
+        gen_config = self.lm_config.gen_config
+        max_obs_length: int = gen_config.get("max_obs_length", 0)
+        context_length: int = gen_config.get("context_length", 0)
+        if not context_length:
+            return max_obs_length or None
+
+        max_new_tokens: int = gen_config.get(
+            "max_tokens", gen_config.get("max_new_tokens", 0)
+        )
+        budget = (
+            context_length
+            - max_new_tokens
+            - self.static_prompt_tokens
+            - self.token_counter.count_text(current_without_obs)
+        )
+        budget = max(budget, 0)
+        if max_obs_length:
+            budget = min(budget, max_obs_length)
+        return budget
+
+    def fill_template(
+        self,
+        obs: str,
+        intent: str,
+        url: str,
+        previous_action: str,
+    ) -> str:
+        """Fill the template with the largest part of the observation that fits"""
+        template = self.instruction["template"]
+        current_without_obs = template.format(
+            objective=intent,
+            url=url,
+            observation="",
+            previous_action=previous_action,
+        )
+        obs_budget = self.get_observation_budget(current_without_obs)
+        if obs_budget is not None:
+            obs = self.token_counter.fit_lines(obs, obs_budget)
+
+        current = template.format(
+            objective=intent,
+            url=url,
+            observation=obs,
+            previous_action=previous_action,
+        )
+        self.prompt_stats = {
+            "static_tokens": self.static_prompt_tokens,
+            "observation_tokens": self.token_counter.count_text(obs),
+            "observation_budget": obs_budget or 0,
+        }
+        return current
+
     def map_url_to_real(self, url: str) -> str:
         """Map the urls to their real world counterparts"""
-        for i, j in URL_MAPPINGS.items():
-            if i in url:
-                url = url.replace(i, j)
-        return url
+        return get_url_rewriters()[0](url)
 
     def map_url_to_local(self, url: str) -> str:
         """Map the urls to their local counterparts"""
-        for i, j in URL_MAPPINGS.items():
-            if j in url:
-                url = url.replace(j, i)
-            # https
-            if j.replace("http", "https") in url:
-                url = url.replace(j.replace("http", "https"), i)
-        return url
+        return get_url_rewriters()[1](url)
 
     def _extract_action(self, response: str) -> str:
         raise NotImplementedError
@@ -163,40 +319,34 @@ class DirectPromptConstructor(PromptConstructor):
         meta_data: dict[str, Any] = {},
     ) -> APIInput:
         """Construct prompt given the trajectory"""
-        intro = self.instruction["intro"]
-        examples = self.instruction["examples"]
-        template = self.instruction["template"]
         keywords = self.instruction["meta_data"]["keywords"]
         state_info: StateInfo = trajectory[-1]  # type: ignore[assignment]
 
         obs = state_info["observation"][self.obs_modality]
-        max_obs_length = self.lm_config.gen_config["max_obs_length"]
-        if max_obs_length:
-            obs = self.tokenizer.decode(self.tokenizer.encode(obs)[:max_obs_length])  # type: ignore[arg-type]
-
         page = state_info["info"]["page"]
         url = page.url
         previous_action_str = meta_data["action_history"][-1]
 
         # input x
-        current = template.format(
-            objective=intent,
+        current = self.fill_template(
+            obs,  # type: ignore[arg-type]
+            intent=intent,
             url=self.map_url_to_real(url),
-            observation=obs,
             previous_action=previous_action_str,
         )
 
         # make sure all keywords are replaced
         assert all([f"{{k}}" not in current for k in keywords])
-        prompt = self.get_lm_api_input(intro, examples, current)
+        prompt = self.get_prompt(current)
+        self.prompt_stats["prompt_tokens"] = self.count_prompt_tokens(prompt)
         return prompt
 
     def _extract_action(self, response: str) -> str:
-        action_splitter = self.instruction["meta_data"]["action_splitter"]
-        pattern = rf"{action_splitter}((.|\n)*?){action_splitter}"
-        match = re.search(pattern, response)
-        if match:
-            return match.group(1).strip()
+        action = find_between(
+            response, self.instruction["meta_data"]["action_splitter"]
+        )
+        if action is not None:
+            return action
         else:
             raise ActionParsingError(
                 f"Cannot parse action from response {response}"
@@ -221,39 +371,33 @@ class CoTPromptConstructor(PromptConstructor):
         intent: str,
         meta_data: dict[str, Any] = {},
     ) -> APIInput:
-        intro = self.instruction["intro"]
-        examples = self.instruction["examples"]
-        template = self.instruction["template"]
         keywords = self.instruction["meta_data"]["keywords"]
         state_info: StateInfo = trajectory[-1]  # type: ignore[assignment]
 
         obs = state_info["observation"][self.obs_modality]
-        max_obs_length = self.lm_config.gen_config["max_obs_length"]
-        if max_obs_length:
-            obs = self.tokenizer.decode(self.tokenizer.encode(obs)[:max_obs_length])  # type: ignore[arg-type]
-
         page = state_info["info"]["page"]
         url = page.url
         previous_action_str = meta_data["action_history"][-1]
-        current = template.format(
-            objective=intent,
+        current = self.fill_template(
+            obs,  # type: ignore[arg-type]
+            intent=intent,
             url=self.map_url_to_real(url),
-            observation=obs,
             previous_action=previous_action_str,
         )
 
         assert all([f"{{k}}" not in current for k in keywords])
 
-        prompt = self.get_lm_api_input(intro, examples, current)
+        prompt = self.get_prompt(current)
+        self.prompt_stats["prompt_tokens"] = self.count_prompt_tokens(prompt)
         return prompt
 
     def _extract_action(self, response: str) -> str:
         # find the first occurence of action
-        action_splitter = self.instruction["meta_data"]["action_splitter"]
-        pattern = rf"{action_splitter}((.|\n)*?){action_splitter}"
-        match = re.search(pattern, response)
-        if match:
-            return match.group(1).strip()
+        action = find_between(
+            response, self.instruction["meta_data"]["action_splitter"]
+        )
+        if action is not None:
+            return action
         else:
             raise ActionParsingError(
                 f'Cannot find the answer phrase "{self.answer_phrase}" in "{response}"'
@@ -15,6 +15,7 @@ from browser_env.env_config import (
     REDDIT,
     SHOPPING,
     SHOPPING_ADMIN,
+    check_site_urls,
 )
 
 HEADLESS = True
@@ -146,6 +147,7 @@ def main(auth_folder: str = "./.auth") -> None:
 
 
 if __name__ == "__main__":
+    check_site_urls()
     parser = argparse.ArgumentParser()
     parser.add_argument("--site_list", nargs="+", default=[])
     parser.add_argument("--auth_folder", type=str, default="./.auth")
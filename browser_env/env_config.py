@@ -9,24 +9,31 @@ WIKIPEDIA = os.environ.get("WIKIPEDIA", "")
 MAP = os.environ.get("MAP", "")
 HOMEPAGE = os.environ.get("HOMEPAGE", "")
 
-assert (
-    REDDIT
-    and SHOPPING
-    and SHOPPING_ADMIN
-    and GITLAB
-    and WIKIPEDIA
-    and MAP
-    and HOMEPAGE
-), (
-    f"Please setup the URLs to each site. Current: \n"
-    + f"Reddit: {REDDIT}\n"
-    + f"Shopping: {SHOPPING}\n"
-    + f"Shopping Admin: {SHOPPING_ADMIN}\n"
-    + f"Gitlab: {GITLAB}\n"
-    + f"Wikipedia: {WIKIPEDIA}\n"
-    + f"Map: {MAP}\n"
-    + f"Homepage: {HOMEPAGE}\n"
-)
+
+def check_site_urls() -> None:
+    """Fail unless the urls of all the websites are set
+
+    Called by the entry points that visit the websites rather than at
+    import, so that importing the library needs no environment.
+    """
+    assert (
+        REDDIT
+        and SHOPPING
+        and SHOPPING_ADMIN
+        and GITLAB
+        and WIKIPEDIA
+        and MAP
+        and HOMEPAGE
+    ), (
+        f"Please setup the URLs to each site. Current: \n"
+        + f"Reddit: {REDDIT}\n"
+        + f"Shopping: {SHOPPING}\n"
+        + f"Shopping Admin: {SHOPPING_ADMIN}\n"
+        + f"Gitlab: {GITLAB}\n"
+        + f"Wikipedia: {WIKIPEDIA}\n"
+        + f"Map: {MAP}\n"
+        + f"Homepage: {HOMEPAGE}\n"
+    )
 
 
 ACCOUNTS = {
@@ -1,10 +1,15 @@
 import base64
+import hashlib
 import io
 import json
-import re
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 from typing import Any
 
+import numpy as np
+import numpy.typing as npt
 from PIL import Image
 
 from agent.prompts import *
@@ -32,6 +37,62 @@ HTML_TEMPLATE = """
     </body>
 </html>
 """
+# the template around the body, the render file is written as a stream
+HTML_HEAD, HTML_TAIL = HTML_TEMPLATE.format(body="\0").split("\0")
+
+
+def get_render_parsed_action(
+    action: Action,
+    observation_metadata: dict[str, ObservationMetadata],
+    action_set_tag: str,
+) -> str:
+    """The action with the full text of the element it targets"""
+    text_meta_data = observation_metadata["text"]
+    if action["element_id"] in text_meta_data["obs_nodes_info"]:
+        node_content = text_meta_data["obs_nodes_info"][action["element_id"]][
+            "text"
+        ]
+    else:
+        node_content = "No match found"
+    return action2str(action, action_set_tag, node_content)
+
+
+def format_render_action(
+    raw_prediction: str, action_repr: str, parsed_action: str
+) -> str:
+    action_str = f"<div class='raw_parsed_prediction' style='background-color:grey'><pre>{raw_prediction}</pre></div>"
+    action_str += f"<div class='action_object' style='background-color:grey'><pre>{action_repr}</pre></div>"
+    action_str += f"<div class='parsed_action' style='background-color:yellow'><pre>{parsed_action}</pre></div>"
+    return action_str
+
+
+def format_render_config(config: dict[str, Any]) -> str:
+    config_str = ""
+    for k, v in config.items():
+        config_str += f"{k}: {v}\n"
+    return f"<pre>{config_str}</pre>\n"
+
+
+def format_render_step(
+    url: str,
+    text_obs: str,
+    image_src: str | None,
+    previous_action: str,
+    action_str: str,
+) -> str:
+    """Return the html of one step of the trajectory"""
+    new_content = f"<h2>New Page</h2>\n"
+    new_content += f"<h3 class='url'><a href={url}>URL: {url}</a></h3>\n"
+    new_content += f"<div class='state_obv'><pre>{text_obs}</pre><div>\n"
+    if image_src is not None:
+        new_content += (
+            f"<img src='{image_src}' style='width:50vw; height:auto;'/>\n"
+        )
+    # meta data
+    new_content += f"<div class='prev_action' style='background-color:pink'>{previous_action}</div>\n"
+    # with yellow background
+    new_content += f"<div class='predict_action'>{action_str}</div>\n"
+    return new_content
 
 
 def get_render_action(
@@ -42,17 +103,13 @@ def get_render_action(
     """Parse the predicted actions for rendering purpose. More comprehensive information"""
     match action_set_tag:
         case "id_accessibility_tree":
-            text_meta_data = observation_metadata["text"]
-            if action["element_id"] in text_meta_data["obs_nodes_info"]:
-                node_content = text_meta_data["obs_nodes_info"][
-                    action["element_id"]
-                ]["text"]
-            else:
-                node_content = "No match found"
-
-            action_str = f"<div class='raw_parsed_prediction' style='background-color:grey'><pre>{action['raw_prediction']}</pre></div>"
-            action_str += f"<div class='action_object' style='background-color:grey'><pre>{repr(action)}</pre></div>"
-            action_str += f"<div class='parsed_action' style='background-color:yellow'><pre>{action2str(action, action_set_tag, node_content)}</pre></div>"
+            action_str = format_render_action(
+                action["raw_prediction"],
+                repr(action),
+                get_render_parsed_action(
+                    action, observation_metadata, action_set_tag
+                ),
+            )
 
         case "playwright":
             action_str = action["pw_code"]
@@ -110,29 +167,92 @@ def get_action_description(
     return action_str
 
 
+class ScreenshotWriter(object):
+    """Write screenshots as image files named by the hash of their pixels
+
+    A screenshot identical to one already written is not written again.
+    Encoding and writing run on a background thread, `close` waits for them.
+    """
+
+    formats = {"png": "PNG", "webp": "WEBP", "jpeg": "JPEG"}
+
+    def __init__(self, image_dir: str | Path, image_format: str = "png"):
+        if image_format not in self.formats:
+            raise ValueError(f"Unknown image format {image_format}")
+        self.image_dir = Path(image_dir)
+        self.image_dir.mkdir(parents=True, exist_ok=True)
+        self.image_format = image_format
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._futures: list[Future[None]] = []
+
+    def write(self, image: npt.NDArray[np.uint8]) -> Path:
+        """Schedule the screenshot to be written, return its path"""
+        digest = hashlib.sha1(str(image.shape).encode())
+        digest.update(np.ascontiguousarray(image).data)
+        path = self.image_dir / f"{digest.hexdigest()}.{self.image_format}"
+        if not path.exists():
+            self._futures.append(
+                self._executor.submit(self._save, image, path)
+            )
+        return path
+
+    def _save(self, image: npt.NDArray[np.uint8], path: Path) -> None:
+        if path.exists():
+            return
+        pil_image = Image.fromarray(image)
+        if self.image_format == "jpeg":
+            pil_image = pil_image.convert("RGB")
+        # write to a temporary file first so a partial image is never visible
+        tmp_path = path.with_suffix(
+            f".{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        pil_image.save(tmp_path, format=self.formats[self.image_format])
+        os.replace(tmp_path, path)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+
 class RenderHelper(object):
-    """Helper class to render text and image observations and meta data in the trajectory"""
+    """Helper class to render text and image observations and meta data in the trajectory
+
+    The render file is append-only: the head of the document is written on
+    creation, each step appends its fragment and the document is closed by
+    `close`. Whatever was rendered before a crash stays in the file.
+
+    Screenshots are written to `result_dir/images` in `image_format` and
+    referenced from the html. With `image_format=None` they are embedded in
+    the html as base64 PNG instead.
+    """
 
     def __init__(
-        self, config_file: str, result_dir: str, action_set_tag: str
+        self,
+        config_file: str,
+        result_dir: str,
+        action_set_tag: str,
+        image_format: str | None = "png",
     ) -> None:
         with open(config_file, "r") as f:
             _config = json.load(f)
-            _config_str = ""
-            for k, v in _config.items():
-                _config_str += f"{k}: {v}\n"
-            _config_str = f"<pre>{_config_str}</pre>\n"
+            _config_str = format_render_config(_config)
             task_id = _config["task_id"]
 
         self.action_set_tag = action_set_tag
+        self.result_dir = Path(result_dir)
+        self.screenshot_writer = (
+            ScreenshotWriter(self.result_dir / "images", image_format)
+            if image_format is not None
+            else None
+        )
 
         self.render_file = open(
-            Path(result_dir) / f"render_{task_id}.html", "a+"
+            Path(result_dir) / f"render_{task_id}.html", "w"
         )
-        self.render_file.truncate(0)
-        # write init template
-        self.render_file.write(HTML_TEMPLATE.format(body=f"{_config_str}"))
-        self.render_file.read()
+        # write the head of the template and the config
+        self.render_file.write(f"{HTML_HEAD}{_config_str}")
         self.render_file.flush()
 
     def render(
@@ -147,23 +267,24 @@ class RenderHelper(object):
         observation = state_info["observation"]
         text_obs = observation["text"]
         info = state_info["info"]
-        new_content = f"<h2>New Page</h2>\n"
-        new_content += f"<h3 class='url'><a href={state_info['info']['page'].url}>URL: {state_info['info']['page'].url}</a></h3>\n"
-        new_content += f"<div class='state_obv'><pre>{text_obs}</pre><div>\n"
 
+        image_src = None
         if render_screenshot:
             # image observation
             img_obs = observation["image"]
-            image = Image.fromarray(img_obs)  # type:ignore
-            byte_io = io.BytesIO()
-            image.save(byte_io, format="PNG")
-            byte_io.seek(0)
-            image_bytes = base64.b64encode(byte_io.read())
-            image_str = image_bytes.decode("utf-8")
-            new_content += f"<img src='data:image/png;base64,{image_str}' style='width:50vw; height:auto;'/>\n"
-
-        # meta data
-        new_content += f"<div class='prev_action' style='background-color:pink'>{meta_data['action_history'][-1]}</div>\n"
+            if self.screenshot_writer is not None:
+                image_path = self.screenshot_writer.write(
+                    img_obs  # type: ignore[arg-type]
+                )
+                image_src = image_path.relative_to(self.result_dir).as_posix()
+            else:
+                image = Image.fromarray(img_obs)  # type:ignore
+                byte_io = io.BytesIO()
+                image.save(byte_io, format="PNG")
+                byte_io.seek(0)
+                image_bytes = base64.b64encode(byte_io.read())
+                image_str = image_bytes.decode("utf-8")
+                image_src = f"data:image/png;base64,{image_str}"
 
         # action
         action_str = get_render_action(
@@ -171,21 +292,21 @@ class RenderHelper(object):
             info["observation_metadata"],
             action_set_tag=self.action_set_tag,
         )
-        # with yellow background
-        action_str = f"<div class='predict_action'>{action_str}</div>"
-        new_content += f"{action_str}\n"
+        new_content = format_render_step(
+            info["page"].url,
+            text_obs,  # type: ignore[arg-type]
+            image_src,
+            meta_data["action_history"][-1],
+            action_str,
+        )
 
         # add new content
-        self.render_file.seek(0)
-        html = self.render_file.read()
-        html_body = re.findall(r"<body>(.*?)</body>", html, re.DOTALL)[0]
-        html_body += new_content
-
-        html = HTML_TEMPLATE.format(body=html_body)
-        self.render_file.seek(0)
-        self.render_file.truncate()
-        self.render_file.write(html)
+        self.render_file.write(new_content)
         self.render_file.flush()
 
     def close(self) -> None:
-        self.render_file.close()
+        if self.screenshot_writer is not None:
+            self.screenshot_writer.close()
+        if not self.render_file.closed:
+            self.render_file.write(HTML_TAIL)
+            self.render_file.close()
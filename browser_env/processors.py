@@ -1,7 +1,8 @@
 import json
 import re
 from collections import defaultdict
-from typing import Any, TypedDict, Union
+from dataclasses import dataclass
+from typing import Any, Callable, TypedDict, Union
 
 import numpy as np
 import numpy.typing as npt
@@ -36,24 +37,75 @@ class ObservationProcessor:
 
 class ObservationMetadata(TypedDict):
     obs_nodes_info: dict[str, Any]
+    obs_truncation: dict[str, Any]
 
 
 def create_empty_metadata() -> ObservationMetadata:
     return {
         "obs_nodes_info": {},
+        "obs_truncation": {},
     }
 
 
+@dataclass
+class ObservationBudget:
+    """Length budget of a serialized observation.
+
+    `length_fn` measures a line without its line break, e.g., `len` for a
+    character budget or the number of tokens of the line for a token budget,
+    and each line break costs `line_break_length`. The serializer stops as
+    soon as the next line does not fit, so the result always ends on a whole
+    line. The counters record how much was kept and how much was dropped.
+    """
+
+    max_length: int
+    length_fn: Callable[[str], int] = len
+    # one character, or one token as counted by `TokenCounter`
+    line_break_length: int = 1
+    used_length: int = 0
+    kept_lines: int = 0
+    visited_nodes: int = 0
+    dropped_nodes: int = 0
+    exhausted: bool = False
+
+    def consume(self, line: str) -> bool:
+        """Account for a line (with its line break), return whether it fits"""
+        if self.exhausted:
+            return False
+        cost = self.length_fn(line) + self.line_break_length
+        if self.used_length + cost > self.max_length:
+            self.exhausted = True
+            return False
+        self.used_length += cost
+        self.kept_lines += 1
+        return True
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "max_length": self.max_length,
+            "used_length": self.used_length,
+            "kept_lines": self.kept_lines,
+            "truncated": self.exhausted,
+            "dropped_nodes": self.dropped_nodes,
+        }
+
+
 class TextObervationProcessor(ObservationProcessor):
     def __init__(
         self,
         observation_type: str,
         current_viewport_only: bool,
         viewport_size: ViewportSize,
+        max_obs_length: int = 0,
+        obs_length_fn: Callable[[str], int] | None = None,
     ):
         self.observation_type = observation_type
         self.current_viewport_only = current_viewport_only
         self.viewport_size = viewport_size
+        # when not zero, stop serializing the page once the observation
+        # reaches this length, measured by `obs_length_fn` (characters by default)
+        self.max_obs_length = max_obs_length
+        self.obs_length_fn = obs_length_fn or len
         self.observation_tag = "text"
         self.meta_data = (
             create_empty_metadata()
@@ -318,19 +370,27 @@ class TextObervationProcessor(ObservationProcessor):
         return dom_tree
 
     @staticmethod
-    def parse_html(dom_tree: DOMTree) -> tuple[str, dict[str, Any]]:
-        """Parse the html tree into a string text"""
+    def parse_html(
+        dom_tree: DOMTree, budget: ObservationBudget | None = None
+    ) -> tuple[str, dict[str, Any]]:
+        """Parse the html tree into a string text
+
+        When a budget is given, the traversal stops at the first line that
+        does not fit and the budget records what was left out.
+        """
 
         obs_nodes_info = {}
         nodeid_to_cursor = {
             node["nodeId"]: idx for idx, node in enumerate(dom_tree)
         }
+        lines: list[str] = []
 
-        def dfs(node_cursor: int, depth: int) -> str:
-            tree_str = ""
+        def dfs(node_cursor: int, depth: int) -> None:
             node = dom_tree[node_cursor]
             indent = "\t" * depth
             valid_node = True
+            if budget is not None:
+                budget.visited_nodes += 1
             try:
                 node_str = f"[{node_cursor}] <{node['nodeName']}"
                 if node["attributes"]:
@@ -339,25 +399,34 @@ class TextObervationProcessor(ObservationProcessor):
                 valid_node = bool(node["attributes"] or node["nodeValue"])
 
                 if valid_node:
+                    if budget is not None and not budget.consume(
+                        f"{indent}{node_str}"
+                    ):
+                        return
                     obs_nodes_info[str(node_cursor)] = {
                         "backend_id": node["backendNodeId"],
                         "union_bound": node["union_bound"],
                         "text": node_str,
                     }
-                    tree_str += f"{indent}{node_str}\n"
+                    lines.append(f"{indent}{node_str}\n")
 
             except Exception as e:
                 valid_node = False
 
             for child_ids in node["childIds"]:
+                if budget is not None and budget.exhausted:
+                    return
                 child_cursor = nodeid_to_cursor[child_ids]
                 child_depth = depth + 1 if valid_node else depth
-                child_str = dfs(child_cursor, child_depth)
-                tree_str += child_str
-
-            return tree_str
-
-        html = dfs(0, 0)
+                dfs(child_cursor, child_depth)
+
+        dfs(0, 0)
+        if budget is not None:
+            budget.dropped_nodes = len(dom_tree) - budget.visited_nodes
+            if budget.exhausted:
+                # the node that did not fit was visited but dropped
+                budget.dropped_nodes += 1
+        html = "".join(lines)
         return html, obs_nodes_info
 
     def fetch_page_accessibility_tree(
@@ -473,19 +542,26 @@ class TextObervationProcessor(ObservationProcessor):
     @staticmethod
     def parse_accessibility_tree(
         accessibility_tree: AccessibilityTree,
+        budget: ObservationBudget | None = None,
     ) -> tuple[str, dict[str, Any]]:
-        """Parse the accessibility tree into a string text"""
+        """Parse the accessibility tree into a string text
+
+        When a budget is given, the traversal stops at the first line that
+        does not fit and the budget records what was left out.
+        """
         node_id_to_idx = {}
         for idx, node in enumerate(accessibility_tree):
             node_id_to_idx[node["nodeId"]] = idx
 
         obs_nodes_info = {}
+        lines: list[str] = []
 
-        def dfs(idx: int, obs_node_id: str, depth: int) -> str:
-            tree_str = ""
+        def dfs(idx: int, obs_node_id: str, depth: int) -> None:
             node = accessibility_tree[idx]
             indent = "\t" * depth
             valid_node = True
+            if budget is not None:
+                budget.visited_nodes += 1
             try:
                 role = node["role"]["value"]
                 name = node["name"]["value"]
@@ -529,7 +605,11 @@ class TextObervationProcessor(ObservationProcessor):
                         valid_node = False
 
                 if valid_node:
-                    tree_str += f"{indent}{node_str}"
+                    if budget is not None and not budget.consume(
+                        f"{indent}{node_str}"
+                    ):
+                        return
+                    lines.append(f"{indent}{node_str}")
                     obs_nodes_info[obs_node_id] = {
                         "backend_id": node["backendDOMNodeId"],
                         "union_bound": node["union_bound"],
@@ -542,19 +622,21 @@ class TextObervationProcessor(ObservationProcessor):
             for _, child_node_id in enumerate(node["childIds"]):
                 if child_node_id not in node_id_to_idx:
                     continue
+                if budget is not None and budget.exhausted:
+                    return
                 # mark this to save some tokens
                 child_depth = depth + 1 if valid_node else depth
-                child_str = dfs(
-                    node_id_to_idx[child_node_id], child_node_id, child_depth
-                )
-                if child_str.strip():
-                    if tree_str.strip():
-                        tree_str += "\n"
-                    tree_str += child_str
+                dfs(node_id_to_idx[child_node_id], child_node_id, child_depth)
 
-            return tree_str
-
-        tree_str = dfs(0, accessibility_tree[0]["nodeId"], 0)
+        dfs(0, accessibility_tree[0]["nodeId"], 0)
+        if budget is not None:
+            budget.dropped_nodes = (
+                len(accessibility_tree) - budget.visited_nodes
+            )
+            if budget.exhausted:
+                # the node that did not fit was visited but dropped
+                budget.dropped_nodes += 1
+        tree_str = "\n".join(lines)
         return tree_str, obs_nodes_info
 
     @staticmethod
@@ -605,6 +687,17 @@ class TextObervationProcessor(ObservationProcessor):
             page.wait_for_load_state("load", timeout=500)
             browser_info = self.fetch_browser_info(page, client)
 
+        budget = None
+        if self.max_obs_length:
+            # the tab titles and the two line breaks after them are part of
+            # the observation as well
+            budget = ObservationBudget(
+                max_length=self.max_obs_length
+                - self.obs_length_fn(tab_title_str)
+                - 2,
+                length_fn=self.obs_length_fn,
+            )
+
         if self.observation_type == "html":
             dom_tree = self.fetch_page_html(
                 browser_info,
@@ -612,7 +705,7 @@ class TextObervationProcessor(ObservationProcessor):
                 client,
                 current_viewport_only=self.current_viewport_only,
             )
-            content, obs_nodes_info = self.parse_html(dom_tree)
+            content, obs_nodes_info = self.parse_html(dom_tree, budget)
             self.obs_nodes_info = obs_nodes_info
             self.meta_data["obs_nodes_info"] = obs_nodes_info
 
@@ -623,7 +716,7 @@ class TextObervationProcessor(ObservationProcessor):
                 current_viewport_only=self.current_viewport_only,
             )
             content, obs_nodes_info = self.parse_accessibility_tree(
-                accessibility_tree
+                accessibility_tree, budget
             )
             content = self.clean_accesibility_tree(content)
             self.obs_nodes_info = obs_nodes_info
@@ -634,6 +727,10 @@ class TextObervationProcessor(ObservationProcessor):
                 f"Invalid observatrion type: {self.observation_type}"
             )
 
+        self.meta_data["obs_truncation"] = (
+            budget.summary() if budget is not None else {}
+        )
+
         self.browser_config = browser_info["config"]
         content = f"{tab_title_str}\n\n{content}"
         return content
@@ -675,10 +772,16 @@ class ObservationHandler:
         image_observation_type: str,
         current_viewport_only: bool,
         viewport_size: ViewportSize,
+        max_obs_length: int = 0,
+        obs_length_fn: Callable[[str], int] | None = None,
     ) -> None:
         self.main_observation_type = main_observation_type
         self.text_processor = TextObervationProcessor(
-            text_observation_type, current_viewport_only, viewport_size
+            text_observation_type,
+            current_viewport_only,
+            viewport_size,
+            max_obs_length=max_obs_length,
+            obs_length_fn=obs_length_fn,
         )
         self.image_processor = ImageObservationProcessor(
             image_observation_type
@@ -0,0 +1,240 @@
+"""Columnar dataset of the steps of a run, built from its trajectory logs
+
+The dataset is a directory:
+
+- `index.npy`: one row per step, a structured array of the numeric columns
+  (task id, step, score, timings, prompt tokens, screenshot index) sorted by
+  task id and step
+- `<column>.bin` and `<column>.offsets.npy`: each text column, one zlib
+  compressed blob per step and the offsets of the blobs
+- `screenshots.npy`: the distinct screenshots as one RGB uint8 tensor of
+  shape (num_screenshots, height, width, 3), opened as a memory map. The
+  screenshots are resized to the size of the first one
+- `tasks.json`: the config and the result of each task
+
+Loading one step reads its index row, decompresses its text fields and maps
+its screenshot, without reading the rest of the dataset.
+
+python -m browser_env.run_dataset --result_dir <result_dir> --output_dir <dir>
+"""
+import argparse
+import json
+import warnings
+import zlib
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+from PIL import Image
+
+from browser_env.trajectory_log import read_trajectory_log
+
+TEXT_COLUMNS = [
+    "url",
+    "observation",
+    "previous_action",
+    "action_type",
+    "raw_prediction",
+    "parsed_action",
+    "action_description",
+]
+
+INDEX_DTYPE = np.dtype(
+    [
+        ("task_id", np.int64),
+        ("step", np.int32),
+        ("score", np.float32),
+        ("env_time", np.float32),
+        ("agent_time", np.float32),
+        ("prompt_tokens", np.int32),
+        # row of `screenshots.npy`, -1 without a screenshot
+        ("screenshot", np.int64),
+    ]
+)
+
+
+def export_run_dataset(
+    result_dir: str | Path, output_dir: str | Path, compression_level: int = 6
+) -> int:
+    """Export the trajectory logs of `result_dir`, return the number of steps"""
+    result_dir = Path(result_dir)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    rows: list[tuple[Any, ...]] = []
+    texts: dict[str, list[bytes]] = {column: [] for column in TEXT_COLUMNS}
+    screenshot_paths: dict[str, int] = {}
+    tasks: dict[int, dict[str, Any]] = {}
+    for log_path in sorted(result_dir.glob("trajectories/*.jsonl")):
+        task_rows = []
+        task: dict[str, Any] = {}
+        for record in read_trajectory_log(log_path):
+            match record["type"]:
+                case "task":
+                    task_id = record["task_id"]
+                    task = {"config": record["config"], "score": None}
+                case "step":
+                    screenshot = -1
+                    if record["screenshot"] is not None:
+                        screenshot = screenshot_paths.setdefault(
+                            record["screenshot"], len(screenshot_paths)
+                        )
+                    task_rows.append(
+                        [
+                            task_id,
+                            record["step"],
+                            np.nan,
+                            record["timings"].get("env", np.nan),
+                            record["timings"].get("agent", np.nan),
+                            record["prompt_stats"].get("prompt_tokens", -1),
+                            screenshot,
+                        ]
+                    )
+                    for column in TEXT_COLUMNS:
+                        texts[column].append(
+                            zlib.compress(
+                                record[column].encode(), compression_level
+                            )
+                        )
+                case "result":
+                    task["score"] = record["score"]
+                case "error":
+                    task["error"] = record["error"]
+        if task:
+            tasks[task_id] = task
+            for row in task_rows:
+                if task["score"] is not None:
+                    row[2] = task["score"]
+                rows.append(tuple(row))
+
+    index = np.array(rows, dtype=INDEX_DTYPE)
+    order = np.lexsort((index["step"], index["task_id"]))
+    np.save(output_dir / "index.npy", index[order])
+    for column, blobs in texts.items():
+        with open(output_dir / f"{column}.bin", "wb") as f:
+            for i in order:
+                f.write(blobs[i])
+        sizes = np.array([len(blobs[i]) for i in order], dtype=np.int64)
+        offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        np.save(output_dir / f"{column}.offsets.npy", offsets)
+
+    _write_screenshots(
+        [result_dir / path for path in screenshot_paths],
+        output_dir / "screenshots.npy",
+    )
+    with open(output_dir / "tasks.json", "w") as f:
+        json.dump({str(k): v for k, v in sorted(tasks.items())}, f)
+    return len(index)
+
+
+def _write_screenshots(paths: list[Path], output_path: Path) -> None:
+    shape: tuple[int, ...] = (0, 0, 0, 3)
+    size = (0, 0)
+    if paths:
+        with Image.open(paths[0]) as image:
+            size = image.size
+        shape = (len(paths), size[1], size[0], 3)
+    tensor = np.lib.format.open_memmap(
+        output_path, mode="w+", dtype=np.uint8, shape=shape
+    )
+    for i, path in enumerate(paths):
+        with Image.open(path) as image:
+            # the screenshots of a run may mix RGBA PNG and RGB JPEG files
+            frame = image.convert("RGB")
+        if frame.size != size:
+            warnings.warn(
+                f"Screenshot {path} has size {frame.size}, resized to {size}"
+            )
+            frame = frame.resize(size)
+        tensor[i] = np.asarray(frame)
+    tensor.flush()
+    del tensor
+
+
+class RunDataset(object):
+    """Read a dataset written by `export_run_dataset`"""
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self.index: npt.NDArray[Any] = np.load(self.path / "index.npy")
+        self.screenshots: npt.NDArray[np.uint8] = np.load(
+            self.path / "screenshots.npy", mmap_mode="r"
+        )
+        self._offsets = {
+            column: np.load(self.path / f"{column}.offsets.npy")
+            for column in TEXT_COLUMNS
+        }
+        self._text_files = {
+            column: open(self.path / f"{column}.bin", "rb")
+            for column in TEXT_COLUMNS
+        }
+        with open(self.path / "tasks.json", "r") as f:
+            self.tasks: dict[int, dict[str, Any]] = {
+                int(k): v for k, v in json.load(f).items()
+            }
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def rows_of_task(self, task_id: int) -> range:
+        task_ids = self.index["task_id"]
+        return range(
+            int(np.searchsorted(task_ids, task_id, side="left")),
+            int(np.searchsorted(task_ids, task_id, side="right")),
+        )
+
+    def find(self, task_id: int, step: int) -> int:
+        """Row of a step, by binary search in the sorted index"""
+        rows = self.rows_of_task(task_id)
+        steps = self.index["step"][rows.start : rows.stop]
+        offset = int(np.searchsorted(steps, step))
+        if offset == len(steps) or steps[offset] != step:
+            raise KeyError((task_id, step))
+        return rows.start + offset
+
+    def text(self, column: str, row: int) -> str:
+        offsets = self._offsets[column]
+        f = self._text_files[column]
+        f.seek(offsets[row])
+        return zlib.decompress(
+            f.read(offsets[row + 1] - offsets[row])
+        ).decode()
+
+    def screenshot(self, row: int) -> npt.NDArray[np.uint8] | None:
+        idx = int(self.index["screenshot"][row])
+        return None if idx == -1 else self.screenshots[idx]
+
+    def get_step(self, task_id: int, step: int) -> dict[str, Any]:
+        row = self.find(task_id, step)
+        record: dict[str, Any] = {
+            name: self.index[name][row].item()
+            for name in self.index.dtype.names or ()
+        }
+        for column in TEXT_COLUMNS:
+            record[column] = self.text(column, row)
+        record["screenshot"] = self.screenshot(row)
+        return record
+
+    def close(self) -> None:
+        for f in self._text_files.values():
+            f.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Export the trajectory logs of a result dir as a columnar dataset"
+    )
+    parser.add_argument("--result_dir", type=str, required=True)
+    parser.add_argument("--output_dir", type=str, required=True)
+    parser.add_argument("--compression_level", type=int, default=6)
+    args = parser.parse_args()
+    num_steps = export_run_dataset(
+        args.result_dir, args.output_dir, args.compression_level
+    )
+    print(f"Exported {num_steps} steps to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,242 @@
-from typing import Union
+import pickle
+import sys
+import tempfile
+import weakref
+from dataclasses import dataclass
+from pathlib import Path
+from typing import (
+    Any,
+    Iterable,
+    Iterator,
+    SupportsIndex,
+    Union,
+    overload,
+)
+
+import numpy as np
 
 from .actions import Action
 from .utils import StateInfo
 
 Trajectory = list[Union[StateInfo, Action]]
+
+
+@dataclass(frozen=True)
+class _SpilledState:
+    """Location of a state written to disk by `MemoryBoundedTrajectory`"""
+
+    # offset and length of the pickled state without its arrays
+    offset: int
+    length: int
+    # observation key -> offset, dtype and shape in the array file
+    arrays: dict[str, tuple[int, str, tuple[int, ...]]]
+
+
+class MemoryBoundedTrajectory(list):  # type: ignore[type-arg]
+    """A trajectory that keeps the last `max_states_in_memory` states in memory
+
+    Older states are spilled to disk: the observation arrays (screenshots)
+    are appended to a raw file and read back as read-only memory maps, the
+    rest of the state is pickled. Actions always stay in memory. Indexing,
+    slicing, iteration and the other list methods load spilled states
+    transparently, so the container can be used wherever a `Trajectory` is
+    expected. Methods returning a new list, e.g. `copy` and `+`, return a
+    plain `Trajectory` of the loaded items.
+    """
+
+    def __init__(
+        self,
+        max_states_in_memory: int = 2,
+        spill_dir: str | Path | None = None,
+    ) -> None:
+        super().__init__()
+        self.max_states_in_memory = max_states_in_memory
+        self._spill_dir = Path(
+            tempfile.mkdtemp(prefix="trajectory_", dir=spill_dir)
+        )
+        self._array_path = self._spill_dir / "arrays.bin"
+        self._state_path = self._spill_dir / "states.pkl"
+        self._array_file = open(self._array_path, "wb")
+        self._state_file = open(self._state_path, "wb")
+        self._state_reader = open(self._state_path, "rb")
+        # indices of the states that are still in memory, oldest first
+        self._in_memory: list[int] = []
+        self._finalizer = weakref.finalize(
+            self,
+            self._cleanup,
+            self._spill_dir,
+            self._array_file,
+            self._state_file,
+            self._state_reader,
+        )
+
+    @staticmethod
+    def _cleanup(spill_dir: Path, *files: Any) -> None:
+        for f in files:
+            f.close()
+        for path in spill_dir.iterdir():
+            path.unlink()
+        spill_dir.rmdir()
+
+    def close(self) -> None:
+        """Delete the spilled states"""
+        self._finalizer()
+
+    def append(self, item: StateInfo | Action) -> None:
+        super().append(item)
+        if "observation" in item:
+            self._in_memory.append(len(self) - 1)
+            while len(self._in_memory) > self.max_states_in_memory:
+                self._spill(self._in_memory.pop(0))
+
+    def extend(self, items: Iterable[StateInfo | Action]) -> None:
+        for item in items:
+            self.append(item)
+
+    def __iadd__(  # type: ignore[override,misc]
+        self, items: Iterable[StateInfo | Action]
+    ) -> "MemoryBoundedTrajectory":
+        self.extend(items)
+        return self
+
+    def _rebalance(self) -> None:
+        """Find the states in memory again after the items have moved"""
+        self._in_memory = [
+            idx
+            for idx, item in enumerate(super().__iter__())
+            if not isinstance(item, _SpilledState) and "observation" in item
+        ]
+        while len(self._in_memory) > self.max_states_in_memory:
+            self._spill(self._in_memory.pop(0))
+
+    def insert(self, idx: SupportsIndex, item: StateInfo | Action) -> None:
+        super().insert(idx, item)
+        self._rebalance()
+
+    def pop(self, idx: SupportsIndex = -1) -> StateInfo | Action:
+        item = self[idx]
+        super().pop(idx)
+        self._rebalance()
+        return item
+
+    def remove(self, value: Any) -> None:
+        del self[self.index(value)]
+
+    def clear(self) -> None:
+        super().clear()
+        self._in_memory = []
+
+    def __setitem__(self, idx: Any, value: Any) -> None:
+        super().__setitem__(idx, value)
+        self._rebalance()
+
+    def __delitem__(self, idx: SupportsIndex | slice) -> None:
+        super().__delitem__(idx)
+        self._rebalance()
+
+    def __contains__(self, value: object) -> bool:
+        return any(item is value or item == value for item in self)
+
+    def index(
+        self,
+        value: Any,
+        start: SupportsIndex = 0,
+        stop: SupportsIndex = sys.maxsize,
+    ) -> int:
+        start, stop, _ = slice(start, stop).indices(len(self))
+        for idx in range(start, stop):
+            item = self[idx]
+            if item is value or item == value:
+                return idx
+        raise ValueError(f"{value!r} is not in the trajectory")
+
+    def count(self, value: Any) -> int:
+        return sum(item is value or item == value for item in self)
+
+    def copy(self) -> Trajectory:
+        return list(self)
+
+    def __add__(self, other: list[Any]) -> Trajectory:  # type: ignore[override]
+        return list(self) + list(other)
+
+    def __radd__(self, other: list[Any]) -> Trajectory:
+        return list(other) + list(self)
+
+    def __mul__(self, n: SupportsIndex) -> Trajectory:
+        return list(self) * n
+
+    def __rmul__(self, n: SupportsIndex) -> Trajectory:
+        return list(self) * n
+
+    def __eq__(self, other: object) -> bool:
+        return list(self) == other
+
+    def __ne__(self, other: object) -> bool:
+        return list(self) != other
+
+    def reverse(self) -> None:
+        super().reverse()
+        self._rebalance()
+
+    def _spill(self, idx: int) -> None:
+        state: StateInfo = super().__getitem__(idx)
+        observation = dict(state["observation"])
+        arrays = {}
+        for key, value in state["observation"].items():
+            if isinstance(value, np.ndarray):
+                value = np.ascontiguousarray(value)
+                arrays[key] = (
+                    self._array_file.tell(),
+                    value.dtype.str,
+                    value.shape,
+                )
+                self._array_file.write(value.data)
+                del observation[key]
+        self._array_file.flush()
+
+        data = pickle.dumps(
+            {"observation": observation, "info": state["info"]},
+            protocol=pickle.HIGHEST_PROTOCOL,
+        )
+        offset = self._state_file.tell()
+        self._state_file.write(data)
+        self._state_file.flush()
+        super().__setitem__(idx, _SpilledState(offset, len(data), arrays))
+
+    def _load(self, item: Any) -> Any:
+        if not isinstance(item, _SpilledState):
+            return item
+        self._state_reader.seek(item.offset)
+        state: StateInfo = pickle.loads(self._state_reader.read(item.length))
+        for key, (offset, dtype, shape) in item.arrays.items():
+            state["observation"][key] = np.memmap(
+                self._array_path,
+                dtype=np.dtype(dtype),
+                mode="r",
+                offset=offset,
+                shape=shape,
+            )
+        return state
+
+    @overload
+    def __getitem__(self, idx: SupportsIndex) -> StateInfo | Action:
+        ...
+
+    @overload
+    def __getitem__(self, idx: slice) -> Trajectory:
+        ...
+
+    def __getitem__(
+        self, idx: SupportsIndex | slice
+    ) -> StateInfo | Action | Trajectory:
+        if isinstance(idx, slice):
+            return [self._load(item) for item in super().__getitem__(idx)]
+        return self._load(super().__getitem__(idx))  # type: ignore[no-any-return]
+
+    def __iter__(self) -> Iterator[StateInfo | Action]:
+        for item in super().__iter__():
+            yield self._load(item)
+
+    def __reversed__(self) -> Iterator[StateInfo | Action]:
+        for item in super().__reversed__():
+            yield self._load(item)
@@ -0,0 +1,267 @@
+"""Structured, append-only log of the steps of each task
+
+Every task writes `result_dir/trajectories/<task_id>.jsonl`, one JSON record
+per line: a `task` record with the config, one `step` record per predicted
+action, then a `result` record, with the final answer and url that the
+task was scored on, or an `error` record. Screenshots are not stored in
+the log but as content-hashed files under `result_dir/images`. Records are
+flushed as they are written, so the log of an interrupted task is readable.
+
+The log can be converted into the html render (`trajectory_log_to_html`)
+and into the messages of `json_dump.json` (`trajectory_log_to_messages`).
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Any, Iterator, TypedDict
+
+from browser_env.actions import Action, action2str
+from browser_env.helper_functions import (
+    HTML_HEAD,
+    HTML_TAIL,
+    ScreenshotWriter,
+    format_render_action,
+    format_render_config,
+    format_render_step,
+    get_render_parsed_action,
+)
+from browser_env.utils import StateInfo
+
+
+class StepRecord(TypedDict):
+    type: str
+    step: int
+    url: str
+    observation: str
+    # path of the screenshot relative to the result dir
+    screenshot: str | None
+    previous_action: str
+    action_type: str
+    raw_prediction: str
+    action_repr: str
+    # the action with the full text of its target element
+    parsed_action: str
+    # the action as written into the action history of the prompt
+    action_description: str
+    pw_code: str
+    # the answer of a stop action
+    answer: str
+    prompt_stats: dict[str, int]
+    # seconds the environment took to produce the observation and the
+    # agent took to predict the action
+    timings: dict[str, float]
+
+
+def get_trajectory_log_path(result_dir: str | Path, task_id: int) -> Path:
+    return Path(result_dir) / "trajectories" / f"{task_id}.jsonl"
+
+
+class TrajectoryLogger(object):
+    """Write the trajectory log of one task"""
+
+    def __init__(
+        self,
+        config_file: str,
+        result_dir: str,
+        action_set_tag: str,
+        screenshot_writer: ScreenshotWriter | None = None,
+    ) -> None:
+        with open(config_file, "r") as f:
+            config = json.load(f)
+        self.task_id: int = config["task_id"]
+        self.action_set_tag = action_set_tag
+        self.result_dir = Path(result_dir)
+        self._owns_writer = screenshot_writer is None
+        self.screenshot_writer = screenshot_writer or ScreenshotWriter(
+            self.result_dir / "images"
+        )
+        self.num_steps = 0
+
+        log_path = get_trajectory_log_path(result_dir, self.task_id)
+        log_path.parent.mkdir(parents=True, exist_ok=True)
+        self.log_file = open(log_path, "w")
+        self.write(
+            {
+                "type": "task",
+                "task_id": self.task_id,
+                "action_set_tag": action_set_tag,
+                "config": config,
+            }
+        )
+
+    def write(self, record: dict[str, Any]) -> None:
+        record["time"] = time.time()
+        self.log_file.write(json.dumps(record) + "\n")
+        self.log_file.flush()
+
+    def log_step(
+        self,
+        action: Action,
+        state_info: StateInfo,
+        meta_data: dict[str, Any],
+        action_description: str,
+        screenshot: bool = False,
+        prompt_stats: dict[str, int] | None = None,
+        timings: dict[str, float] | None = None,
+    ) -> None:
+        observation = state_info["observation"]
+        info = state_info["info"]
+        screenshot_path = None
+        if screenshot:
+            image_path = self.screenshot_writer.write(
+                observation["image"]  # type: ignore[arg-type]
+            )
+            screenshot_path = image_path.relative_to(
+                self.result_dir
+            ).as_posix()
+        if self.action_set_tag == "id_accessibility_tree":
+            parsed_action = get_render_parsed_action(
+                action, info["observation_metadata"], self.action_set_tag
+            )
+        else:
+            parsed_action = action2str(action, self.action_set_tag)
+
+        record: StepRecord = {
+            "type": "step",
+            "step": self.num_steps,
+            "url": info["page"].url,
+            "observation": observation["text"],  # type: ignore[typeddict-item]
+            "screenshot": screenshot_path,
+            "previous_action": meta_data["action_history"][-1],
+            "action_type": str(action["action_type"]),
+            "raw_prediction": action["raw_prediction"],
+            "action_repr": repr(action),
+            "parsed_action": parsed_action,
+            "action_description": action_description,
+            "pw_code": action["pw_code"],
+            "answer": action["answer"],
+            "prompt_stats": prompt_stats or {},
+            "timings": timings or {},
+        }
+        self.write(dict(record))
+        self.num_steps += 1
+
+    def log_result(
+        self, score: float, answer: str | None = None, url: str | None = None
+    ) -> None:
+        self.write(
+            {
+                "type": "result",
+                "score": score,
+                "num_steps": self.num_steps,
+                "answer": answer,
+                "url": url,
+            }
+        )
+
+    def log_error(self, error: str, traceback: str) -> None:
+        self.write({"type": "error", "error": error, "traceback": traceback})
+
+    def close(self) -> None:
+        if self._owns_writer:
+            self.screenshot_writer.close()
+        self.log_file.close()
+
+
+def read_trajectory_log(log_path: str | Path) -> Iterator[dict[str, Any]]:
+    """Iterate over the records, a partially written last line is skipped"""
+    with open(log_path, "r") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            yield json.loads(line)
+
+
+def trajectory_log_to_html(log_path: str | Path) -> str:
+    """Return the html render of the log, as written by `RenderHelper`
+
+    Screenshot paths are relative to the result dir.
+    """
+    html = HTML_HEAD
+    action_set_tag = ""
+    for record in read_trajectory_log(log_path):
+        match record["type"]:
+            case "task":
+                action_set_tag = record["action_set_tag"]
+                html += format_render_config(record["config"])
+            case "step":
+                if action_set_tag == "id_accessibility_tree":
+                    action_str = format_render_action(
+                        record["raw_prediction"],
+                        record["action_repr"],
+                        record["parsed_action"],
+                    )
+                else:
+                    action_str = record["pw_code"]
+                html += format_render_step(
+                    record["url"],
+                    record["observation"],
+                    record["screenshot"],
+                    record["previous_action"],
+                    action_str,
+                )
+    return html + HTML_TAIL
+
+
+def trajectory_log_to_messages(
+    log_path: str | Path,
+) -> tuple[list[dict[str, str | None]], bool]:
+    """Return the messages of the task in `json_dump.json` and its success"""
+    log_path = Path(log_path)
+    messages: list[dict[str, str | None]] = []
+    success = False
+    for record in read_trajectory_log(log_path):
+        match record["type"]:
+            case "step":
+                image = None
+                if record["screenshot"] is not None:
+                    image = (
+                        log_path.parents[1] / record["screenshot"]
+                    ).as_posix()
+                messages.append(
+                    {
+                        "user": f"URL: {record['url']}\n\nobservation:\n{record['observation']}",
+                        "image": image,
+                    }
+                )
+                messages.append(
+                    {
+                        "assistant": record["raw_prediction"]
+                        or record["parsed_action"]
+                    }
+                )
+            case "result":
+                success = record["score"] == 1
+    return messages, success
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Render the trajectory logs of a result dir to html"
+    )
+    parser.add_argument("--result_dir", type=str, required=True)
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Replace the renders already in the result dir, e.g. those saved during the run",
+    )
+    args = parser.parse_args()
+
+    skipped = []
+    for log_path in sorted(Path(args.result_dir).glob("trajectories/*.jsonl")):
+        # the screenshot paths are relative to the result dir
+        render_path = Path(args.result_dir) / f"render_{log_path.stem}.html"
+        if render_path.exists() and not args.overwrite:
+            skipped.append(log_path.stem)
+            continue
+        with open(render_path, "w") as f:
+            f.write(trajectory_log_to_html(log_path))
+    if skipped:
+        print(
+            f"Kept the existing renders of {len(skipped)} tasks, use --overwrite to replace them: {skipped}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -4,3 +4,4 @@ from .helper_functions import (
     shopping_get_sku_latest_review_author,
     shopping_get_sku_latest_review_rating,
 )
+from .llm_judge import LLMJudge, get_llm_judge
@@ -0,0 +1,250 @@
+"""Evaluation plans, the eval config of a task compiled once
+
+Evaluating a trajectory used to work through the eval config of its task
+again: the `func:` helper calls of program_html went through `eval`, the
+JS of the locators was assembled, and the references were cleaned and
+tokenized at every comparison. A plan holds the result of that work. It
+is compiled once per distinct eval config and shared by the evaluations
+of every trajectory of the task.
+
+Helper calls are parsed with `ast`. They may only call the helpers of
+`HELPERS`, with literal arguments, `__page__` for the page being checked
+and `__last_url__` in strings for the final url of the episode.
+"""
+import ast
+import functools
+import json
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from playwright.sync_api import Page
+
+from evaluation_harness.helper_functions import (
+    PseudoPage,
+    gitlab_get_project_memeber_role,
+    reddit_get_post_url,
+    shopping_get_latest_order_url,
+    shopping_get_sku_latest_review_author,
+    shopping_get_sku_latest_review_rating,
+)
+
+HELPERS: dict[str, Callable[..., Any]] = {
+    "gitlab_get_project_memeber_role": gitlab_get_project_memeber_role,
+    "reddit_get_post_url": reddit_get_post_url,
+    "shopping_get_latest_order_url": shopping_get_latest_order_url,
+    "shopping_get_sku_latest_review_author": shopping_get_sku_latest_review_author,
+    "shopping_get_sku_latest_review_rating": shopping_get_sku_latest_review_rating,
+}
+
+PAGE_PLACEHOLDER = "__page__"
+LAST_URL_PLACEHOLDER = "__last_url__"
+
+
+def word_tokenize(text: str) -> list[str]:
+    """nltk's word tokenizer, nltk is imported on first use"""
+    from nltk.tokenize import word_tokenize  # type: ignore
+
+    return word_tokenize(text)  # type: ignore[no-any-return]
+
+
+def clean_answer(answer: str) -> str:
+    answer = answer.strip()
+    if answer.startswith("'") and answer.endswith("'"):
+        answer = answer[1:-1]
+    elif answer.startswith('"') and answer.endswith('"'):
+        answer = answer[1:-1]
+    return answer.lower()
+
+
+class _PageArgument(object):
+    def __repr__(self) -> str:
+        return PAGE_PLACEHOLDER
+
+
+# the argument of a helper call that is replaced by the page
+PAGE_ARGUMENT = _PageArgument()
+
+
+@dataclass(frozen=True)
+class HelperCall:
+    name: str
+    args: tuple[Any, ...]
+
+    @classmethod
+    def parse(cls, source: str) -> "HelperCall":
+        """Parse e.g. `reddit_get_post_url('__last_url__')`"""
+        try:
+            node = ast.parse(source.strip(), mode="eval").body
+        except SyntaxError as e:
+            raise ValueError(f"Unsupported helper call: {source}") from e
+        if (
+            not isinstance(node, ast.Call)
+            or not isinstance(node.func, ast.Name)
+            or node.func.id not in HELPERS
+            or node.keywords
+        ):
+            raise ValueError(f"Unsupported helper call: {source}")
+        args: list[Any] = []
+        for arg in node.args:
+            if isinstance(arg, ast.Name) and arg.id == PAGE_PLACEHOLDER:
+                args.append(PAGE_ARGUMENT)
+                continue
+            try:
+                args.append(ast.literal_eval(arg))
+            except ValueError as e:
+                raise ValueError(
+                    f"Unsupported argument of helper call: {source}"
+                ) from e
+        return cls(node.func.id, tuple(args))
+
+    def __call__(
+        self, page: Page | PseudoPage | None = None, last_url: str = ""
+    ) -> Any:
+        args = [
+            page
+            if arg is PAGE_ARGUMENT
+            else arg.replace(LAST_URL_PLACEHOLDER, last_url)
+            if isinstance(arg, str)
+            else arg
+            for arg in self.args
+        ]
+        return HELPERS[self.name](*args)
+
+
+def is_js_locator(locator: str) -> bool:
+    return locator.startswith("document.") or locator.startswith(
+        "[...document."
+    )
+
+
+@dataclass(frozen=True)
+class HTMLTarget:
+    """A program_html target, what to select and what it must contain"""
+
+    # "last" for the current page, a url, or the helper call returning it
+    url: str | HelperCall
+    # "page" for the full page, "js" or "func"
+    kind: str
+    locator: str
+    helper: HelperCall | None
+    # the JS locator as one statement of a batched `page.evaluate`
+    js_statement: str
+    prep_scripts: tuple[str, ...]
+    # cleaned references, the exact match or the alternatives of each
+    # content that must be included
+    exact_match: str | None
+    must_include: tuple[tuple[str, ...], ...]
+
+    @classmethod
+    def compile(cls, target: dict[str, Any]) -> "HTMLTarget":
+        url: str | HelperCall = target["url"]
+        if target["url"].startswith("func"):
+            url = HelperCall.parse(target["url"].split("func:")[1])
+
+        locator: str = target["locator"]
+        helper = None
+        js_statement = ""
+        if not locator.strip():
+            kind = "page"
+        elif is_js_locator(locator):
+            kind = "js"
+            js_statement = (
+                f"try {{ results.push([true, await ({locator})]); }} "
+                "catch (e) { results.push([false, null]); }\n"
+            )
+        elif locator.startswith("func:"):
+            kind = "func"
+            helper = HelperCall.parse(locator.split("func:")[1])
+        else:
+            raise ValueError(f"Unknown locator: {locator}")
+
+        required_contents = target["required_contents"]
+        exact_match = None
+        must_include: list[tuple[str, ...]] = []
+        if "exact_match" in required_contents:
+            exact_match = clean_answer(required_contents["exact_match"])
+        elif "must_include" in required_contents:
+            assert isinstance(required_contents["must_include"], list)
+            must_include = [
+                tuple(clean_answer(c) for c in content.split(" |OR| "))
+                for content in required_contents["must_include"]
+            ]
+        else:
+            raise ValueError(
+                f"Unknown required_contents: {required_contents.keys()}"
+            )
+
+        return cls(
+            url=url,
+            kind=kind,
+            locator=locator,
+            helper=helper,
+            js_statement=js_statement,
+            prep_scripts=tuple(
+                f"() => {prep_action}"
+                for prep_action in target.get("prep_actions", [])
+            ),
+            exact_match=exact_match,
+            must_include=tuple(must_include),
+        )
+
+    def score(self, selected_element: str) -> float:
+        """Whether the selected element has the required contents"""
+        pred = clean_answer(selected_element)
+        if self.exact_match is not None:
+            return float(pred == self.exact_match)
+        return float(
+            all(
+                any(alternative in pred for alternative in alternatives)
+                for alternatives in self.must_include
+            )
+        )
+
+
+@dataclass(frozen=True)
+class EvalPlan:
+    # cleaned reference answers
+    exact_match: str | None
+    # cleaned phrases, and whether each is compared to the tokens of the
+    # answer rather than to the answer itself
+    must_include: tuple[tuple[str, bool], ...]
+    program_html: tuple[HTMLTarget, ...]
+
+    @classmethod
+    def compile(cls, eval_config: dict[str, Any]) -> "EvalPlan":
+        reference_answers = eval_config.get("reference_answers") or {}
+        exact_match = None
+        if "exact_match" in reference_answers:
+            exact_match = clean_answer(reference_answers["exact_match"])
+        must_include = []
+        if "must_include" in reference_answers:
+            values = reference_answers["must_include"]
+            assert isinstance(values, list)
+            for value in values:
+                ref = clean_answer(value)
+                # a single character is looked up among the tokens of the
+                # answer, e.g. "0" is not included in "10"
+                tokenize = (
+                    len(values) == 1
+                    and len(ref) == 1
+                    and len(word_tokenize(ref)) == 1
+                )
+                must_include.append((ref, tokenize))
+        return cls(
+            exact_match=exact_match,
+            must_include=tuple(must_include),
+            program_html=tuple(
+                HTMLTarget.compile(target)
+                for target in eval_config.get("program_html") or []
+            ),
+        )
+
+
+@functools.lru_cache(maxsize=4096)
+def _compile_eval_plan(eval_config: str) -> EvalPlan:
+    return EvalPlan.compile(json.loads(eval_config))
+
+
+def get_eval_plan(configs: dict[str, Any]) -> EvalPlan:
+    """The plan of the eval config of a task, compiled once per config"""
+    return _compile_eval_plan(json.dumps(configs["eval"], sort_keys=True))
@@ -4,32 +4,60 @@ import collections
 import html
 import importlib
 import json
-import time
 import urllib
 from pathlib import Path
 from typing import Any, Tuple, Union
 
 from beartype import beartype
-from nltk.tokenize import word_tokenize  # type: ignore
 from playwright.sync_api import CDPSession, Page
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
 
 from browser_env.actions import Action
 from browser_env.utils import StateInfo
+from evaluation_harness.eval_plan import (
+    HelperCall,
+    HTMLTarget,
+    clean_answer,
+    get_eval_plan,
+    word_tokenize,
+)
 from evaluation_harness.helper_functions import (
     PseudoPage,
-    gitlab_get_project_memeber_role,
+    get_fuzzy_match_messages,
+    get_shopping_client,
+    get_ua_match_messages,
     llm_fuzzy_match,
     llm_ua_match,
-    reddit_get_post_url,
-    shopping_get_latest_order_url,
-    shopping_get_sku_latest_review_author,
-    shopping_get_sku_latest_review_rating,
 )
 
 Trajectory = list[Union[Action, StateInfo]]
 
+# longest wait for the network of a page to settle after it loaded
+NETWORK_IDLE_TIMEOUT_MS = 3000
+
+
+def load_config(config_file: Path | str | dict[str, Any]) -> dict[str, Any]:
+    """Return the task config, parsing the file unless it is already parsed"""
+    if isinstance(config_file, dict):
+        return config_file
+    with open(config_file, "r") as f:
+        configs: dict[str, Any] = json.load(f)
+    return configs
+
+
+# relative cost of the evaluators, EvaluatorComb runs the cheap ones first
+STRING_MATCH_COST = 0
+URL_MATCH_COST = 1
+PROGRAM_HTML_COST = 2
+LLM_JUDGE_COST = 3
+
+# reference answers that StringEvaluator checks with an LLM judge
+LLM_APPROACHES = ["fuzzy_match"]
+
 
 class Evaluator(object):
+    cost = STRING_MATCH_COST
+
     def __init__(self, eval_tag: str = "") -> None:
         self.eval_tag = eval_tag
 
@@ -37,9 +65,9 @@ class Evaluator(object):
     def __call__(
         self,
         trajectory: Trajectory,
-        config_file: Path | str,
+        config_file: Path | str | dict[str, Any],
         page: Page | PseudoPage,
-        client: CDPSession,
+        client: CDPSession | None = None,
     ) -> float:
         raise NotImplementedError
 
@@ -73,17 +101,23 @@ class StringEvaluator(Evaluator):
     exact match: the answer is exactly the same as the reference answer
     must include: each phrase in the reference answer must be included in the answer
     fuzzy match: the answer is similar to the reference answer, using LLM judge
+
+    With `approaches`, only the reference answers of these approaches are
+    checked.
     """
 
+    def __init__(
+        self, eval_tag: str = "", approaches: list[str] | None = None
+    ) -> None:
+        super().__init__(eval_tag)
+        self.approaches = approaches
+        if approaches is None or set(approaches) & set(LLM_APPROACHES):
+            self.cost = LLM_JUDGE_COST
+
     @staticmethod
     @beartype
     def clean_answer(answer: str) -> str:
-        answer = answer.strip()
-        if answer.startswith("'") and answer.endswith("'"):
-            answer = answer[1:-1]
-        elif answer.startswith('"') and answer.endswith('"'):
-            answer = answer[1:-1]
-        return answer.lower()
+        return clean_answer(answer)
 
     @staticmethod
     @beartype
@@ -123,30 +157,36 @@ class StringEvaluator(Evaluator):
     def __call__(
         self,
         trajectory: Trajectory,
-        config_file: Path | str,
+        config_file: Path | str | dict[str, Any],
         page: Page | PseudoPage | None = None,
         client: CDPSession | None = None,
     ) -> float:
-        with open(config_file, "r") as f:
-            configs = json.load(f)
-
+        configs = load_config(config_file)
         last_action = self.get_last_action(trajectory)
-        pred = self.clean_answer(last_action["answer"])
+        return self.score_answer(last_action["answer"], configs)
+
+    def score_answer(self, answer: str, configs: dict[str, Any]) -> float:
+        """Score the final answer of the agent, without the browser"""
+        plan = get_eval_plan(configs)
+        pred = self.clean_answer(answer)
 
         score = 1.0
         for approach, value in configs["eval"]["reference_answers"].items():
+            if self.approaches is not None and approach not in self.approaches:
+                continue
             match approach:
                 case "exact_match":
-                    score *= self.exact_match(ref=value, pred=pred)
+                    score *= float(clean_answer(pred) == plan.exact_match)
 
                 case "must_include":
-                    assert isinstance(value, list)
-                    for must_value in value:
-                        score *= self.must_include(
-                            ref=must_value,
-                            pred=pred,
-                            tokenize=(len(value) == 1),
-                        )
+                    clean_pred = clean_answer(pred)
+                    for ref, tokenize in plan.must_include:
+                        if tokenize:
+                            score *= float(ref in word_tokenize(clean_pred))
+                        else:
+                            score *= float(ref in clean_pred)
+                        if score == 0:
+                            break
                 case "fuzzy_match":
                     intent = configs["intent"]
                     if value == "N/A":
@@ -164,25 +204,63 @@ class StringEvaluator(Evaluator):
                     else:
                         assert isinstance(value, list)
                         for reference in value:
+                            # no judge call once the answer failed
+                            if score == 0:
+                                break
                             score *= self.fuzzy_match(
                                 ref=reference, pred=pred, intent=intent
                             )
         return score
 
 
+def get_judge_messages(
+    trajectory: Trajectory, config_file: Path | str | dict[str, Any]
+) -> list[list[dict[str, str]]]:
+    """The questions that evaluating the answer may ask the LLM judge
+
+    Judging those of many tasks at once with `get_llm_judge().judge_many`
+    batches the requests, the evaluation then finds the verdicts cached.
+    """
+    configs = load_config(config_file)
+    reference_answers = configs["eval"].get("reference_answers") or {}
+    if "fuzzy_match" not in reference_answers:
+        return []
+    last_action = Evaluator.get_last_action(trajectory)
+    pred = StringEvaluator.clean_answer(last_action["answer"])
+    value = reference_answers["fuzzy_match"]
+    if value == "N/A":
+        if StringEvaluator.exact_match(ref=value, pred=pred) == 1:
+            return []
+        return [
+            get_ua_match_messages(
+                pred, configs["eval"]["string_note"], configs["intent"]
+            )
+        ]
+    return [
+        get_fuzzy_match_messages(pred, reference, configs["intent"])
+        for reference in value
+    ]
+
+
 class URLEvaluator(Evaluator):
     """Check URL matching"""
 
+    cost = URL_MATCH_COST
+
     @beartype
     def __call__(
         self,
         trajectory: Trajectory,
-        config_file: Path | str,
+        config_file: Path | str | dict[str, Any],
         page: Page | PseudoPage,
         client: CDPSession | None = None,
     ) -> float:
-        with open(config_file, "r") as f:
-            configs = json.load(f)
+        configs = load_config(config_file)
+        return self.score_url(page.url, configs)
+
+    @staticmethod
+    def score_url(url: str, configs: dict[str, Any]) -> float:
+        """Score the final url of the agent, without the browser"""
 
         def clean_url(url: str) -> str:
             url = str(url)
@@ -209,7 +287,7 @@ class URLEvaluator(Evaluator):
                     queries[k].update(v)
             return base_paths, queries
 
-        pred = clean_url(page.url)
+        pred = clean_url(url)
         ref_urls = configs["eval"]["reference_url"].split(" |OR| ")
         ref_urls = [clean_url(url) for url in ref_urls]
         matching_rule = configs["eval"].get("url_note", "GOLD in PRED")
@@ -244,126 +322,266 @@ class URLEvaluator(Evaluator):
 class HTMLContentEvaluator(Evaluator):
     """Check whether the contents appear in the page"""
 
+    cost = PROGRAM_HTML_COST
+
+    def __init__(self, eval_tag: str = "") -> None:
+        super().__init__(eval_tag)
+        # elements of the "last" targets and the url of every target, see
+        # `select_last_page`
+        self.last_page_elements: list[str] | None = None
+        self.target_urls: list[str] | None = None
+
+    @staticmethod
+    def open_pages(
+        page: Page | PseudoPage, urls: list[str]
+    ) -> dict[str, Page]:
+        """Open every url in a new page of the context, all loading at once"""
+        pages = {}
+        try:
+            for url in urls:
+                pages[url] = page.context.new_page()
+                # returns once the navigation starts, the pages load in
+                # parallel
+                pages[url].goto(url, wait_until="commit")
+            for new_page in pages.values():
+                new_page.wait_for_load_state("load")
+                try:
+                    # let the scripts of the page render its contents
+                    new_page.wait_for_load_state(
+                        "networkidle", timeout=NETWORK_IDLE_TIMEOUT_MS
+                    )
+                except PlaywrightTimeoutError:
+                    pass
+        except Exception:
+            for new_page in pages.values():
+                new_page.close()
+            raise
+        return pages
+
+    @staticmethod
+    def evaluate_locators(
+        page: Page | PseudoPage, targets: list[HTMLTarget]
+    ) -> list[str]:
+        """Evaluate the JS locators of the targets in a single `page.evaluate`
+
+        A locator that throws selects an empty string, as when evaluated
+        on its own.
+        """
+        if not targets:
+            return []
+        body = "".join(target.js_statement for target in targets)
+        try:
+            results = page.evaluate(
+                f"async () => {{ const results = [];\n{body}return results; }}"
+            )
+        except Exception:
+            # e.g. a value that cannot be serialized, one locator at a time
+            results = []
+            for target in targets:
+                try:
+                    results.append(
+                        [True, page.evaluate(f"() => {target.locator}")]
+                    )
+                except Exception:
+                    results.append([False, None])
+        return [str(value) if ok else "" for ok, value in results]
+
+    @staticmethod
+    def select_elements(
+        page: Page | PseudoPage, targets: list[HTMLTarget]
+    ) -> list[str]:
+        """Select the element of each target, all on the same page"""
+        selected: list[str | None] = [None] * len(targets)
+        # targets with prep actions change the page, the JS locators of the
+        # targets before them are evaluated first
+        pending: list[int] = []
+
+        def flush() -> None:
+            values = HTMLContentEvaluator.evaluate_locators(
+                page, [targets[i] for i in pending]
+            )
+            for i, value in zip(pending, values):
+                selected[i] = value
+            pending.clear()
+
+        for i, target in enumerate(targets):
+            match target.kind:
+                # empty locator, use the full page
+                case "page":
+                    flush()
+                    selected[i] = page.content()
+                # use JS to select the element
+                case "js":
+                    if target.prep_scripts:
+                        flush()
+                        try:
+                            for prep_script in target.prep_scripts:
+                                page.evaluate(prep_script)
+                        except Exception:
+                            pass
+                    pending.append(i)
+                # a helper function, e.g. calling an API
+                case "func":
+                    assert target.helper is not None
+                    flush()
+                    selected[i] = target.helper(page=page)
+        flush()
+        return [value or "" for value in selected]
+
+    @staticmethod
+    def get_target_urls(
+        targets: tuple[HTMLTarget, ...], last_url: str
+    ) -> list[str]:
+        """Which url to check for each target, "last" for the current page
+
+        The helper calls, e.g. the url of the latest order, are resolved
+        against the current state of the sites.
+        """
+        return [
+            target.url(last_url=last_url)
+            if isinstance(target.url, HelperCall)
+            else target.url
+            for target in targets
+        ]
+
+    def select_last_page(
+        self, config_file: Path | str | dict[str, Any], page: Page | PseudoPage
+    ) -> None:
+        """Select the elements of the "last" targets on the page now
+
+        The urls of the other targets are resolved now as well. The
+        evaluation may then run later, on a page of another browser with the
+        final url of the episode, which opens those urls, after the next
+        episode changed the sites.
+        """
+        plan = get_eval_plan(load_config(config_file))
+        get_shopping_client().clear_cache()
+        self.target_urls = self.get_target_urls(plan.program_html, page.url)
+        self.last_page_elements = self.select_elements(
+            page, [t for t in plan.program_html if t.url == "last"]
+        )
+
     @beartype
     def __call__(
         self,
         trajectory: Trajectory,
-        config_file: Path | str,
+        config_file: Path | str | dict[str, Any],
         page: Page | PseudoPage,
         client: CDPSession | None = None,
     ) -> float:
-        with open(config_file, "r") as f:
-            configs = json.load(f)
+        targets = get_eval_plan(load_config(config_file)).program_html
+        # the API responses of a previous evaluation may be stale
+        get_shopping_client().clear_cache()
+
+        target_urls = (
+            self.get_target_urls(targets, page.url)
+            if self.target_urls is None
+            else self.target_urls
+        )
 
-        targets = configs["eval"]["program_html"]
+        # check the targets of each url together, the other urls in pages
+        # of their own that load concurrently
+        targets_of_url: dict[str, list[int]] = collections.defaultdict(list)
+        for i, target_url in enumerate(target_urls):
+            targets_of_url[target_url].append(i)
+        pages = self.open_pages(
+            page, [url for url in targets_of_url if url != "last"]
+        )
+        selected_elements: list[str] = [""] * len(targets)
+        try:
+            for target_url, indices in targets_of_url.items():
+                if (
+                    target_url == "last"
+                    and self.last_page_elements is not None
+                ):
+                    values = self.last_page_elements
+                else:
+                    values = self.select_elements(
+                        page if target_url == "last" else pages[target_url],
+                        [targets[i] for i in indices],
+                    )
+                for i, value in zip(indices, values):
+                    selected_elements[i] = value
+        finally:
+            for new_page in pages.values():
+                new_page.close()
 
         score = 1.0
-        for target in targets:
-            target_url: str = target["url"]  # which url to check
-            if target_url.startswith("func"):
-                func = target_url.split("func:")[1]
-                func = func.replace("__last_url__", page.url)
-                target_url = eval(func)
-
-            locator: str = target["locator"]  # js element locator
-
-            # navigate to that url
-            if target_url != "last":
-                page.goto(target_url)
-                time.sleep(3)  # TODO [shuyanzh]: fix this hard-coded sleep
-
-            # empty, use the full page
-            if not locator.strip():
-                selected_element = page.content()
-            # use JS to select the element
-            elif locator.startswith("document.") or locator.startswith(
-                "[...document."
-            ):
-                if "prep_actions" in target:
-                    try:
-                        for prep_action in target["prep_actions"]:
-                            page.evaluate(f"() => {prep_action}")
-                    except Exception:
-                        pass
-                try:
-                    selected_element = str(page.evaluate(f"() => {locator}"))
-                    if not selected_element:
-                        selected_element = ""
-                except Exception:
-                    # the page is wrong, return empty
-                    selected_element = ""
-            # run program to call API
-            elif locator.startswith("func:"):  # a helper function
-                func = locator.split("func:")[1]
-                func = func.replace("__page__", "page")
-                selected_element = eval(func)
-            else:
-                raise ValueError(f"Unknown locator: {locator}")
-
-            selected_element = html.unescape(selected_element)
-
-            if "exact_match" in target["required_contents"]:
-                required_contents = target["required_contents"]["exact_match"]
-                cur_score = StringEvaluator.exact_match(
-                    ref=required_contents, pred=selected_element
-                )
-                score *= float(cur_score)
-                # print(f"[exact match] {cur_score}, selected element: {selected_element}, required contents: {required_contents}")
-            elif "must_include" in target["required_contents"]:
-                required_contents = target["required_contents"]["must_include"]
-                assert isinstance(required_contents, list)
-                for content in required_contents:
-                    content_or = content.split(" |OR| ")
-                    cur_score = any(
-                        [
-                            StringEvaluator.must_include(
-                                ref=content,
-                                pred=selected_element,
-                                tokenize=False,
-                            )
-                            for content in content_or
-                        ]
-                    )
-                    score *= float(cur_score)
-                    # print(f"[must include] {cur_score}, selected element: {selected_element}, required contents: {content_or}")
-            else:
-                raise ValueError(
-                    f"Unknown required_contents: {target['required_contents'].keys()}"
-                )
+        for target, selected_element in zip(targets, selected_elements):
+            score *= target.score(html.unescape(selected_element))
         return score
 
 
 class EvaluatorComb:
-    def __init__(self, evaluators: list[Evaluator]) -> None:
-        self.evaluators = evaluators
+    """Product of the scores of the evaluators
+
+    The evaluators run from the cheapest to the most expensive and stop at
+    the first zero score, unless `evaluate_all` is set, e.g. to diagnose
+    which evaluators a task fails. `scores` holds the class name and the
+    score of each evaluator that ran.
+    """
+
+    def __init__(
+        self, evaluators: list[Evaluator], evaluate_all: bool = False
+    ) -> None:
+        # stable, evaluators of the same cost keep their order
+        self.evaluators = sorted(evaluators, key=lambda e: e.cost)
+        self.evaluate_all = evaluate_all
+        self.scores: list[tuple[str, float]] = []
 
     @beartype
     def __call__(
         self,
         trajectory: Trajectory,
-        config_file: Path | str,
+        config_file: Path | str | dict[str, Any],
         page: Page | PseudoPage,
-        client: CDPSession,
+        client: CDPSession | None = None,
     ) -> float:
+        # parse the config once for all the evaluators
+        configs = load_config(config_file)
+        self.scores = []
         score = 1.0
         for evaluator in self.evaluators:
-            cur_score = evaluator(trajectory, config_file, page, client)
+            cur_score = evaluator(trajectory, configs, page, client)
+            self.scores.append((type(evaluator).__name__, cur_score))
             score *= cur_score
+            if score == 0 and not self.evaluate_all:
+                break
         return score
 
+    def select_last_page(
+        self, config_file: Path | str | dict[str, Any], page: Page | PseudoPage
+    ) -> None:
+        """Capture what the evaluators need of the current page
+
+        Afterwards the evaluation only needs a page with the final url, of
+        any browser whose context has the cookies of the episode.
+        """
+        for evaluator in self.evaluators:
+            if isinstance(evaluator, HTMLContentEvaluator):
+                evaluator.select_last_page(config_file, page)
+
 
 @beartype
-def evaluator_router(config_file: Path | str) -> EvaluatorComb:
+def evaluator_router(
+    config_file: Path | str | dict[str, Any], evaluate_all: bool = False
+) -> EvaluatorComb:
     """Router to get the evaluator class"""
-    with open(config_file, "r") as f:
-        configs = json.load(f)
+    configs = load_config(config_file)
 
     eval_types = configs["eval"]["eval_types"]
     evaluators: list[Evaluator] = []
     for eval_type in eval_types:
         match eval_type:
             case "string_match":
-                evaluators.append(StringEvaluator())
+                # the string matches run first, the LLM judge last
+                approaches = list(configs["eval"]["reference_answers"])
+                cheap = [a for a in approaches if a not in LLM_APPROACHES]
+                judged = [a for a in approaches if a in LLM_APPROACHES]
+                if cheap:
+                    evaluators.append(StringEvaluator(approaches=cheap))
+                if judged:
+                    evaluators.append(StringEvaluator(approaches=judged))
             case "url_match":
                 evaluators.append(URLEvaluator())
             case "program_html":
@@ -371,4 +589,4 @@ def evaluator_router(config_file: Path | str) -> EvaluatorComb:
             case _:
                 raise ValueError(f"eval_type {eval_type} is not supported")
 
-    return EvaluatorComb(evaluators)
+    return EvaluatorComb(evaluators, evaluate_all=evaluate_all)
@@ -1,9 +1,10 @@
 """Implements helper functions to assist evaluation cases where other evaluators are not suitable."""
 import json
+import threading
+import time
 from typing import Any
 from urllib.parse import urlparse
 
-import requests
 from playwright.sync_api import CDPSession, Page
 
 from browser_env.env_config import (
@@ -15,45 +16,114 @@ from browser_env.env_config import (
     SHOPPING_ADMIN,
     WIKIPEDIA,
 )
-from llms.providers.openai_utils import (
-    generate_from_openai_chat_completion,
-)
+from evaluation_harness.llm_judge import get_llm_judge
 
 
-def shopping_get_auth_token() -> str:
-    response = requests.post(
-        url=f"{SHOPPING}/rest/default/V1/integration/admin/token",
-        headers={"content-type": "application/json"},
-        data=json.dumps(
-            {
-                "username": ACCOUNTS["shopping_site_admin"]["username"],
-                "password": ACCOUNTS["shopping_site_admin"]["password"],
-            }
-        ),
+class ShoppingAPIClient(object):
+    """Client of the REST API of the shopping site
+
+    One pooled session serves all the requests, and the admin token is
+    reused until it expires or the site rejects it. GET responses are
+    memoized until `clear_cache`, which the evaluators call before each
+    evaluation since the agent may have changed the site since. The client
+    is not thread safe, `get_shopping_client` gives each thread its own.
+    """
+
+    def __init__(
+        self,
+        base_url: str = SHOPPING,
+        token_ttl: float = 3600.0,
+        timeout: float = 30.0,
+    ) -> None:
+        self.base_url = base_url
+        # Magento admin tokens are valid for 4 hours by default
+        self.token_ttl = token_ttl
+        self.timeout = timeout
+        import requests
+
+        self.session = requests.Session()
+        self._token = ""
+        self._token_expires = 0.0
+        self._cache: dict[tuple[str, tuple[tuple[str, str], ...]], Any] = {}
+
+    def get_token(self, refresh: bool = False) -> str:
+        if refresh or not self._token or time.time() >= self._token_expires:
+            response = self.session.post(
+                url=f"{self.base_url}/rest/default/V1/integration/admin/token",
+                headers={"content-type": "application/json"},
+                data=json.dumps(
+                    {
+                        "username": ACCOUNTS["shopping_site_admin"][
+                            "username"
+                        ],
+                        "password": ACCOUNTS["shopping_site_admin"][
+                            "password"
+                        ],
+                    }
+                ),
+                timeout=self.timeout,
+            )
+            self._token = response.json()
+            self._token_expires = time.time() + self.token_ttl
+        return self._token
+
+    def get(self, path: str, params: dict[str, str] | None = None) -> Any:
+        """GET `path` of the REST API as the admin, return the JSON body"""
+        key = (path, tuple(sorted((params or {}).items())))
+        if key in self._cache:
+            return self._cache[key]
+        for refresh in (False, True):
+            response = self.session.get(
+                f"{self.base_url}/rest/V1/{path}",
+                params=params,
+                headers={
+                    "Authorization": f"Bearer {self.get_token(refresh)}",
+                    "Content-Type": "application/json",
+                },
+                timeout=self.timeout,
+            )
+            # the token was revoked or has expired early, log in again
+            if response.status_code != 401:
+                break
+        assert (
+            response.status_code == 200
+        ), f"GET {path} returned {response.status_code}"
+        self._cache[key] = response.json()
+        return self._cache[key]
+
+    def clear_cache(self) -> None:
+        self._cache.clear()
+
+
+_shopping_clients = threading.local()
+
+
+def get_shopping_client() -> ShoppingAPIClient:
+    """Return the client of the current thread
+
+    The evaluation stage evaluates in a thread of its own while the worker
+    selects the elements of its next task, each with its own client.
+    """
+    client: ShoppingAPIClient | None = getattr(
+        _shopping_clients, "client", None
     )
-    token: str = response.json()
-    return token
+    if client is None:
+        client = _shopping_clients.client = ShoppingAPIClient()
+    return client
 
 
-def shopping_get_latest_order_url() -> str:
-    """Get the latest order url from the shopping website."""
+def shopping_get_auth_token() -> str:
+    return get_shopping_client().get_token()
 
-    header = {
-        "Authorization": f"Bearer {shopping_get_auth_token()}",
-        "Content-Type": "application/json",
-    }
 
+def shopping_get_latest_order_url() -> str:
+    """Get the latest order url from the shopping website."""
     params = {
         "searchCriteria[sortOrders][0][field]": "created_at",
         "searchCriteria[sortOrders][0][direction]": "DESC",
         "searchCriteria[pageSize]": "1",
     }
-
-    response = requests.get(
-        f"{SHOPPING}/rest/V1/orders", params=params, headers=header
-    )
-    assert response.status_code == 200
-    response_obj = response.json()["items"][0]
+    response_obj = get_shopping_client().get("orders", params)["items"][0]
     order_id = int(response_obj["increment_id"])
     order_url = f"{SHOPPING}/sales/order/view/order_id/{order_id}/"
     return order_url
@@ -61,15 +131,7 @@ def shopping_get_latest_order_url() -> str:
 
 def shopping_get_sku_latest_review_author(sku: str) -> str:
     """Get the latest review for shopping admin."""
-    header = {
-        "Authorization": f"Bearer {shopping_get_auth_token()}",
-        "Content-Type": "application/json",
-    }
-    response = requests.get(
-        f"{SHOPPING}/rest/V1/products/{sku}/reviews", headers=header
-    )
-    assert response.status_code == 200
-    response_obj = response.json()
+    response_obj = get_shopping_client().get(f"products/{sku}/reviews")
     if len(response_obj) == 0:
         return ""
     author: str = response_obj[-1]["nickname"]
@@ -78,15 +140,7 @@ def shopping_get_sku_latest_review_author(sku: str) -> str:
 
 def shopping_get_sku_latest_review_rating(sku: str) -> str:
     """Get the latest review for shopping admin."""
-    header = {
-        "Authorization": f"Bearer {shopping_get_auth_token()}",
-        "Content-Type": "application/json",
-    }
-    response = requests.get(
-        f"{SHOPPING}/rest/V1/products/{sku}/reviews", headers=header
-    )
-    assert response.status_code == 200
-    response_obj = response.json()
+    response_obj = get_shopping_client().get(f"products/{sku}/reviews")
     if len(response_obj) == 0:
         return ""
     assert response_obj[0]["ratings"][0]["rating_name"] == "Rating"
@@ -143,9 +197,9 @@ def gitlab_get_project_memeber_role(page: Page, account_name: str) -> str:
     return role
 
 
-def llm_fuzzy_match(pred: str, reference: str, question: str) -> float:
-    """Check whether the prediction matches the reference with GPT4-turbo"""
-    messages: list[dict[str, Any]] = []
+def get_fuzzy_match_messages(
+    pred: str, reference: str, question: str
+) -> list[dict[str, str]]:
     # construct the question to ask
     message = "Help a teacher to grade the answer of a student given a question. Keep in mind that the student may use different phrasing or wording to answer the question. The goal is to evaluate whether the answer is semantically equivalent to the reference answer.\n"
     message += f"question: {question}\n"
@@ -153,29 +207,15 @@ def llm_fuzzy_match(pred: str, reference: str, question: str) -> float:
     message += "all the string 'N/A' that you see is a special sequence that means 'not achievable'\n"
     message += f"student answer: {pred}\n"
     message += "Conclude the judgement by correct/incorrect/partially correct."
-    messages = [
+    return [
         {"role": "system", "content": "You are a helpful assistant"},
         {"role": "user", "content": message},
     ]
 
-    response = generate_from_openai_chat_completion(
-        model="gpt-4-1106-preview",
-        messages=messages,
-        temperature=0,
-        max_tokens=768,
-        top_p=1.0,
-        context_length=0,
-    ).lower()
-    if "partially correct" in response or "incorrect" in response:
-        return 0.0
-    else:
-        assert "correct" in response
-        return 1.0
-
 
-def llm_ua_match(pred: str, reference: str, question: str) -> float:
-    """Check whether the prediction matches the reference with GPT-turbo"""
-    messages: list[dict[str, Any]] = []
+def get_ua_match_messages(
+    pred: str, reference: str, question: str
+) -> list[dict[str, str]]:
     # construct the question to ask
     message = ""
     message += f"task: {question}\n"
@@ -188,19 +228,33 @@ def llm_ua_match(pred: str, reference: str, question: str) -> float:
         "Determine if the reported reason aligns with the actual reason, even if implicitly. "
         "If the stated reason is in line with the actual reason, respond with 'same'. Otherwise, respond with 'different'."
     )
-    messages = [
+    return [
         {"role": "system", "content": "You are a helpful assistant"},
         {"role": "user", "content": message},
     ]
 
-    response = generate_from_openai_chat_completion(
-        model="gpt-4-1106-preview",
-        messages=messages,
-        temperature=0,
-        max_tokens=768,
-        top_p=1.0,
-        context_length=0,
-    ).lower()
+
+def llm_fuzzy_match(pred: str, reference: str, question: str) -> float:
+    """Check whether the prediction matches the reference with GPT4-turbo"""
+    response = (
+        get_llm_judge()
+        .judge(get_fuzzy_match_messages(pred, reference, question))
+        .lower()
+    )
+    if "partially correct" in response or "incorrect" in response:
+        return 0.0
+    else:
+        assert "correct" in response
+        return 1.0
+
+
+def llm_ua_match(pred: str, reference: str, question: str) -> float:
+    """Check whether the prediction matches the reference with GPT-turbo"""
+    response = (
+        get_llm_judge()
+        .judge(get_ua_match_messages(pred, reference, question))
+        .lower()
+    )
     if "different" in response:
         return 0.0
     else:
@@ -209,7 +263,7 @@ def llm_ua_match(pred: str, reference: str, question: str) -> float:
 
 
 class PseudoPage:
-    def __init__(self, original_page: Page, url: str):
+    def __init__(self, original_page: Page | None, url: str):
         self.url = url
         self.original_page = original_page
 
@@ -0,0 +1,235 @@
+"""LLM judge of the fuzzy_match and ua_match answers
+
+Verdicts are cached on disk by model and messages, so re-scoring a run
+asks the judge only about answers it has not seen. Pending judgements,
+e.g. those of all the tasks of a run being re-scored, are sent together
+through the async client with a rate limit shared by all the requests of
+the judge. The requests run on an event loop of the judge, in a thread of
+its own, since the thread of the caller may already run one, e.g. that of
+the sync Playwright API. The judge counts the tokens of the requests it
+sends, `cost` is the spend of this process in USD.
+
+The cache file is `cache/llm_judge.sqlite3`, or `$LLM_JUDGE_CACHE`.
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Coroutine, TypeVar
+
+if TYPE_CHECKING:
+    import aiolimiter
+
+JUDGE_MODEL = "gpt-4-1106-preview"
+# USD per 1K prompt and completion tokens
+JUDGE_PRICES = {
+    "gpt-4-1106-preview": (0.01, 0.03),
+    "gpt-4": (0.03, 0.06),
+    "gpt-3.5-turbo": (0.0015, 0.002),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS verdicts (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    messages TEXT NOT NULL,
+    response TEXT NOT NULL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    created_at REAL NOT NULL
+);
+"""
+
+Messages = list[dict[str, str]]
+T = TypeVar("T")
+
+
+class JudgeRequestError(Exception):
+    """The request to the LLM judge failed after its retries"""
+
+
+def get_judge_key(model: str, messages: Messages) -> str:
+    payload = json.dumps([model, messages], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class LLMJudge(object):
+    def __init__(
+        self,
+        cache_path: str | Path | None = "cache/llm_judge.sqlite3",
+        model: str = JUDGE_MODEL,
+        max_tokens: int = 768,
+        requests_per_minute: int = 300,
+        request_timeout: float = 120.0,
+    ) -> None:
+        """Without `cache_path` the verdicts are cached in memory
+
+        A request that takes longer than `request_timeout` seconds is tried
+        again, and fails after its retries.
+        """
+        self.model = model
+        self.max_tokens = max_tokens
+        self.requests_per_minute = requests_per_minute
+        self.request_timeout = request_timeout
+        if cache_path is not None:
+            Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(
+            ":memory:" if cache_path is None else cache_path,
+            check_same_thread=False,
+        )
+        self.conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._limiter: "aiolimiter.AsyncLimiter | None" = None
+        self.usage = {
+            "requests": 0,
+            "cache_hits": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+        }
+
+    @property
+    def cost(self) -> float:
+        """USD spent on the judge requests of this process"""
+        prompt_price, completion_price = JUDGE_PRICES.get(
+            self.model, (0.0, 0.0)
+        )
+        return (
+            self.usage["prompt_tokens"] * prompt_price
+            + self.usage["completion_tokens"] * completion_price
+        ) / 1000
+
+    def close(self) -> None:
+        self.conn.close()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def _run(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        """Run the coroutine on the event loop of the judge, wait for it"""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever,
+                    name="llm-judge",
+                    daemon=True,
+                ).start()
+        future: Future[T] = asyncio.run_coroutine_threadsafe(
+            coroutine, self._loop
+        )
+        return future.result()
+
+    def _lookup(self, keys: list[str]) -> dict[str, str]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                row = self.conn.execute(
+                    "SELECT response FROM verdicts WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    found[key] = row[0]
+        return found
+
+    async def _request(self, messages: Messages) -> dict[str, Any]:
+        from llms.providers.openai_utils import (
+            _throttled_openai_chat_completion_acreate,
+        )
+
+        assert self._limiter is not None
+        return await _throttled_openai_chat_completion_acreate(
+            model=self.model,
+            messages=messages,
+            temperature=0,
+            max_tokens=self.max_tokens,
+            top_p=1.0,
+            limiter=self._limiter,
+            request_timeout=self.request_timeout,
+        )
+
+    async def _request_all(
+        self, messages_list: list[Messages]
+    ) -> list[dict[str, Any]]:
+        if self._limiter is None:
+            import aiolimiter
+
+            # one limiter for all the requests of the judge
+            self._limiter = aiolimiter.AsyncLimiter(self.requests_per_minute)
+        return await asyncio.gather(
+            *[self._request(messages) for messages in messages_list]
+        )
+
+    def judge_many(self, messages_list: list[Messages]) -> list[str]:
+        """Responses of the judge, asking it only about uncached messages
+
+        The uncached messages are sent concurrently, each distinct one once.
+        The response to a request that failed is empty and is not cached.
+        """
+        keys = [get_judge_key(self.model, m) for m in messages_list]
+        verdicts = self._lookup(keys)
+        self.usage["cache_hits"] += sum(key in verdicts for key in keys)
+        pending = {
+            key: messages
+            for key, messages in zip(keys, messages_list)
+            if key not in verdicts
+        }
+        if pending:
+            if "OPENAI_API_KEY" not in os.environ:
+                raise ValueError(
+                    "OPENAI_API_KEY environment variable must be set when using OpenAI API."
+                )
+            import openai
+
+            openai.api_key = os.environ["OPENAI_API_KEY"]
+            openai.organization = os.environ.get("OPENAI_ORGANIZATION", "")
+            responses = self._run(self._request_all(list(pending.values())))
+            rows = []
+            for (key, messages), response in zip(pending.items(), responses):
+                content: str = response["choices"][0]["message"]["content"]
+                usage = response.get("usage", {})
+                self.usage["requests"] += 1
+                self.usage["prompt_tokens"] += usage.get("prompt_tokens", 0)
+                self.usage["completion_tokens"] += usage.get(
+                    "completion_tokens", 0
+                )
+                verdicts[key] = content
+                # a failed request answers with an empty message
+                if content:
+                    rows.append(
+                        (
+                            key,
+                            self.model,
+                            json.dumps(messages),
+                            content,
+                            usage.get("prompt_tokens"),
+                            usage.get("completion_tokens"),
+                            time.time(),
+                        )
+                    )
+            with self._lock, self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+        return [verdicts[key] for key in keys]
+
+    def judge(self, messages: Messages) -> str:
+        response = self.judge_many([messages])[0]
+        if not response:
+            raise JudgeRequestError(
+                f"The {self.model} judge request failed, see the OpenAI API warnings"
+            )
+        return response
+
+
+@functools.lru_cache(maxsize=None)
+def get_llm_judge() -> LLMJudge:
+    """Return the judge shared by the whole process"""
+    return LLMJudge(
+        os.environ.get("LLM_JUDGE_CACHE", "cache/llm_judge.sqlite3")
+    )
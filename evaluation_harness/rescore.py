@@ -0,0 +1,235 @@
+"""Score saved trajectories again, without the agent or the browser
+
+The final answer and url of each task are read from the trajectory logs of
+a result dir, then scored by the string and url evaluators in a process
+pool, with the task configs saved in the logs or with fresh ones, e.g.
+after a reference answer changed. The questions to the LLM judge are
+batched across all the tasks before their fuzzy matches are scored.
+
+program_html checks read the live websites and cannot be replayed. Tasks
+with such checks are flagged `needs_live_site`, with the score of their
+other evaluators as an upper bound.
+
+python -m evaluation_harness.rescore --result_dir <result_dir> \
+    [--config_dir config_files] [--num_workers 8] [--no_judge]
+"""
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, TypedDict
+
+from browser_env import create_stop_action
+from browser_env.trajectory_log import read_trajectory_log
+from evaluation_harness.evaluators import (
+    LLM_JUDGE_COST,
+    HTMLContentEvaluator,
+    StringEvaluator,
+    URLEvaluator,
+    evaluator_router,
+    get_judge_messages,
+)
+from evaluation_harness.llm_judge import (
+    JudgeRequestError,
+    get_llm_judge,
+)
+
+SCORED = "scored"
+NEEDS_LIVE_SITE = "needs_live_site"
+NEEDS_JUDGE = "needs_judge"
+MISSING_RESULT = "missing_result"
+
+
+class RescoredTask(TypedDict):
+    task_id: int
+    status: str
+    # score of the logged run
+    old_score: float | None
+    # None when the score needs the live site or the judge
+    score: float | None
+    # product of the evaluators that could run, an upper bound of the score
+    offline_score: float | None
+    judge_messages: list[list[dict[str, str]]]
+
+
+def load_saved_outcome(log_path: str | Path) -> dict[str, Any]:
+    """The config, final answer and url, and score of a logged task
+
+    Logs written before the result recorded the answer and the url fall
+    back to those of the last step.
+    """
+    outcome: dict[str, Any] = {"answer": None, "url": None, "score": None}
+    last_step: dict[str, Any] = {}
+    for record in read_trajectory_log(log_path):
+        match record["type"]:
+            case "task":
+                outcome["task_id"] = record["task_id"]
+                outcome["config"] = record["config"]
+            case "step":
+                last_step = record
+            case "result":
+                outcome["score"] = record["score"]
+                for key in ("answer", "url"):
+                    outcome[key] = record.get(key)
+                    if outcome[key] is None:
+                        outcome[key] = last_step.get(key)
+    return outcome
+
+
+def score_outcome(
+    configs: dict[str, Any],
+    answer: str | None,
+    url: str | None,
+    use_judge: bool,
+) -> tuple[str, float | None, float]:
+    """Status, score and offline score of a saved answer and url"""
+    status = SCORED
+    offline_score = 1.0
+    # from cheap to expensive, a zero settles the score
+    for evaluator in evaluator_router(configs).evaluators:
+        if isinstance(evaluator, HTMLContentEvaluator):
+            status = NEEDS_LIVE_SITE
+            continue
+        if evaluator.cost >= LLM_JUDGE_COST and not use_judge:
+            if status == SCORED:
+                status = NEEDS_JUDGE
+            continue
+        if isinstance(evaluator, StringEvaluator):
+            offline_score *= evaluator.score_answer(answer or "", configs)
+        elif isinstance(evaluator, URLEvaluator):
+            offline_score *= evaluator.score_url(url or "", configs)
+        if offline_score == 0:
+            return SCORED, 0.0, 0.0
+    return status, offline_score if status == SCORED else None, offline_score
+
+
+def rescore_log(
+    log_path: str, config_dir: str = "", use_judge: bool = False
+) -> RescoredTask:
+    """Score one logged task, for a worker of the process pool"""
+    outcome = load_saved_outcome(log_path)
+    task_id = outcome.get("task_id", int(Path(log_path).stem))
+    rescored: RescoredTask = {
+        "task_id": task_id,
+        "status": MISSING_RESULT,
+        "old_score": outcome["score"],
+        "score": None,
+        "offline_score": None,
+        "judge_messages": [],
+    }
+    if outcome["score"] is None:
+        return rescored
+
+    configs = outcome["config"]
+    if config_dir:
+        with open(Path(config_dir) / f"{task_id}.json", "r") as f:
+            configs = json.load(f)
+    (
+        rescored["status"],
+        rescored["score"],
+        rescored["offline_score"],
+    ) = score_outcome(configs, outcome["answer"], outcome["url"], use_judge)
+    if rescored["status"] == NEEDS_JUDGE:
+        rescored["judge_messages"] = get_judge_messages(
+            [create_stop_action(outcome["answer"] or "")], configs
+        )
+    return rescored
+
+
+def rescore_result_dir(
+    result_dir: str | Path,
+    config_dir: str = "",
+    num_workers: int | None = None,
+    use_judge: bool = True,
+) -> list[RescoredTask]:
+    log_paths = [
+        str(p) for p in sorted(Path(result_dir).glob("trajectories/*.jsonl"))
+    ]
+    with ProcessPoolExecutor(num_workers) as executor:
+        rescored = list(
+            executor.map(
+                rescore_log,
+                log_paths,
+                [config_dir] * len(log_paths),
+                [False] * len(log_paths),
+                chunksize=max(
+                    1, len(log_paths) // (4 * (os.cpu_count() or 1))
+                ),
+            )
+        )
+
+    pending = [
+        (i, task)
+        for i, task in enumerate(rescored)
+        if task["status"] == NEEDS_JUDGE
+    ]
+    if use_judge and pending:
+        # one batch of judge requests for all the tasks, the scoring below
+        # finds the verdicts cached
+        get_llm_judge().judge_many(
+            [m for _, task in pending for m in task["judge_messages"]]
+        )
+        for i, task in pending:
+            try:
+                rescored[i] = rescore_log(log_paths[i], config_dir, True)
+            except JudgeRequestError:
+                # the task still needs the judge, a later run asks again
+                pass
+    return sorted(rescored, key=lambda task: task["task_id"])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Score the trajectories of a result dir again, without a browser"
+    )
+    parser.add_argument("--result_dir", type=str, required=True)
+    parser.add_argument(
+        "--config_dir",
+        type=str,
+        default="",
+        help="Directory of <task_id>.json configs to score with, the configs saved in the logs by default",
+    )
+    parser.add_argument("--num_workers", type=int, default=None)
+    parser.add_argument(
+        "--no_judge",
+        action="store_true",
+        help="Flag the tasks that need the LLM judge instead of asking it",
+    )
+    parser.add_argument("--output", type=str, default="")
+    args = parser.parse_args()
+
+    rescored = rescore_result_dir(
+        args.result_dir,
+        args.config_dir,
+        args.num_workers,
+        use_judge=not args.no_judge,
+    )
+    output = args.output or Path(args.result_dir) / "rescored.json"
+    with open(output, "w") as f:
+        json.dump(
+            [
+                {k: v for k, v in task.items() if k != "judge_messages"}
+                for task in rescored
+            ],
+            f,
+            indent=2,
+        )
+
+    scored = [task for task in rescored if task["status"] == SCORED]
+    changed = [task for task in scored if task["score"] != task["old_score"]]
+    print(f"Rescored {len(scored)}/{len(rescored)} tasks, written to {output}")
+    if scored:
+        average = sum(task["score"] or 0.0 for task in scored) / len(scored)
+        print(f"Average score of the rescored tasks: {average:.4f}")
+    print(f"Changed scores: {[task['task_id'] for task in changed]}")
+    for status in (NEEDS_LIVE_SITE, NEEDS_JUDGE, MISSING_RESULT):
+        task_ids = [t["task_id"] for t in rescored if t["status"] == status]
+        if task_ids:
+            print(f"[{status}] {len(task_ids)} tasks: {task_ids}")
+    if get_llm_judge.cache_info().currsize:
+        print(f"Judge cost: ${get_llm_judge().cost:.4f}")
+
+
+if __name__ == "__main__":
+    main()
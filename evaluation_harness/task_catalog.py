@@ -0,0 +1,142 @@
+"""Catalog of the tasks of the benchmark, loaded once from `test.raw.json`
+
+The raw file holds every task with placeholders such as `__GITLAB__` in
+place of the website urls. The catalog parses it once, indexes the tasks by
+id, site, intent template and eval type, and fills in the urls of a task
+only when the task is accessed.
+"""
+import functools
+import json
+import re
+from collections import defaultdict
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from evaluation_harness.eval_plan import EvalPlan
+
+URL_PLACEHOLDER_PATTERN = re.compile(
+    r"__(GITLAB|REDDIT|SHOPPING_ADMIN|SHOPPING|WIKIPEDIA|MAP|HOMEPAGE)__"
+)
+
+
+def get_url_placeholders() -> dict[str, str]:
+    """Placeholder name -> url of the website, from the environment config"""
+    from browser_env import env_config
+
+    env_config.check_site_urls()
+    return {
+        name: getattr(env_config, name)
+        for name in [
+            "GITLAB",
+            "REDDIT",
+            "SHOPPING_ADMIN",
+            "SHOPPING",
+            "WIKIPEDIA",
+            "MAP",
+            "HOMEPAGE",
+        ]
+    }
+
+
+def fill_url_placeholders(value: Any, urls: dict[str, str]) -> Any:
+    """Replace the url placeholders in every string of a nested config"""
+    if isinstance(value, str):
+        if "__" not in value:
+            return value
+        return URL_PLACEHOLDER_PATTERN.sub(
+            lambda m: urls.get(m.group(1), m.group(0)), value
+        )
+    if isinstance(value, list):
+        return [fill_url_placeholders(v, urls) for v in value]
+    if isinstance(value, dict):
+        return {k: fill_url_placeholders(v, urls) for k, v in value.items()}
+    return value
+
+
+class TaskCatalog(object):
+    def __init__(
+        self,
+        raw_path: str | Path = "config_files/test.raw.json",
+        urls: dict[str, str] | None = None,
+    ) -> None:
+        self.raw_path = Path(raw_path)
+        with open(self.raw_path, "r") as f:
+            raw_tasks: list[dict[str, Any]] = json.load(f)
+        self._urls = urls
+        self._raw_tasks = {task["task_id"]: task for task in raw_tasks}
+        self._tasks: dict[int, dict[str, Any]] = {}
+
+        self.by_site: dict[str, list[int]] = defaultdict(list)
+        self.by_template: dict[int, list[int]] = defaultdict(list)
+        self.by_eval_type: dict[str, list[int]] = defaultdict(list)
+        for task_id, task in self._raw_tasks.items():
+            for site in task["sites"]:
+                self.by_site[site].append(task_id)
+            self.by_template[task["intent_template_id"]].append(task_id)
+            for eval_type in task["eval"]["eval_types"]:
+                self.by_eval_type[eval_type].append(task_id)
+
+    @property
+    def urls(self) -> dict[str, str]:
+        if self._urls is None:
+            self._urls = get_url_placeholders()
+        return self._urls
+
+    def __len__(self) -> int:
+        return len(self._raw_tasks)
+
+    def __contains__(self, task_id: int) -> bool:
+        return task_id in self._raw_tasks
+
+    def __getitem__(self, task_id: int) -> dict[str, Any]:
+        """The config of the task with the website urls filled in
+
+        The config is shared by all callers, do not modify it.
+        """
+        if task_id not in self._tasks:
+            self._tasks[task_id] = fill_url_placeholders(
+                self._raw_tasks[task_id], self.urls
+            )
+        return self._tasks[task_id]
+
+    def get_eval_plan(self, task_id: int) -> "EvalPlan":
+        """The compiled eval config of the task, see `eval_plan`"""
+        from evaluation_harness.eval_plan import get_eval_plan
+
+        return get_eval_plan(self[task_id])
+
+    def get_raw(self, task_id: int) -> dict[str, Any]:
+        """The config of the task with the url placeholders"""
+        return self._raw_tasks[task_id]
+
+    def task_ids(
+        self,
+        site: str | None = None,
+        template_id: int | None = None,
+        eval_type: str | None = None,
+    ) -> list[int]:
+        """Ids of the tasks matching all the given filters, in order"""
+        selected = set(self._raw_tasks)
+        if site is not None:
+            selected &= set(self.by_site.get(site, []))
+        if template_id is not None:
+            selected &= set(self.by_template.get(template_id, []))
+        if eval_type is not None:
+            selected &= set(self.by_eval_type.get(eval_type, []))
+        return sorted(selected)
+
+    def write_config_file(self, task_id: int, config_dir: str | Path) -> Path:
+        """Write the config of a task as `<config_dir>/<task_id>.json`"""
+        config_file = Path(config_dir) / f"{task_id}.json"
+        with open(config_file, "w") as f:
+            json.dump(self[task_id], f, indent=2)
+        return config_file
+
+
+@functools.lru_cache(maxsize=None)
+def get_task_catalog(
+    raw_path: str = "config_files/test.raw.json",
+) -> TaskCatalog:
+    """Return the catalog shared by the whole process"""
+    return TaskCatalog(raw_path)
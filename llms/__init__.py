@@ -1,14 +1,51 @@
-"""This module is adapt from https://github.com/zeno-ml/zeno-build"""
-from .providers.hf_utils import generate_from_huggingface_completion
-from .providers.openai_utils import (
-    generate_from_openai_chat_completion,
-    generate_from_openai_completion,
-)
-from .utils import call_llm
+"""This module is adapt from https://github.com/zeno-ml/zeno-build
+
+The functions below are imported on first access, the providers import
+their clients, e.g. openai and text_generation, which take a while.
+"""
+import importlib
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from .providers.hf_utils import (
+        generate_from_huggingface_completion,
+        generate_n_from_huggingface_completion,
+    )
+    from .providers.openai_utils import (
+        generate_from_openai_chat_completion,
+        generate_from_openai_completion,
+        generate_n_from_openai_chat_completion,
+        generate_n_from_openai_completion,
+    )
+    from .utils import call_llm, call_llm_n
+
+# name -> module defining it
+_LAZY_IMPORTS = {
+    "generate_from_huggingface_completion": ".providers.hf_utils",
+    "generate_n_from_huggingface_completion": ".providers.hf_utils",
+    "generate_from_openai_chat_completion": ".providers.openai_utils",
+    "generate_from_openai_completion": ".providers.openai_utils",
+    "generate_n_from_openai_chat_completion": ".providers.openai_utils",
+    "generate_n_from_openai_completion": ".providers.openai_utils",
+    "call_llm": ".utils",
+    "call_llm_n": ".utils",
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name in _LAZY_IMPORTS:
+        module = importlib.import_module(_LAZY_IMPORTS[name], __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 __all__ = [
     "generate_from_openai_completion",
     "generate_from_openai_chat_completion",
     "generate_from_huggingface_completion",
+    "generate_n_from_openai_completion",
+    "generate_n_from_openai_chat_completion",
+    "generate_n_from_huggingface_completion",
     "call_llm",
+    "call_llm_n",
 ]
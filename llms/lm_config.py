@@ -42,16 +42,22 @@ def construct_llm_config(args: argparse.Namespace) -> LMConfig:
         llm_config.gen_config["stop_token"] = args.stop_token
         llm_config.gen_config["max_obs_length"] = args.max_obs_length
         llm_config.gen_config["max_retry"] = args.max_retry
+        llm_config.gen_config["n_samples"] = args.n_samples
+        llm_config.gen_config["sample_selection"] = args.sample_selection
     elif args.provider == "huggingface":
         llm_config.gen_config["temperature"] = args.temperature
         llm_config.gen_config["top_p"] = args.top_p
         llm_config.gen_config["max_new_tokens"] = args.max_tokens
+        llm_config.gen_config["context_length"] = args.context_length
         llm_config.gen_config["stop_sequences"] = (
             [args.stop_token] if args.stop_token else None
         )
         llm_config.gen_config["max_obs_length"] = args.max_obs_length
         llm_config.gen_config["model_endpoint"] = args.model_endpoint
+        llm_config.gen_config["max_batch_delay"] = args.max_batch_delay
         llm_config.gen_config["max_retry"] = args.max_retry
+        llm_config.gen_config["n_samples"] = args.n_samples
+        llm_config.gen_config["sample_selection"] = args.sample_selection
     else:
         raise NotImplementedError(f"provider {args.provider} not implemented")
     return llm_config
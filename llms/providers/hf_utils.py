@@ -1,4 +1,253 @@
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import Future
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
 from text_generation import Client  # type: ignore
+from text_generation.errors import parse_error  # type: ignore
+from text_generation.types import (  # type: ignore
+    Parameters,
+    Request,
+    Response,
+)
+
+
+@functools.lru_cache(maxsize=None)
+def get_huggingface_client(model_endpoint: str, timeout: int = 60) -> Client:
+    """Return the client shared by all calls to the same endpoint"""
+    return Client(model_endpoint, timeout=timeout)
+
+
+class TGIBatchScheduler:
+    """Send the prompts of the threads of a process to a
+    text-generation-inference endpoint over one pooled HTTP session.
+
+    Callers from any thread submit a prompt and block on the returned future.
+    A background event loop waits up to `max_batch_delay` seconds (or until
+    `max_batch_size` prompts are pending) and then sends the pending prompts
+    concurrently, so that the server's continuous batching sees them
+    together. Each response is routed back to its caller. A delay of 0
+    dispatches whatever is pending right away.
+
+    Only prompts submitted while others are pending share a batch. run.py
+    runs one episode at a time per process, so there each batch holds the
+    single prompt of the agent, and the `n` samples of
+    `generate_n_from_huggingface_completion` are one `best_of` request.
+    Batches form when several threads of a process generate at once.
+
+    Batches do not wait for each other: up to `max_inflight_batches` are sent
+    at the same time. `close` fails the prompts that are still pending.
+    """
+
+    def __init__(
+        self,
+        model_endpoint: str,
+        max_batch_delay: float = 0.0,
+        max_batch_size: int = 32,
+        max_inflight_batches: int = 4,
+        timeout: int = 60,
+    ) -> None:
+        self.model_endpoint = model_endpoint
+        self.max_batch_delay = max_batch_delay
+        self.max_batch_size = max_batch_size
+        self.max_inflight_batches = max_inflight_batches
+        self.timeout = timeout
+        # size of each batch sent so far
+        self.batch_sizes: list[int] = []
+        # the futures not resolved yet, failed by `close`
+        self._futures: set[Future[Response]] = set()
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self._loop = asyncio.new_event_loop()
+        self._queue: asyncio.Queue[
+            tuple[Request, Future[Response]]
+        ] = asyncio.Queue()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, daemon=True
+        )
+        self._thread.start()
+        self._dispatcher = asyncio.run_coroutine_threadsafe(
+            self._dispatch_forever(), self._loop
+        )
+
+    def submit(
+        self,
+        prompt: str,
+        temperature: float,
+        top_p: float,
+        max_new_tokens: int,
+        stop_sequences: list[str] | None = None,
+        best_of: int | None = None,
+    ) -> Future[Response]:
+        """Queue a prompt, the future resolves to the TGI response"""
+        parameters = Parameters(
+            best_of=best_of,
+            details=True,
+            do_sample=best_of is not None and best_of > 1,
+            max_new_tokens=max_new_tokens,
+            stop=stop_sequences if stop_sequences is not None else [],
+            temperature=temperature,
+            top_p=top_p,
+        )
+        request = Request(inputs=prompt, stream=False, parameters=parameters)
+        future: Future[Response] = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The TGI batch scheduler is closed")
+            self._futures.add(future)
+        future.add_done_callback(self._discard)
+        self._loop.call_soon_threadsafe(
+            self._queue.put_nowait, (request, future)
+        )
+        return future
+
+    def _discard(self, future: Future[Response]) -> None:
+        with self._lock:
+            self._futures.discard(future)
+
+    def generate(
+        self,
+        prompt: str,
+        temperature: float,
+        top_p: float,
+        max_new_tokens: int,
+        stop_sequences: list[str] | None = None,
+    ) -> str:
+        future = self.submit(
+            prompt,
+            temperature=temperature,
+            top_p=top_p,
+            max_new_tokens=max_new_tokens,
+            stop_sequences=stop_sequences,
+        )
+        generation: str = future.result().generated_text
+        return generation
+
+    async def _next_batch(self) -> list[tuple[Request, Future[Response]]]:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_batch_delay
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # take what is already pending without waiting for more
+                while (
+                    not self._queue.empty()
+                    and len(batch) < self.max_batch_size
+                ):
+                    batch.append(self._queue.get_nowait())
+                break
+            try:
+                batch.append(
+                    await asyncio.wait_for(self._queue.get(), remaining)
+                )
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _send(
+        self,
+        session: ClientSession,
+        request: Request,
+        future: Future[Response],
+    ) -> None:
+        try:
+            async with session.post(
+                self.model_endpoint, json=request.dict()
+            ) as resp:
+                payload = await resp.json()
+                if resp.status != 200:
+                    raise parse_error(resp.status, payload)
+                future.set_result(Response(**payload[0]))
+        except Exception as e:
+            future.set_exception(e)
+
+    async def _send_batch(
+        self,
+        session: ClientSession,
+        batch: list[tuple[Request, Future[Response]]],
+        inflight: asyncio.Semaphore,
+    ) -> None:
+        try:
+            await asyncio.gather(
+                *[
+                    self._send(session, request, future)
+                    for request, future in batch
+                ]
+            )
+        finally:
+            inflight.release()
+
+    async def _dispatch_forever(self) -> None:
+        inflight = asyncio.Semaphore(self.max_inflight_batches)
+        # keep a reference to the running batches, the loop only keeps a
+        # weak one
+        tasks: set[asyncio.Task[None]] = set()
+        async with ClientSession(
+            timeout=ClientTimeout(self.timeout),
+            connector=TCPConnector(
+                limit=self.max_batch_size * self.max_inflight_batches
+            ),
+        ) as session:
+            while True:
+                # prompts keep queuing while all the batches are in flight
+                await inflight.acquire()
+                batch = await self._next_batch()
+                self.batch_sizes.append(len(batch))
+                task = asyncio.create_task(
+                    self._send_batch(session, batch, inflight)
+                )
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+    async def _shutdown(self) -> None:
+        tasks = [
+            task
+            for task in asyncio.all_tasks()
+            if task is not asyncio.current_task()
+        ]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self) -> None:
+        """Stop the event loop, the pending prompts fail with RuntimeError"""
+        with self._lock:
+            self._closed = True
+        try:
+            asyncio.run_coroutine_threadsafe(
+                self._shutdown(), self._loop
+            ).result(timeout=self.timeout)
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            with self._lock:
+                pending = list(self._futures)
+            for future in pending:
+                # the callers blocked on the future would wait forever
+                if not future.done():
+                    future.set_exception(
+                        RuntimeError("The TGI batch scheduler was closed")
+                    )
+
+
+_schedulers: dict[tuple[str, float], TGIBatchScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_batch_scheduler(
+    model_endpoint: str, max_batch_delay: float
+) -> TGIBatchScheduler:
+    """Return the scheduler shared by all callers of the same endpoint"""
+    with _schedulers_lock:
+        key = (model_endpoint, max_batch_delay)
+        if key not in _schedulers:
+            _schedulers[key] = TGIBatchScheduler(
+                model_endpoint, max_batch_delay=max_batch_delay
+            )
+        return _schedulers[key]
 
 
 def generate_from_huggingface_completion(
@@ -8,8 +257,18 @@ def generate_from_huggingface_completion(
     top_p: float,
     max_new_tokens: int,
     stop_sequences: list[str] | None = None,
+    max_batch_delay: float | None = None,
 ) -> str:
-    client = Client(model_endpoint, timeout=60)
+    if max_batch_delay is not None:
+        return get_batch_scheduler(model_endpoint, max_batch_delay).generate(
+            prompt=prompt,
+            temperature=temperature,
+            top_p=top_p,
+            max_new_tokens=max_new_tokens,
+            stop_sequences=stop_sequences,
+        )
+
+    client = get_huggingface_client(model_endpoint)
     generation: str = client.generate(
         prompt=prompt,
         temperature=temperature,
@@ -19,3 +278,47 @@ def generate_from_huggingface_completion(
     ).generated_text
 
     return generation
+
+
+def generate_n_from_huggingface_completion(
+    prompt: str,
+    model_endpoint: str,
+    temperature: float,
+    top_p: float,
+    max_new_tokens: int,
+    n: int,
+    stop_sequences: list[str] | None = None,
+    max_batch_delay: float | None = None,
+) -> list[str]:
+    """Sample `n` sequences in a single request through TGI's `best_of`.
+
+    The best sequence comes first, followed by the other candidates.
+    """
+    if max_batch_delay is not None:
+        response = (
+            get_batch_scheduler(model_endpoint, max_batch_delay)
+            .submit(
+                prompt,
+                temperature=temperature,
+                top_p=top_p,
+                max_new_tokens=max_new_tokens,
+                stop_sequences=stop_sequences,
+                best_of=n,
+            )
+            .result()
+        )
+    else:
+        client = get_huggingface_client(model_endpoint)
+        response = client.generate(
+            prompt=prompt,
+            do_sample=True,
+            best_of=n,
+            temperature=temperature,
+            top_p=top_p,
+            max_new_tokens=max_new_tokens,
+            stop_sequences=stop_sequences,
+        )
+    generations: list[str] = [response.generated_text]
+    for sequence in response.details.best_of_sequences or []:
+        generations.append(sequence.generated_text)
+    return generations
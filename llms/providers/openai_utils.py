@@ -159,6 +159,40 @@ def generate_from_openai_completion(
     return answer
 
 
+@retry_with_exponential_backoff
+def generate_n_from_openai_completion(
+    prompt: str,
+    engine: str,
+    temperature: float,
+    max_tokens: int,
+    top_p: float,
+    context_length: int,
+    n: int,
+    stop_token: str | None = None,
+) -> list[str]:
+    """Sample `n` completions for the same prompt in a single request."""
+    if "OPENAI_API_KEY" not in os.environ:
+        raise ValueError(
+            "OPENAI_API_KEY environment variable must be set when using OpenAI API."
+        )
+    openai.api_key = os.environ["OPENAI_API_KEY"]
+    openai.organization = os.environ.get("OPENAI_ORGANIZATION", "")
+    response = openai.Completion.create(  # type: ignore
+        prompt=prompt,
+        engine=engine,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        top_p=top_p,
+        n=n,
+        stop=[stop_token],
+    )
+    answers: list[str] = [
+        choice["text"]
+        for choice in sorted(response["choices"], key=lambda x: x["index"])
+    ]
+    return answers
+
+
 async def _throttled_openai_chat_completion_acreate(
     model: str,
     messages: list[dict[str, str]],
@@ -166,6 +200,7 @@ async def _throttled_openai_chat_completion_acreate(
     max_tokens: int,
     top_p: float,
     limiter: aiolimiter.AsyncLimiter,
+    request_timeout: float | None = None,
 ) -> dict[str, Any]:
     async with limiter:
         for _ in range(3):
@@ -176,13 +211,14 @@ async def _throttled_openai_chat_completion_acreate(
                     temperature=temperature,
                     max_tokens=max_tokens,
                     top_p=top_p,
+                    request_timeout=request_timeout,
                 )
             except openai.error.RateLimitError:
                 logging.warning(
                     "OpenAI API rate limit exceeded. Sleeping for 10 seconds."
                 )
                 await asyncio.sleep(10)
-            except asyncio.exceptions.TimeoutError:
+            except (asyncio.exceptions.TimeoutError, openai.error.Timeout):
                 logging.warning("OpenAI API timeout. Sleeping for 10 seconds.")
                 await asyncio.sleep(10)
             except openai.error.APIError as e:
@@ -265,6 +301,41 @@ def generate_from_openai_chat_completion(
     return answer
 
 
+@retry_with_exponential_backoff
+def generate_n_from_openai_chat_completion(
+    messages: list[dict[str, str]],
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    top_p: float,
+    context_length: int,
+    n: int,
+    stop_token: str | None = None,
+) -> list[str]:
+    """Sample `n` chat completions for the same messages in a single request."""
+    if "OPENAI_API_KEY" not in os.environ:
+        raise ValueError(
+            "OPENAI_API_KEY environment variable must be set when using OpenAI API."
+        )
+    openai.api_key = os.environ["OPENAI_API_KEY"]
+    openai.organization = os.environ.get("OPENAI_ORGANIZATION", "")
+
+    response = openai.ChatCompletion.create(  # type: ignore
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        top_p=top_p,
+        n=n,
+        stop=[stop_token] if stop_token else None,
+    )
+    answers: list[str] = [
+        choice["message"]["content"]
+        for choice in sorted(response["choices"], key=lambda x: x["index"])
+    ]
+    return answers
+
+
 @retry_with_exponential_backoff
 # debug only
 def fake_generate_from_openai_chat_completion(
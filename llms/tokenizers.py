@@ -1,27 +1,151 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 
-import tiktoken
-from transformers import LlamaTokenizer  # type: ignore
-
 
 class Tokenizer(object):
-    def __init__(self, provider: str, model_name: str) -> None:
-        if provider == "openai":
-            self.tokenizer = tiktoken.encoding_for_model(model_name)
-        elif provider == "huggingface":
-            self.tokenizer = LlamaTokenizer.from_pretrained(model_name)
-            # turn off adding special tokens automatically
-            self.tokenizer.add_special_tokens = False  # type: ignore[attr-defined]
-            self.tokenizer.add_bos_token = False  # type: ignore[attr-defined]
-            self.tokenizer.add_eos_token = False  # type: ignore[attr-defined]
-        else:
+    """Tokenizer of the model, the backend is imported and loaded on first use
+
+    OpenAI models use tiktoken. Hugging Face models use the fast (Rust)
+    tokenizer when the model provides one, and the sentencepiece one otherwise.
+    """
+
+    # batches smaller than this are encoded text by text, the batch calls
+    # set up a thread pool on every call
+    MIN_BATCH_SIZE = 64
+
+    def __init__(
+        self, provider: str, model_name: str, use_fast: bool = True
+    ) -> None:
+        if provider not in ["openai", "huggingface"]:
             raise NotImplementedError
+        self.provider = provider
+        self.model_name = model_name
+        self.use_fast = use_fast
+        self._tokenizer: Any = None
+
+    @property
+    def tokenizer(self) -> Any:
+        if self._tokenizer is None:
+            if self.provider == "openai":
+                import tiktoken
+
+                self._tokenizer = tiktoken.encoding_for_model(self.model_name)
+            else:
+                from transformers import AutoTokenizer  # type: ignore
+
+                self._tokenizer = AutoTokenizer.from_pretrained(
+                    self.model_name, use_fast=self.use_fast
+                )
+        return self._tokenizer
 
     def encode(self, text: str) -> list[int]:
-        return self.tokenizer.encode(text)
+        if self.provider == "huggingface":
+            # turn off adding special tokens automatically
+            ids: list[int] = self.tokenizer.encode(
+                text, add_special_tokens=False
+            )
+            return ids
+        return self.tokenizer.encode(text)  # type: ignore[no-any-return]
+
+    def encode_many(
+        self, texts: list[str], num_threads: int | None = None
+    ) -> list[list[int]]:
+        """Encode a batch of texts
+
+        tiktoken and the fast Hugging Face tokenizers encode the batch in
+        parallel natively, other backends use a pool of `num_threads` threads.
+        Batches of fewer than `MIN_BATCH_SIZE` texts are encoded one by one.
+        """
+        if len(texts) < self.MIN_BATCH_SIZE:
+            return [self.encode(text) for text in texts]
+        if self.provider == "openai":
+            return self.tokenizer.encode_batch(  # type: ignore[no-any-return]
+                texts, num_threads=num_threads or 8
+            )
+        if self.provider == "huggingface" and self.tokenizer.is_fast:
+            return self.tokenizer(  # type: ignore[no-any-return]
+                texts, add_special_tokens=False
+            )["input_ids"]
+        if not num_threads or num_threads == 1:
+            return [self.encode(text) for text in texts]
+        with ThreadPoolExecutor(num_threads) as executor:
+            return list(executor.map(self.encode, texts))
 
     def decode(self, ids: list[int]) -> str:
-        return self.tokenizer.decode(ids)
+        return self.tokenizer.decode(ids)  # type: ignore[no-any-return]
 
     def __call__(self, text: str) -> list[int]:
-        return self.tokenizer.encode(text)
+        return self.encode(text)
+
+
+class TokenCounter(object):
+    """Count tokens line by line with an LRU cache of line to token count.
+
+    Consecutive observations of the same site share most of their lines, so
+    after the first step only the new lines are encoded. The count of a text
+    is the sum of its lines plus `LINE_BREAK_TOKENS` per line break, an
+    estimate of the count of encoding the text at once. Lines are cached
+    without their line break, count them the same way elsewhere (see
+    `ObservationBudget`) to share the cache.
+    """
+
+    LINE_BREAK_TOKENS = 1
+
+    def __init__(self, tokenizer: Tokenizer, cache_size: int = 65536) -> None:
+        self.tokenizer = tokenizer
+        self.cache_size = cache_size
+        self._cache: OrderedDict[str, int] = OrderedDict()
+
+    def count_lines(self, lines: list[str]) -> list[int]:
+        """Count the tokens of every line, only the unseen lines are encoded"""
+        missing = []
+        for line in lines:
+            if line in self._cache:
+                self._cache.move_to_end(line)
+            else:
+                missing.append(line)
+        if missing:
+            missing = list(dict.fromkeys(missing))
+            for line, ids in zip(missing, self.tokenizer.encode_many(missing)):
+                self._cache[line] = len(ids)
+        counts = [self._cache[line] for line in lines]
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return counts
+
+    def count_tokens(self, line: str) -> int:
+        return self.count_lines([line])[0]
+
+    def count_text(self, text: str) -> int:
+        lines = text.split("\n")
+        return (
+            sum(self.count_lines(lines))
+            + (len(lines) - 1) * self.LINE_BREAK_TOKENS
+        )
+
+    def fit_lines(
+        self, text: str, max_tokens: int, chunk_size: int = 256
+    ) -> str:
+        """Return the largest prefix of whole lines that fits in `max_tokens`
+
+        Lines are counted a chunk at a time so that the lines past the budget
+        are mostly never encoded. If not even the first line fits, it is cut
+        at the token level instead.
+        """
+        lines = text.split("\n")
+        used = 0
+        for start in range(0, len(lines), chunk_size):
+            counts = self.count_lines(lines[start : start + chunk_size])
+            for offset, count in enumerate(counts):
+                idx = start + offset
+                # the line break before every line but the first one
+                cost = count + (self.LINE_BREAK_TOKENS if idx else 0)
+                if used + cost > max_tokens:
+                    if idx == 0:
+                        return self.tokenizer.decode(
+                            self.tokenizer.encode(lines[0])[:max_tokens]
+                        )
+                    return "\n".join(lines[:idx])
+                used += cost
+        return text
@@ -1,12 +1,7 @@
 import argparse
 from typing import Any
 
-from llms import (
-    generate_from_huggingface_completion,
-    generate_from_openai_chat_completion,
-    generate_from_openai_completion,
-    lm_config,
-)
+from llms import lm_config
 
 APIInput = str | list[Any] | dict[str, Any]
 
@@ -17,6 +12,11 @@ def call_llm(
 ) -> str:
     response: str
     if lm_config.provider == "openai":
+        from llms.providers.openai_utils import (
+            generate_from_openai_chat_completion,
+            generate_from_openai_completion,
+        )
+
         if lm_config.mode == "chat":
             assert isinstance(prompt, list)
             response = generate_from_openai_chat_completion(
@@ -43,6 +43,10 @@ def call_llm(
                 f"OpenAI models do not support mode {lm_config.mode}"
             )
     elif lm_config.provider == "huggingface":
+        from llms.providers.hf_utils import (
+            generate_from_huggingface_completion,
+        )
+
         assert isinstance(prompt, str)
         response = generate_from_huggingface_completion(
             prompt=prompt,
@@ -51,6 +55,7 @@ def call_llm(
             top_p=lm_config.gen_config["top_p"],
             stop_sequences=lm_config.gen_config["stop_sequences"],
             max_new_tokens=lm_config.gen_config["max_new_tokens"],
+            max_batch_delay=lm_config.gen_config.get("max_batch_delay"),
         )
     else:
         raise NotImplementedError(
@@ -58,3 +63,68 @@ def call_llm(
         )
 
     return response
+
+
+def call_llm_n(
+    lm_config: lm_config.LMConfig,
+    prompt: APIInput,
+    n: int,
+) -> list[str]:
+    """Sample `n` responses for the same prompt with a single API call"""
+    responses: list[str]
+    if lm_config.provider == "openai":
+        from llms.providers.openai_utils import (
+            generate_n_from_openai_chat_completion,
+            generate_n_from_openai_completion,
+        )
+
+        if lm_config.mode == "chat":
+            assert isinstance(prompt, list)
+            responses = generate_n_from_openai_chat_completion(
+                messages=prompt,
+                model=lm_config.model,
+                temperature=lm_config.gen_config["temperature"],
+                top_p=lm_config.gen_config["top_p"],
+                context_length=lm_config.gen_config["context_length"],
+                max_tokens=lm_config.gen_config["max_tokens"],
+                n=n,
+                stop_token=None,
+            )
+        elif lm_config.mode == "completion":
+            assert isinstance(prompt, str)
+            responses = generate_n_from_openai_completion(
+                prompt=prompt,
+                engine=lm_config.model,
+                temperature=lm_config.gen_config["temperature"],
+                max_tokens=lm_config.gen_config["max_tokens"],
+                top_p=lm_config.gen_config["top_p"],
+                context_length=lm_config.gen_config["context_length"],
+                n=n,
+                stop_token=lm_config.gen_config["stop_token"],
+            )
+        else:
+            raise ValueError(
+                f"OpenAI models do not support mode {lm_config.mode}"
+            )
+    elif lm_config.provider == "huggingface":
+        from llms.providers.hf_utils import (
+            generate_n_from_huggingface_completion,
+        )
+
+        assert isinstance(prompt, str)
+        responses = generate_n_from_huggingface_completion(
+            prompt=prompt,
+            model_endpoint=lm_config.gen_config["model_endpoint"],
+            temperature=lm_config.gen_config["temperature"],
+            top_p=lm_config.gen_config["top_p"],
+            stop_sequences=lm_config.gen_config["stop_sequences"],
+            max_new_tokens=lm_config.gen_config["max_new_tokens"],
+            n=n,
+            max_batch_delay=lm_config.gen_config.get("max_batch_delay"),
+        )
+    else:
+        raise NotImplementedError(
+            f"Provider {lm_config.provider} not implemented"
+        )
+
+    return responses
@@ -1,6 +1,6 @@
 """Script to run end-to-end evaluation on the benchmark"""
 import argparse
-import glob
+import functools
 import json
 import logging
 import os
@@ -9,6 +9,7 @@ import subprocess
 import tempfile
 import time
 from pathlib import Path
+from typing import Any
 
 import openai
 
@@ -22,6 +23,7 @@ from agent.prompts import *
 from browser_env import (
     Action,
     ActionTypes,
+    MemoryBoundedTrajectory,
     ScriptBrowserEnv,
     StateInfo,
     Trajectory,
@@ -29,31 +31,62 @@ from browser_env import (
 )
 from browser_env.actions import is_equivalent
 from browser_env.auto_login import get_site_comb_from_filepath
+from browser_env.env_config import check_site_urls
 from browser_env.helper_functions import (
     RenderHelper,
     get_action_description,
 )
-from evaluation_harness import evaluator_router
+from browser_env.trajectory_log import TrajectoryLogger
+from evaluation_harness import (
+    Evaluator,
+    EvaluatorComb,
+    evaluator_router,
+)
+from evaluation_harness.llm_judge import get_llm_judge
+from evaluation_harness.task_catalog import get_task_catalog
+from runner import (
+    EpisodeTimeout,
+    EvaluationJob,
+    EvaluationStage,
+    LeaseHeartbeat,
+    RunStore,
+    Watchdog,
+    default_worker_id,
+    estimate_costs,
+    get_worker_order,
+    group_tasks,
+    schedule_tasks,
+)
+
+# seconds to close a browser stuck after a timeout, the process exits if
+# it takes longer
+TEARDOWN_SECONDS = 60.0
 
 LOG_FOLDER = "log_files"
-Path(LOG_FOLDER).mkdir(parents=True, exist_ok=True)
-LOG_FILE_NAME = f"{LOG_FOLDER}/log_{time.strftime('%Y%m%d%H%M%S', time.localtime())}_{random.randint(0, 10000)}.log"
 
 logger = logging.getLogger("logger")
-logger.setLevel(logging.INFO)
 
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.DEBUG)
-logger.addHandler(console_handler)
 
-file_handler = logging.FileHandler(LOG_FILE_NAME)
-file_handler.setLevel(logging.DEBUG)
-logger.addHandler(file_handler)
+def setup_logging() -> str:
+    """Log to the console and to a new log file, return the file name"""
+    Path(LOG_FOLDER).mkdir(parents=True, exist_ok=True)
+    log_file_name = f"{LOG_FOLDER}/log_{time.strftime('%Y%m%d%H%M%S', time.localtime())}_{random.randint(0, 10000)}.log"
+
+    logger.setLevel(logging.INFO)
 
-# Set the log format
-formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
-console_handler.setFormatter(formatter)
-file_handler.setFormatter(formatter)
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.DEBUG)
+    logger.addHandler(console_handler)
+
+    file_handler = logging.FileHandler(log_file_name)
+    file_handler.setLevel(logging.DEBUG)
+    logger.addHandler(file_handler)
+
+    # Set the log format
+    formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    console_handler.setFormatter(formatter)
+    file_handler.setFormatter(formatter)
+    return log_file_name
 
 
 def config() -> argparse.Namespace:
@@ -85,10 +118,90 @@ def config() -> argparse.Namespace:
     )
     parser.add_argument("--viewport_width", type=int, default=1280)
     parser.add_argument("--viewport_height", type=int, default=720)
+    parser.add_argument(
+        "--render_image_format",
+        type=str,
+        default="png",
+        choices=["png", "webp", "jpeg", "inline"],
+        help="Format of the screenshot files referenced by the render, inline embeds them as base64 PNG",
+    )
     parser.add_argument("--save_trace_enabled", action="store_true")
     parser.add_argument("--sleep_after_execution", type=float, default=0.0)
 
     parser.add_argument("--max_steps", type=int, default=30)
+    parser.add_argument(
+        "--run_store",
+        type=str,
+        default="",
+        help="SQLite file of the task attempts shared by the workers, result_dir/run_store.sqlite3 by default",
+    )
+    parser.add_argument(
+        "--shared_run_store",
+        action="store_true",
+        help="The run store is on storage shared by several hosts",
+    )
+    parser.add_argument(
+        "--lease_seconds",
+        type=float,
+        default=600.0,
+        help="A task whose worker sent no heartbeat for this long is claimed again",
+    )
+    parser.add_argument(
+        "--evaluate_all",
+        action="store_true",
+        help="Run every evaluator of a task instead of stopping at the first zero score",
+    )
+    parser.add_argument(
+        "--eval_queue_size",
+        type=int,
+        default=0,
+        help="Queue up to this many finished tasks to be evaluated while the next episodes run, 0 evaluates each task before the next. Their checks may see the changes of the next episodes to the sites",
+    )
+    parser.add_argument(
+        "--step_timeout",
+        type=float,
+        default=300.0,
+        help="Seconds an agent prediction or a browser step may take, 0 for no limit",
+    )
+    parser.add_argument(
+        "--task_timeout",
+        type=float,
+        default=1800.0,
+        help="Seconds a task may take including its evaluation, 0 for no limit",
+    )
+    parser.add_argument(
+        "--schedule",
+        type=str,
+        default="index",
+        choices=["index", "site_affinity"],
+        help="Run the tasks in index order, or grouped by sites and login state and balanced over the workers by past durations",
+    )
+    parser.add_argument("--num_workers", type=int, default=1)
+    parser.add_argument("--worker_index", type=int, default=0)
+    parser.add_argument(
+        "--cost_run_store",
+        type=str,
+        default="",
+        help="Run store of a past run whose durations estimate the task costs, the run store of this run by default",
+    )
+    parser.add_argument(
+        "--cookie_max_age",
+        type=float,
+        default=0.0,
+        help="Seconds a renewed login is reused by the next tasks with the same login state, 0 renews it for every task",
+    )
+    parser.add_argument(
+        "--worker_id",
+        type=str,
+        default="",
+        help="Name of this worker in the run store, a restarted worker with the same name takes over its unfinished tasks. The host name and the result dir by default, give each worker of one host its own name",
+    )
+    parser.add_argument(
+        "--max_states_in_memory",
+        type=int,
+        default=2,
+        help="Number of the latest states of the trajectory kept in memory, older states are spilled to disk",
+    )
 
     # agent config
     parser.add_argument("--agent_type", type=str, default="prompt")
@@ -116,7 +229,12 @@ def config() -> argparse.Namespace:
     parser.add_argument("--mode", type=str, default="chat")
     parser.add_argument("--temperature", type=float, default=1.0)
     parser.add_argument("--top_p", type=float, default=0.9)
-    parser.add_argument("--context_length", type=int, default=0)
+    parser.add_argument(
+        "--context_length",
+        type=int,
+        help="when not zero, the observation is sized to fill the context window left by the rest of the prompt and the generation",
+        default=0,
+    )
     parser.add_argument("--max_tokens", type=int, default=384)
     parser.add_argument("--stop_token", type=str, default=None)
     parser.add_argument(
@@ -125,6 +243,18 @@ def config() -> argparse.Namespace:
         help="max retry times to perform generations when parsing fails",
         default=1,
     )
+    parser.add_argument(
+        "--n_samples",
+        type=int,
+        help="number of candidate responses to sample in a single generation call, the agent selects among the ones that parse",
+        default=1,
+    )
+    parser.add_argument(
+        "--sample_selection",
+        choices=["first", "vote"],
+        help="how to pick the action when multiple candidates parse: the first one or a majority vote",
+        default="first",
+    )
     parser.add_argument(
         "--max_obs_length",
         type=int,
@@ -137,6 +267,12 @@ def config() -> argparse.Namespace:
         type=str,
         default="",
     )
+    parser.add_argument(
+        "--max_batch_delay",
+        help="when set, requests to the huggingface endpoint go through a shared batching scheduler that waits up to this many seconds to group concurrent prompts",
+        type=float,
+        default=None,
+    )
 
     # example config
     parser.add_argument("--test_start_idx", type=int, default=0)
@@ -221,12 +357,28 @@ def test(
 ) -> None:
     scores = []
     max_steps = args.max_steps
+    run_store = get_run_store(args)
+    worker_id = args.worker_id or default_worker_id(args.result_dir)
+    run_store.abandon_running(worker_id)
+    watchdog = Watchdog(args.step_timeout, args.task_timeout)
 
     early_stop_thresholds = {
         "parsing_failure": args.parsing_failure_th,
         "repeating_action": args.repeating_action_failure_th,
     }
 
+    # serialize at most the part of the page that fits in the prompt,
+    # measured with the agent's tokenizer
+    max_obs_length = 0
+    obs_length_fn = None
+    if isinstance(agent, PromptAgent):
+        # the observation never exceeds either limit
+        max_obs_length = min(
+            [n for n in (args.max_obs_length, args.context_length) if n],
+            default=0,
+        )
+        obs_length_fn = agent.prompt_constructor.token_counter.count_tokens
+
     env = ScriptBrowserEnv(
         headless=not args.render,
         slow_mo=args.slow_mo,
@@ -238,35 +390,185 @@ def test(
         },
         save_trace_enabled=args.save_trace_enabled,
         sleep_after_execution=args.sleep_after_execution,
+        max_obs_length=max_obs_length,
+        obs_length_fn=obs_length_fn,
     )
 
-    for config_file in config_file_list:
-        try:
-            render_helper = RenderHelper(
-                config_file, args.result_dir, args.action_set_tag
+    # renewed login state file -> its path and when it was renewed
+    renewed_logins: dict[str, tuple[str, float]] = {}
+
+    evaluation_stage = None
+    if args.eval_queue_size > 0:
+        evaluation_stage = EvaluationStage(
+            args.eval_queue_size,
+            viewport_size={
+                "width": args.viewport_width,
+                "height": args.viewport_height,
+            },
+            page_timeout=args.step_timeout or 60.0,
+        )
+        evaluation_stage.start()
+
+    def record_result(
+        score: float,
+        evaluator: EvaluatorComb,
+        config_file: str,
+        answer: str,
+        url: str,
+        trajectory_logger: TrajectoryLogger,
+        attempt: dict[str, Any],
+    ) -> None:
+        if args.evaluate_all:
+            logger.info(f"[Evaluator scores] {evaluator.scores}")
+        scores.append(score)
+        trajectory_logger.log_result(score, answer=answer, url=url)
+        attempt.update(
+            status="passed" if score == 1 else "failed",
+            score=score,
+            num_steps=trajectory_logger.num_steps,
+        )
+
+        if score == 1:
+            logger.info(f"[Result] (PASS) {config_file}")
+        else:
+            logger.info(f"[Result] (FAIL) {config_file}")
+
+    def finish_attempt(
+        attempt_id: int,
+        attempt: dict[str, Any],
+        config_file: str,
+        trajectory_logger: TrajectoryLogger | None,
+        render_helper: RenderHelper | None,
+        heartbeat: LeaseHeartbeat,
+        env_time: float,
+        agent_time: float,
+    ) -> None:
+        # None when the task failed before they were created
+        if trajectory_logger is not None:
+            trajectory_logger.close()
+        if render_helper is not None:
+            render_helper.close()
+        heartbeat.stop()
+        if heartbeat.lost:
+            logger.info(
+                f"[Lease lost] {config_file} may have run on another worker"
+            )
+        if not run_store.finish(
+            attempt_id, env_time=env_time, agent_time=agent_time, **attempt
+        ):
+            logger.info(
+                f"[Lease lost] {config_file} was claimed again, its result is not recorded"
+            )
+
+    def finish_evaluation(
+        job: EvaluationJob,
+        attempt_id: int,
+        attempt: dict[str, Any],
+        config_file: str,
+        trajectory_logger: TrajectoryLogger,
+        render_helper: RenderHelper,
+        heartbeat: LeaseHeartbeat,
+        env_time: float,
+        agent_time: float,
+    ) -> None:
+        """Record the result of a task evaluated by the evaluation stage"""
+        if job.error is None:
+            record_result(
+                job.score,
+                job.evaluator,
+                config_file,
+                Evaluator.get_last_action(job.trajectory)["answer"],
+                job.url,
+                trajectory_logger,
+                attempt,
             )
+        else:
+            logger.info(f"[Evaluation Error] {repr(job.error)}")
+            trajectory_logger.log_error(repr(job.error), job.traceback)
+            attempt.update(
+                error_class=type(job.error).__name__, error=repr(job.error)
+            )
+        finish_attempt(
+            attempt_id,
+            attempt,
+            config_file,
+            trajectory_logger,
+            render_helper,
+            heartbeat,
+            env_time,
+            agent_time,
+        )
+
+    # debug runs rerun the tasks that are already done
+    skip_finished = "debug" not in args.result_dir
+    for attempt_id, config_file in run_store.claim_tasks(
+        config_file_list, worker_id, skip_finished=skip_finished
+    ):
+        attempt: dict[str, Any] = {"status": "error"}
+        total_env_time = 0.0
+        total_agent_time = 0.0
+        timed_out = False
+        # the evaluation stage finishes the attempt
+        evaluated_later = False
+        trajectory: MemoryBoundedTrajectory | None = None
+        render_helper: RenderHelper | None = None
+        trajectory_logger: TrajectoryLogger | None = None
+        heartbeat = LeaseHeartbeat(run_store, attempt_id)
+        heartbeat.start()
+        try:
+            # the evaluation and the login renewal count towards the budget,
+            # the handlers below run without it so that a late timeout does
+            # not escape them
+            with watchdog.task():
+                render_helper = RenderHelper(
+                    config_file,
+                    args.result_dir,
+                    args.action_set_tag,
+                    image_format=None
+                    if args.render_image_format == "inline"
+                    else args.render_image_format,
+                )
+                trajectory_logger = TrajectoryLogger(
+                    config_file,
+                    args.result_dir,
+                    args.action_set_tag,
+                    screenshot_writer=render_helper.screenshot_writer,
+                )
 
-            # get intent
-            with open(config_file) as f:
-                _c = json.load(f)
+                # get intent, the login renewal below changes the config
+                _c = get_task_config(config_file)
                 intent = _c["intent"]
                 task_id = _c["task_id"]
                 # automatically login
                 if _c["storage_state"]:
                     cookie_file_name = os.path.basename(_c["storage_state"])
-                    comb = get_site_comb_from_filepath(cookie_file_name)
-                    temp_dir = tempfile.mkdtemp()
-                    # subprocess to renew the cookie
-                    subprocess.run(
-                        [
-                            "python",
-                            "browser_env/auto_login.py",
-                            "--auth_folder",
-                            temp_dir,
-                            "--site_list",
-                            *comb,
-                        ]
+                    renewed_path, renewed_at = renewed_logins.get(
+                        cookie_file_name, ("", 0.0)
                     )
+                    if (
+                        renewed_path
+                        and time.time() - renewed_at < args.cookie_max_age
+                    ):
+                        # reuse the login of the previous task of the group
+                        temp_dir = os.path.dirname(renewed_path)
+                    else:
+                        comb = get_site_comb_from_filepath(cookie_file_name)
+                        temp_dir = tempfile.mkdtemp()
+                        # subprocess to renew the cookie
+                        subprocess.run(
+                            [
+                                "python",
+                                "browser_env/auto_login.py",
+                                "--auth_folder",
+                                temp_dir,
+                                "--site_list",
+                                *comb,
+                            ]
+                        )
+                        renewed_logins[cookie_file_name] = (
+                            f"{temp_dir}/{cookie_file_name}",
+                            time.time(),
+                        )
                     _c["storage_state"] = f"{temp_dir}/{cookie_file_name}"
                     assert os.path.exists(_c["storage_state"])
                     # update the config file
@@ -274,98 +576,234 @@ def test(
                     with open(config_file, "w") as f:
                         json.dump(_c, f)
 
-            logger.info(f"[Config file]: {config_file}")
-            logger.info(f"[Intent]: {intent}")
-
-            agent.reset(config_file)
-            trajectory: Trajectory = []
-            obs, info = env.reset(options={"config_file": config_file})
-            state_info: StateInfo = {"observation": obs, "info": info}
-            trajectory.append(state_info)
-
-            meta_data = {"action_history": ["None"]}
-            while True:
-                early_stop_flag, stop_info = early_stop(
-                    trajectory, max_steps, early_stop_thresholds
-                )
+                logger.info(f"[Config file]: {config_file}")
+                logger.info(f"[Intent]: {intent}")
 
-                if early_stop_flag:
-                    action = create_stop_action(f"Early stop: {stop_info}")
-                else:
-                    try:
-                        action = agent.next_action(
-                            trajectory, intent, meta_data=meta_data
-                        )
-                    except ValueError as e:
-                        # get the error message
-                        action = create_stop_action(f"ERROR: {str(e)}")
-
-                trajectory.append(action)
-
-                action_str = get_action_description(
-                    action,
-                    state_info["info"]["observation_metadata"],
-                    action_set_tag=args.action_set_tag,
-                    prompt_constructor=agent.prompt_constructor
-                    if isinstance(agent, PromptAgent)
-                    else None,
-                )
-                render_helper.render(
-                    action, state_info, meta_data, args.render_screenshot
+                agent.reset(config_file)
+                trajectory = MemoryBoundedTrajectory(
+                    args.max_states_in_memory, spill_dir=args.result_dir
                 )
-                meta_data["action_history"].append(action_str)
-
-                if action["action_type"] == ActionTypes.STOP:
-                    break
-
-                obs, _, terminated, _, info = env.step(action)
-                state_info = {"observation": obs, "info": info}
+                env_start = time.perf_counter()
+                with watchdog.step():
+                    obs, info = env.reset(options={"config_file": config_file})
+                env_time = time.perf_counter() - env_start
+                total_env_time += env_time
+                state_info: StateInfo = {"observation": obs, "info": info}
                 trajectory.append(state_info)
 
-                if terminated:
-                    # add a action place holder
-                    trajectory.append(create_stop_action(""))
-                    break
-
-            evaluator = evaluator_router(config_file)
-            score = evaluator(
-                trajectory=trajectory,
-                config_file=config_file,
-                page=env.page,
-                client=env.get_page_client(env.page),
-            )
-
-            scores.append(score)
-
-            if score == 1:
-                logger.info(f"[Result] (PASS) {config_file}")
-            else:
-                logger.info(f"[Result] (FAIL) {config_file}")
+                meta_data = {"action_history": ["None"]}
+                while True:
+                    early_stop_flag, stop_info = early_stop(
+                        trajectory, max_steps, early_stop_thresholds
+                    )
 
-            if args.save_trace_enabled:
-                env.save_trace(
-                    Path(args.result_dir) / "traces" / f"{task_id}.zip"
+                    agent_start = time.perf_counter()
+                    prompt_stats: dict[str, int] = {}
+                    if early_stop_flag:
+                        action = create_stop_action(f"Early stop: {stop_info}")
+                    else:
+                        try:
+                            with watchdog.step():
+                                action = agent.next_action(
+                                    trajectory, intent, meta_data=meta_data
+                                )
+                            if isinstance(agent, PromptAgent):
+                                prompt_stats = (
+                                    agent.prompt_constructor.prompt_stats
+                                )
+                                logger.info(
+                                    f"[Prompt tokens] {prompt_stats['prompt_tokens']} "
+                                    f"(observation {prompt_stats['observation_tokens']}"
+                                    f"/{prompt_stats['observation_budget']})"
+                                )
+                        except ValueError as e:
+                            # get the error message
+                            action = create_stop_action(f"ERROR: {str(e)}")
+                    agent_time = time.perf_counter() - agent_start
+                    total_agent_time += agent_time
+
+                    trajectory.append(action)
+
+                    action_str = get_action_description(
+                        action,
+                        state_info["info"]["observation_metadata"],
+                        action_set_tag=args.action_set_tag,
+                        prompt_constructor=agent.prompt_constructor
+                        if isinstance(agent, PromptAgent)
+                        else None,
+                    )
+                    render_helper.render(
+                        action, state_info, meta_data, args.render_screenshot
+                    )
+                    trajectory_logger.log_step(
+                        action,
+                        state_info,
+                        meta_data,
+                        action_str,
+                        screenshot=args.render_screenshot,
+                        prompt_stats=prompt_stats,
+                        timings={"env": env_time, "agent": agent_time},
+                    )
+                    meta_data["action_history"].append(action_str)
+
+                    if action["action_type"] == ActionTypes.STOP:
+                        break
+
+                    env_start = time.perf_counter()
+                    with watchdog.step():
+                        obs, _, terminated, _, info = env.step(action)
+                    env_time = time.perf_counter() - env_start
+                    total_env_time += env_time
+                    state_info = {"observation": obs, "info": info}
+                    trajectory.append(state_info)
+
+                    if terminated:
+                        # add a action place holder
+                        trajectory.append(create_stop_action(""))
+                        break
+
+                evaluator = evaluator_router(
+                    _c, evaluate_all=args.evaluate_all
                 )
+                last_action = Evaluator.get_last_action(trajectory)
+                if evaluation_stage is None:
+                    score = evaluator(
+                        trajectory=trajectory,
+                        config_file=_c,
+                        page=env.page,
+                        client=env.get_page_client(env.page),
+                    )
+                    record_result(
+                        score,
+                        evaluator,
+                        config_file,
+                        last_action["answer"],
+                        env.page.url,
+                        trajectory_logger,
+                        attempt,
+                    )
+                else:
+                    # the next reset closes the browser of the episode, the
+                    # evaluation takes what it needs of it now
+                    evaluator.select_last_page(_c, env.page)
+                    job = EvaluationJob(
+                        evaluator,
+                        [last_action],
+                        _c,
+                        env.page.url,
+                        env.context.storage_state(),
+                        on_done=functools.partial(
+                            finish_evaluation,
+                            attempt_id=attempt_id,
+                            attempt=attempt,
+                            config_file=config_file,
+                            trajectory_logger=trajectory_logger,
+                            render_helper=render_helper,
+                            heartbeat=heartbeat,
+                            env_time=total_env_time,
+                            agent_time=total_agent_time,
+                        ),
+                    )
+
+                if args.save_trace_enabled:
+                    env.save_trace(
+                        Path(args.result_dir) / "traces" / f"{task_id}.zip"
+                    )
 
+                if evaluation_stage is not None:
+                    # waits while the queue is full
+                    evaluation_stage.submit(job)
+                    evaluated_later = True
+
+        except EpisodeTimeout as e:
+            logger.info(f"[Timeout] {config_file}: {e}")
+            if trajectory_logger is not None:
+                trajectory_logger.log_error(repr(e), "")
+                trajectory_logger.log_result(0.0)
+            # a task that hangs again when retried would block the run, the
+            # timeout is its result
+            scores.append(0.0)
+            attempt.update(
+                status="failed",
+                score=0.0,
+                error_class=type(e).__name__,
+                error=str(e),
+                num_steps=trajectory_logger.num_steps
+                if trajectory_logger is not None
+                else 0,
+            )
+            timed_out = True
         except openai.error.OpenAIError as e:
             logger.info(f"[OpenAI Error] {repr(e)}")
+            if trajectory_logger is not None:
+                trajectory_logger.log_error(repr(e), "")
+            attempt.update(error_class=type(e).__name__, error=repr(e))
         except Exception as e:
             logger.info(f"[Unhandled Error] {repr(e)}]")
             import traceback
 
+            if trajectory_logger is not None:
+                trajectory_logger.log_error(repr(e), traceback.format_exc())
+            attempt.update(error_class=type(e).__name__, error=repr(e))
+
             # write to error file
             with open(Path(args.result_dir) / "error.txt", "a") as f:
                 f.write(f"[Config file]: {config_file}\n")
                 f.write(f"[Unhandled Error] {repr(e)}\n")
                 f.write(traceback.format_exc())  # write stack trace to file
-
-        render_helper.close()
+        finally:
+            # the states spilled to the result dir, whatever the outcome
+            if trajectory is not None:
+                trajectory.close()
+
+        if not evaluated_later:
+            finish_attempt(
+                attempt_id,
+                attempt,
+                config_file,
+                trajectory_logger,
+                render_helper,
+                heartbeat,
+                total_env_time,
+                total_agent_time,
+            )
+        if evaluation_stage is not None:
+            evaluation_stage.collect()
+        if timed_out:
+            # the browser may be stuck in the call that timed out, the next
+            # task starts a new one
+            with watchdog.task(TEARDOWN_SECONDS):
+                try:
+                    env.close()
+                except Exception as e:
+                    logger.info(f"[Teardown Error] {repr(e)}")
+            env.reset_finished = False
 
     env.close()
-    logger.info(f"Average score: {sum(scores) / len(scores)}")
+    if evaluation_stage is not None:
+        evaluation_stage.close(args.task_timeout or None)
+        if evaluation_stage.running:
+            logger.info(
+                "[Evaluation timeout] the evaluation stage is stuck, the tasks it holds are not recorded"
+            )
+    if scores:
+        logger.info(f"Average score: {sum(scores) / len(scores)}")
+    if get_llm_judge.cache_info().currsize:
+        judge = get_llm_judge()
+        logger.info(
+            f"[Judge cost] ${judge.cost:.4f} for {judge.usage['requests']} "
+            f"requests, {judge.usage['cache_hits']} cached verdicts"
+        )
+    summary = run_store.summary()
+    logger.info(
+        f"[Run summary] {summary['num_passed']}/{summary['num_tasks']} passed, "
+        f"average score {summary['average_score']:.4f}, "
+        f"{summary['num_error_tasks']} tasks with errors"
+    )
+    run_store.close()
 
 
-def prepare(args: argparse.Namespace) -> None:
+def prepare(args: argparse.Namespace, log_file_name: str) -> None:
     # convert prompt python files to json
     from agent.prompts import to_json
 
@@ -387,22 +825,80 @@ def prepare(args: argparse.Namespace) -> None:
 
     # log the log file
     with open(os.path.join(result_dir, "log_files.txt"), "a+") as f:
-        f.write(f"{LOG_FILE_NAME}\n")
-
-
-def get_unfinished(config_files: list[str], result_dir: str) -> list[str]:
-    result_files = glob.glob(f"{result_dir}/*.html")
-    task_ids = [
-        os.path.basename(f).split(".")[0].split("_")[1] for f in result_files
-    ]
-    unfinished_configs = []
-    for config_file in config_files:
-        task_id = os.path.basename(config_file).split(".")[0]
-        if task_id not in task_ids:
-            unfinished_configs.append(config_file)
+        f.write(f"{log_file_name}\n")
+
+
+def get_run_store(args: argparse.Namespace) -> RunStore:
+    return RunStore(
+        args.run_store or Path(args.result_dir) / "run_store.sqlite3",
+        lease_seconds=args.lease_seconds,
+        shared_storage=args.shared_run_store,
+    )
+
+
+def get_unfinished(
+    config_files: list[str], args: argparse.Namespace
+) -> list[str]:
+    run_store = get_run_store(args)
+    if run_store.summary()["attempts"]:
+        unfinished_configs = run_store.unfinished(config_files)
+    else:
+        # a result dir of a run before the run store, the finished tasks
+        # are those with a render
+        task_ids = {
+            f.stem.split("_")[1]
+            for f in Path(args.result_dir).glob("render_*.html")
+        }
+        unfinished_configs = [
+            c
+            for c in config_files
+            if os.path.basename(c).split(".")[0] not in task_ids
+        ]
+    run_store.close()
     return unfinished_configs
 
 
+def get_task_config(config_file: str) -> dict[str, Any]:
+    """The config of a task, read from the file the env and the agent read
+
+    The scheduling groups the tasks with the task catalog, a config file
+    that differs from its task in the catalog is an error.
+    """
+    with open(config_file, "r") as f:
+        task_config: dict[str, Any] = json.load(f)
+    catalog = get_task_catalog()
+    task_id = task_config["task_id"]
+    if task_id in catalog and catalog[task_id] != task_config:
+        raise ValueError(
+            f"{config_file} differs from task {task_id} of {catalog.raw_path}, "
+            "regenerate the config file"
+        )
+    return task_config
+
+
+def schedule_config_files(
+    config_files: list[str], args: argparse.Namespace
+) -> list[str]:
+    """Order the tasks of this worker by site affinity"""
+    task_ids = [int(os.path.basename(c).split(".")[0]) for c in config_files]
+    config_file_of = dict(zip(task_ids, config_files))
+    groups = group_tasks(task_ids, get_task_catalog().__getitem__)
+    cost_store = (
+        RunStore(args.cost_run_store)
+        if args.cost_run_store
+        else get_run_store(args)
+    )
+    costs = estimate_costs(groups, cost_store.task_durations())
+    cost_store.close()
+    schedule = schedule_tasks(groups, costs, args.num_workers)
+    logger.info(
+        f"[Schedule] {len(groups)} site groups, worker {args.worker_index} "
+        f"runs {len(schedule[args.worker_index])} tasks first"
+    )
+    order = get_worker_order(schedule, args.worker_index)
+    return [config_file_of[task_id] for task_id in order]
+
+
 def dump_config(args: argparse.Namespace) -> None:
     config_file = Path(args.result_dir) / "config.json"
     if not config_file.exists():
@@ -412,17 +908,26 @@ def dump_config(args: argparse.Namespace) -> None:
 
 
 if __name__ == "__main__":
+    check_site_urls()
+    log_file_name = setup_logging()
     args = config()
     args.sleep_after_execution = 2.0
-    prepare(args)
+    prepare(args, log_file_name)
 
     test_file_list = []
     st_idx = args.test_start_idx
     ed_idx = args.test_end_idx
     for i in range(st_idx, ed_idx):
-        test_file_list.append(f"config_files/{i}.json")
+        config_file = f"config_files/{i}.json"
+        if not os.path.exists(config_file):
+            # fill in the urls of the task from the raw catalog
+            get_task_catalog().write_config_file(i, "config_files")
+        test_file_list.append(config_file)
     if "debug" not in args.result_dir:
-        test_file_list = get_unfinished(test_file_list, args.result_dir)
+        test_file_list = get_unfinished(test_file_list, args)
+
+    if args.schedule == "site_affinity":
+        test_file_list = schedule_config_files(test_file_list, args)
 
     if len(test_file_list) == 0:
         logger.info("No task left to run")
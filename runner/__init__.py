@@ -0,0 +1,40 @@
+from typing import TYPE_CHECKING, Any
+
+from .report import build_report, merge_run_stores
+from .run_store import LeaseHeartbeat, RunStore, default_worker_id
+from .scheduling import (
+    estimate_costs,
+    get_worker_order,
+    group_tasks,
+    schedule_tasks,
+)
+from .watchdog import EpisodeTimeout, Watchdog
+
+if TYPE_CHECKING:
+    from .evaluation import EvaluationJob, EvaluationStage
+
+__all__ = [
+    "EpisodeTimeout",
+    "EvaluationJob",
+    "EvaluationStage",
+    "LeaseHeartbeat",
+    "RunStore",
+    "Watchdog",
+    "build_report",
+    "default_worker_id",
+    "estimate_costs",
+    "get_worker_order",
+    "group_tasks",
+    "merge_run_stores",
+    "schedule_tasks",
+]
+
+
+def __getattr__(name: str) -> Any:
+    # the evaluation stage imports the browser and the evaluators, which
+    # the tools reading the run store do not need
+    if name in ("EvaluationJob", "EvaluationStage"):
+        from . import evaluation
+
+        return getattr(evaluation, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
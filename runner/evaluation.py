@@ -0,0 +1,167 @@
+"""Evaluate finished episodes while the next episode runs
+
+Evaluating a task, e.g. opening the pages of its program_html checks or
+asking the LLM judge, used to keep the worker from starting the next task.
+The stage evaluates in a thread of its own, with its own browser, so the
+environment can start the next episode right away.
+
+Playwright objects belong to the thread that created them, and the next
+reset closes the browser of the episode, so the evaluation cannot use the
+episode's page. Before handing a task over, the worker selects the
+elements of the "last" targets on that page, see
+`EvaluatorComb.select_last_page`, and saves the cookies of its context.
+The stage then evaluates on a page of a new context with those cookies
+and the final url of the episode, which no later episode touches.
+
+stage = EvaluationStage(max_pending=2)
+stage.start()
+stage.submit(EvaluationJob(evaluator, trajectory, config, url, cookies, on_done))
+for job in stage.collect():  # in the worker, between the episodes
+    ...
+stage.close()
+
+The queue of pending tasks is bounded, `submit` blocks when it is full so
+that a slow evaluation holds the worker back instead of piling up. The
+watchdog of the worker does not reach the stage thread: the page calls of
+the stage time out after `page_timeout` seconds, the judge requests after
+those of the judge, and `close` waits at most `timeout` seconds.
+"""
+import queue
+import threading
+import traceback
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from playwright.sync_api import (
+    Browser,
+    BrowserContext,
+    Playwright,
+    ViewportSize,
+    sync_playwright,
+)
+
+from evaluation_harness.evaluators import (
+    EvaluatorComb,
+    HTMLContentEvaluator,
+    Trajectory,
+)
+from evaluation_harness.helper_functions import PseudoPage
+
+
+@dataclass
+class EvaluationJob:
+    evaluator: EvaluatorComb
+    # the evaluators only read the last action of the trajectory
+    trajectory: Trajectory
+    config: dict[str, Any]
+    # final url of the episode and the storage state of its context
+    url: str
+    storage_state: Any
+    # called in the worker by `collect` once the job is evaluated
+    on_done: Callable[["EvaluationJob"], None]
+    score: float = 0.0
+    error: Exception | None = None
+    traceback: str = ""
+
+
+class EvaluationStage(object):
+    def __init__(
+        self,
+        max_pending: int = 2,
+        headless: bool = True,
+        viewport_size: ViewportSize = {"width": 1280, "height": 720},
+        page_timeout: float = 60.0,
+    ) -> None:
+        self.headless = headless
+        self.viewport_size = viewport_size
+        self.page_timeout = page_timeout
+        self._jobs: queue.Queue[EvaluationJob | None] = queue.Queue(
+            max_pending
+        )
+        self._done: queue.Queue[EvaluationJob] = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="evaluation", daemon=True
+        )
+        self._playwright: Playwright | None = None
+        self._browser: Browser | None = None
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def submit(self, job: EvaluationJob) -> None:
+        """Queue the job, waiting while `max_pending` jobs are queued"""
+        self._jobs.put(job)
+
+    def collect(self) -> list[EvaluationJob]:
+        """Call `on_done` of the jobs evaluated since the last call"""
+        jobs = []
+        while True:
+            try:
+                job = self._done.get_nowait()
+            except queue.Empty:
+                break
+            job.on_done(job)
+            jobs.append(job)
+        return jobs
+
+    @property
+    def running(self) -> bool:
+        return self._thread.is_alive()
+
+    def close(self, timeout: float | None = None) -> list[EvaluationJob]:
+        """Wait up to `timeout` seconds for the pending jobs, collect them
+
+        The jobs still pending afterwards are not collected, `running`
+        tells whether the stage thread is stuck in one of them.
+        """
+        if self._thread.is_alive():
+            self._jobs.put(None, timeout=timeout)
+            self._thread.join(timeout)
+        return self.collect()
+
+    def _new_context(self, job: EvaluationJob) -> BrowserContext:
+        if self._browser is None:
+            self._playwright = sync_playwright().start()
+            self._browser = self._playwright.chromium.launch(
+                headless=self.headless
+            )
+        context = self._browser.new_context(
+            viewport=self.viewport_size,
+            storage_state=job.storage_state,
+            geolocation=job.config.get("geolocation"),
+            device_scale_factor=1,
+        )
+        context.set_default_timeout(self.page_timeout * 1000)
+        return context
+
+    def _evaluate(self, job: EvaluationJob) -> None:
+        # only program_html checks open pages, the others read the url
+        needs_browser = any(
+            isinstance(evaluator, HTMLContentEvaluator)
+            for evaluator in job.evaluator.evaluators
+        )
+        context = self._new_context(job) if needs_browser else None
+        try:
+            job.score = job.evaluator(
+                trajectory=job.trajectory,
+                config_file=job.config,
+                page=PseudoPage(
+                    context.new_page() if context else None, job.url
+                ),
+            )
+        finally:
+            if context is not None:
+                context.close()
+
+    def _run(self) -> None:
+        while (job := self._jobs.get()) is not None:
+            try:
+                self._evaluate(job)
+            except Exception as e:
+                job.error = e
+                job.traceback = traceback.format_exc()
+            self._done.put(job)
+        if self._browser is not None:
+            self._browser.close()
+        if self._playwright is not None:
+            self._playwright.stop()
@@ -0,0 +1,129 @@
+"""Merge the run stores of several nodes and report the results of a run
+
+Nodes sharing one store need no merge. Nodes that each kept a store of
+their own, e.g. because they had no shared storage, are merged into one
+store first. Merging is idempotent, an attempt already in the target is
+not copied again.
+
+python -m runner.report --run_store node0.sqlite3 node1.sqlite3 \
+    --merged_store merged.sqlite3 --output report.json
+"""
+import argparse
+import json
+from pathlib import Path
+from typing import Any
+
+from runner.run_store import FAILED, PASSED, RunStore
+
+ATTEMPT_COLUMNS = [
+    "task_id",
+    "config_file",
+    "worker",
+    "status",
+    "score",
+    "error_class",
+    "error",
+    "num_steps",
+    "env_time",
+    "agent_time",
+    "started_at",
+    "finished_at",
+    "lease_expires",
+]
+
+
+def merge_run_stores(
+    sources: list[str | Path], target: str | Path
+) -> RunStore:
+    """Copy the attempts of the source stores into the target store"""
+    run_store = RunStore(target)
+    columns = ", ".join(ATTEMPT_COLUMNS)
+    for source in sources:
+        # brings the schema of old stores up to date
+        RunStore(source).close()
+        run_store.conn.execute("ATTACH DATABASE ? AS source", (str(source),))
+        try:
+            run_store.conn.execute(
+                f"""
+                INSERT INTO attempts ({columns})
+                SELECT {columns} FROM source.attempts AS s
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM attempts AS t
+                    WHERE t.task_id = s.task_id AND t.worker = s.worker
+                    AND t.started_at = s.started_at
+                )
+                ORDER BY s.started_at
+                """
+            )
+        finally:
+            run_store.conn.execute("DETACH DATABASE source")
+    return run_store
+
+
+def build_report(run_store: RunStore) -> dict[str, Any]:
+    """Summary of the run and the latest result of every task"""
+    run_store.reclaim_expired()
+    tasks = {}
+    for row in run_store.conn.execute(
+        """
+        SELECT task_id, status, score, worker, error_class, num_steps,
+        finished_at - started_at AS duration,
+        (SELECT COUNT(*) FROM attempts WHERE task_id = a.task_id)
+        AS num_attempts
+        FROM attempts AS a
+        WHERE id = (
+            SELECT id FROM attempts WHERE task_id = a.task_id
+            ORDER BY status IN (?, ?) DESC, id DESC LIMIT 1
+        )
+        ORDER BY task_id
+        """,
+        (PASSED, FAILED),
+    ):
+        tasks[row["task_id"]] = {
+            key: row[key] for key in row.keys() if key != "task_id"
+        }
+    workers = {
+        row["worker"]: row["n"]
+        for row in run_store.conn.execute(
+            "SELECT worker, COUNT(*) AS n FROM attempts WHERE status IN (?, ?) GROUP BY worker",
+            (PASSED, FAILED),
+        )
+    }
+    return {"summary": run_store.summary(), "workers": workers, "tasks": tasks}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Merge run stores and write one report of the run"
+    )
+    parser.add_argument("--run_store", type=str, nargs="+", required=True)
+    parser.add_argument(
+        "--merged_store",
+        type=str,
+        default="",
+        help="Store to merge several run stores into",
+    )
+    parser.add_argument("--output", type=str, default="report.json")
+    args = parser.parse_args()
+
+    if len(args.run_store) > 1 or args.merged_store:
+        if not args.merged_store:
+            parser.error("merging several run stores needs --merged_store")
+        run_store = merge_run_stores(args.run_store, args.merged_store)
+    else:
+        run_store = RunStore(args.run_store[0])
+    report = build_report(run_store)
+    run_store.close()
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    summary = report["summary"]
+    print(
+        f"{summary['num_passed']}/{summary['num_tasks']} passed, "
+        f"average score {summary['average_score']:.4f}, "
+        f"{summary['num_error_tasks']} tasks with errors, "
+        f"report written to {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""SQLite store of the task attempts of a run
+
+Every attempt to run a task is one row with its status, score, error,
+timings and the worker that ran it. Workers claim a task in a transaction,
+so several processes sharing the store never run the same task at once.
+A task is done once it has a `passed` or `failed` attempt. Tasks whose
+attempts ended in an `error` are claimed again.
+
+A running attempt holds a lease on its task that the worker renews with
+heartbeats. When a worker dies, e.g. its host goes down, the lease expires
+and the next worker that comes across the task records the attempt as an
+error and claims the task again. Workers on several hosts can share a store
+on shared storage; open it with `shared_storage=True` there, since the WAL
+journal only works between processes of one host.
+"""
+import os
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterator
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS attempts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_id INTEGER NOT NULL,
+    config_file TEXT NOT NULL,
+    worker TEXT NOT NULL,
+    -- running, passed, failed, error or discarded
+    status TEXT NOT NULL,
+    score REAL,
+    error_class TEXT,
+    error TEXT,
+    num_steps INTEGER,
+    env_time REAL,
+    agent_time REAL,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    -- a running attempt whose lease expired is reclaimed
+    lease_expires REAL
+);
+CREATE INDEX IF NOT EXISTS attempts_task_id ON attempts (task_id, status);
+"""
+
+RUNNING = "running"
+PASSED = "passed"
+FAILED = "failed"
+ERROR = "error"
+DISCARDED = "discarded"
+# statuses that take a task out of the queue
+CLAIMED_STATUSES = (RUNNING, PASSED, FAILED)
+LEASE_EXPIRED = "LeaseExpired"
+
+
+def get_task_id(config_file: str) -> int:
+    return int(os.path.basename(config_file).split(".")[0])
+
+
+def default_worker_id(result_dir: str | Path) -> str:
+    """Name of the worker of `result_dir` on this host
+
+    The name is the same after a restart, so that the worker takes over its
+    unfinished tasks. Several workers of one result dir on the same host
+    need names of their own.
+    """
+    return f"{socket.gethostname()}:{Path(result_dir).resolve()}"
+
+
+class RunStore(object):
+    def __init__(
+        self,
+        db_path: str | Path,
+        timeout: float = 60.0,
+        lease_seconds: float = 600.0,
+        shared_storage: bool = False,
+    ) -> None:
+        self.db_path = Path(db_path)
+        self.lease_seconds = lease_seconds
+        self.shared_storage = shared_storage
+        # autocommit, transactions are opened explicitly
+        self.conn = sqlite3.connect(
+            self.db_path, timeout=timeout, isolation_level=None
+        )
+        self.conn.row_factory = sqlite3.Row
+        if not shared_storage:
+            # readers do not block the writer and the other way around
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        columns = {
+            row["name"]
+            for row in self.conn.execute("PRAGMA table_info(attempts)")
+        }
+        if "lease_expires" not in columns:
+            # store created before leases, its attempts never expire
+            self.conn.execute(
+                "ALTER TABLE attempts ADD COLUMN lease_expires REAL"
+            )
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def claim(
+        self, config_file: str, worker: str, skip_finished: bool = True
+    ) -> int | None:
+        """Start an attempt at the task unless it is running or done
+
+        With `skip_finished=False` a done task is claimed again.
+        Return the id of the attempt, None if the task is not available.
+        """
+        task_id = get_task_id(config_file)
+        statuses = CLAIMED_STATUSES if skip_finished else (RUNNING,)
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            self._expire_leases(now, task_id)
+            taken = self.conn.execute(
+                f"SELECT 1 FROM attempts WHERE task_id = ? AND status IN ({', '.join('?' * len(statuses))})",
+                (task_id, *statuses),
+            ).fetchone()
+            attempt_id = None
+            if taken is None:
+                attempt_id = self.conn.execute(
+                    "INSERT INTO attempts (task_id, config_file, worker, status, started_at, lease_expires) VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        task_id,
+                        config_file,
+                        worker,
+                        RUNNING,
+                        now,
+                        now + self.lease_seconds,
+                    ),
+                ).lastrowid
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return attempt_id
+
+    def claim_tasks(
+        self, config_files: list[str], worker: str, skip_finished: bool = True
+    ) -> Iterator[tuple[int, str]]:
+        """Claim the available tasks one at a time, in order"""
+        for config_file in config_files:
+            attempt_id = self.claim(config_file, worker, skip_finished)
+            if attempt_id is not None:
+                yield attempt_id, config_file
+
+    def _expire_leases(self, now: float, task_id: int | None = None) -> int:
+        query = "UPDATE attempts SET status = ?, error_class = ?, finished_at = ? WHERE status = ? AND lease_expires < ?"
+        params: tuple[Any, ...] = (ERROR, LEASE_EXPIRED, now, RUNNING, now)
+        if task_id is not None:
+            query += " AND task_id = ?"
+            params += (task_id,)
+        return self.conn.execute(query, params).rowcount
+
+    def reclaim_expired(self) -> int:
+        """Mark the running attempts whose lease expired as errors"""
+        return self._expire_leases(time.time())
+
+    def heartbeat(self, attempt_id: int) -> bool:
+        """Renew the lease of a running attempt
+
+        Return False if the attempt lost its lease, the task may then be
+        running on another worker.
+        """
+        now = time.time()
+        return (
+            self.conn.execute(
+                "UPDATE attempts SET lease_expires = ? WHERE id = ? AND status = ?",
+                (now + self.lease_seconds, attempt_id, RUNNING),
+            ).rowcount
+            == 1
+        )
+
+    def finish(
+        self,
+        attempt_id: int,
+        status: str,
+        score: float | None = None,
+        error_class: str | None = None,
+        error: str | None = None,
+        num_steps: int | None = None,
+        env_time: float | None = None,
+        agent_time: float | None = None,
+    ) -> bool:
+        """Record the outcome of a running attempt
+
+        Return False if the attempt is no longer running, e.g. its lease
+        expired and the task was claimed again; its outcome is then dropped
+        so that it does not overwrite the result of the new attempt.
+        """
+        return (
+            self.conn.execute(
+                "UPDATE attempts SET status = ?, score = ?, error_class = ?, error = ?, num_steps = ?, env_time = ?, agent_time = ?, finished_at = ? WHERE id = ? AND status = ?",
+                (
+                    status,
+                    score,
+                    error_class,
+                    error,
+                    num_steps,
+                    env_time,
+                    agent_time,
+                    time.time(),
+                    attempt_id,
+                    RUNNING,
+                ),
+            ).rowcount
+            == 1
+        )
+
+    def abandon_running(self, worker: str) -> int:
+        """Mark the running attempts of a worker that restarted as errors"""
+        return self.conn.execute(
+            "UPDATE attempts SET status = ?, error_class = 'Abandoned', finished_at = ? WHERE worker = ? AND status = ?",
+            (ERROR, time.time(), worker, RUNNING),
+        ).rowcount
+
+    def discard(self, task_ids: list[int]) -> int:
+        """Discard the results of the tasks so that they run again"""
+        return self.conn.executemany(
+            "UPDATE attempts SET status = ? WHERE task_id = ? AND status IN (?, ?)",
+            [(DISCARDED, task_id, PASSED, FAILED) for task_id in task_ids],
+        ).rowcount
+
+    def unfinished(self, config_files: list[str]) -> list[str]:
+        done = {
+            row["task_id"]
+            for row in self.conn.execute(
+                "SELECT DISTINCT task_id FROM attempts WHERE status IN (?, ?)",
+                (PASSED, FAILED),
+            )
+        }
+        return [c for c in config_files if get_task_id(c) not in done]
+
+    def error_tasks(self) -> list[int]:
+        """Tasks without a result whose last attempt ended in an error"""
+        return [
+            row["task_id"]
+            for row in self.conn.execute(
+                """
+                SELECT task_id FROM attempts AS a
+                WHERE id = (SELECT MAX(id) FROM attempts WHERE task_id = a.task_id)
+                AND status = ?
+                ORDER BY task_id
+                """,
+                (ERROR,),
+            )
+        ]
+
+    def results(self) -> dict[int, float]:
+        """Score of every done task, from its latest result"""
+        return {
+            row["task_id"]: row["score"]
+            for row in self.conn.execute(
+                """
+                SELECT task_id, score FROM attempts AS a
+                WHERE id = (
+                    SELECT MAX(id) FROM attempts
+                    WHERE task_id = a.task_id AND status IN (?, ?)
+                )
+                ORDER BY task_id
+                """,
+                (PASSED, FAILED),
+            )
+        }
+
+    def task_durations(self) -> dict[int, float]:
+        """Mean duration in seconds of the attempts of each task that finished"""
+        return {
+            row["task_id"]: row["duration"]
+            for row in self.conn.execute(
+                "SELECT task_id, AVG(finished_at - started_at) AS duration FROM attempts WHERE status IN (?, ?) GROUP BY task_id",
+                (PASSED, FAILED),
+            )
+        }
+
+    def summary(self) -> dict[str, Any]:
+        results = self.results()
+        counts = {
+            row["status"]: row["n"]
+            for row in self.conn.execute(
+                "SELECT status, COUNT(*) AS n FROM attempts GROUP BY status"
+            )
+        }
+        return {
+            "num_tasks": len(results),
+            "num_passed": sum(score == 1 for score in results.values()),
+            "average_score": sum(results.values()) / len(results)
+            if results
+            else 0.0,
+            "num_error_tasks": len(self.error_tasks()),
+            "attempts": counts,
+        }
+
+
+class LeaseHeartbeat(object):
+    """Renew the lease of an attempt from a background thread
+
+    The thread opens its own connection to the store, so the heartbeats go
+    on while the worker is busy in a long step.
+
+    with LeaseHeartbeat(run_store, attempt_id):
+        ...
+    """
+
+    def __init__(
+        self,
+        run_store: RunStore,
+        attempt_id: int,
+        interval: float | None = None,
+    ) -> None:
+        self.db_path = run_store.db_path
+        self.lease_seconds = run_store.lease_seconds
+        self.shared_storage = run_store.shared_storage
+        self.attempt_id = attempt_id
+        self.interval = interval or self.lease_seconds / 3
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        run_store = RunStore(
+            self.db_path,
+            lease_seconds=self.lease_seconds,
+            shared_storage=self.shared_storage,
+        )
+        try:
+            while not self._stop.wait(self.interval):
+                if not run_store.heartbeat(self.attempt_id):
+                    self.lost = True
+                    break
+        finally:
+            run_store.close()
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def __enter__(self) -> "LeaseHeartbeat":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
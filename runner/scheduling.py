@@ -0,0 +1,109 @@
+"""Site-affinity scheduling of the tasks over the workers of a run
+
+Tasks that use the same sites and login state are grouped so that a worker
+runs them back to back and keeps its cookies and caches warm. Groups are
+assigned to workers longest-processing-time first using the durations of
+past attempts, splitting groups that are larger than a fair share.
+"""
+import heapq
+import math
+import os
+from collections import defaultdict
+from typing import Any, Callable
+
+TaskGroupKey = tuple[str, ...]
+
+
+def get_task_group_key(config: dict[str, Any]) -> TaskGroupKey:
+    """The sites of the task and the login state it starts from"""
+    storage_state = os.path.basename(config.get("storage_state") or "")
+    return (*sorted(config["sites"]), storage_state)
+
+
+def group_tasks(
+    task_ids: list[int], get_config: Callable[[int], dict[str, Any]]
+) -> dict[TaskGroupKey, list[int]]:
+    groups: dict[TaskGroupKey, list[int]] = defaultdict(list)
+    for task_id in task_ids:
+        groups[get_task_group_key(get_config(task_id))].append(task_id)
+    return dict(groups)
+
+
+def estimate_costs(
+    groups: dict[TaskGroupKey, list[int]],
+    durations: dict[int, float],
+    default_cost: float = 1.0,
+) -> dict[int, float]:
+    """Cost of every task, its past duration if known
+
+    Tasks without a past duration cost the mean duration of their group, or
+    of all tasks when no task of the group ran before.
+    """
+    known = [
+        durations[t] for ts in groups.values() for t in ts if t in durations
+    ]
+    overall = sum(known) / len(known) if known else default_cost
+    costs = {}
+    for task_ids in groups.values():
+        group_known = [durations[t] for t in task_ids if t in durations]
+        group_cost = (
+            sum(group_known) / len(group_known) if group_known else overall
+        )
+        for task_id in task_ids:
+            costs[task_id] = durations.get(task_id, group_cost)
+    return costs
+
+
+def schedule_tasks(
+    groups: dict[TaskGroupKey, list[int]],
+    costs: dict[int, float],
+    num_workers: int,
+) -> list[list[int]]:
+    """Assign the groups to the workers, return the tasks of each worker
+
+    Groups costing more than a fair share are split into chunks of about a
+    share. Chunks are then given, most expensive first, to the least loaded
+    worker. The tasks of a chunk stay together, most expensive first.
+    """
+    total = sum(costs[t] for ts in groups.values() for t in ts)
+    share = total / num_workers if num_workers else total
+    chunks: list[tuple[float, list[int]]] = []
+    for key in sorted(groups):
+        task_ids = sorted(groups[key], key=lambda t: (-costs[t], t))
+        group_cost = sum(costs[t] for t in task_ids)
+        num_chunks = (
+            max(1, math.ceil(group_cost / share - 1e-9)) if share else 1
+        )
+        # deal the tasks round robin so the chunks cost about the same
+        for i in range(num_chunks):
+            chunk = task_ids[i::num_chunks]
+            if chunk:
+                chunks.append((sum(costs[t] for t in chunk), chunk))
+    chunks.sort(key=lambda c: -c[0])
+
+    schedule: list[list[int]] = [[] for _ in range(num_workers)]
+    loads = [(0.0, worker) for worker in range(num_workers)]
+    for cost, chunk in chunks:
+        load, worker = heapq.heappop(loads)
+        schedule[worker].extend(chunk)
+        heapq.heappush(loads, (load + cost, worker))
+    return schedule
+
+
+def get_worker_order(
+    schedule: list[list[int]], worker_index: int
+) -> list[int]:
+    """The tasks of the worker, followed by the tasks of the other workers
+
+    Once its own share is done, a worker steals from the others, starting
+    with the next worker. The run store keeps two workers from claiming the
+    same task, and covers tasks that workers with slightly different cost
+    estimates both left out.
+    """
+    order = list(schedule[worker_index])
+    num_workers = len(schedule)
+    for offset in range(1, num_workers):
+        other = schedule[(worker_index + offset) % num_workers]
+        # steal from the end, the tasks the other worker reaches last
+        order.extend(reversed(other))
+    return order
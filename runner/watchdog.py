@@ -0,0 +1,126 @@
+"""Wall-clock budgets of a task and of each of its steps
+
+A hung `page.goto` or a request to the LLM that never returns blocks the
+worker forever. The watchdog arms SIGALRM for the nearest deadline and
+raises `EpisodeTimeout` in the main thread when it passes, which unwinds
+whatever call the worker is stuck in. The browser may be left in any
+state, so the caller tears it down before the next task.
+
+watchdog = Watchdog(step_seconds=300, task_seconds=1800)
+watchdog.start_task()
+with watchdog.step():
+    env.step(action)
+watchdog.end_task()
+
+Signals only reach the main thread and do not exist on Windows, there the
+watchdog does nothing.
+"""
+import signal
+import threading
+import time
+from contextlib import AbstractContextManager, contextmanager
+from types import FrameType
+from typing import Any, Iterator
+
+
+class EpisodeTimeout(BaseException):
+    """Raised in the main thread when a budget is spent
+
+    It derives from BaseException, like KeyboardInterrupt, so that the
+    `except Exception` of the interrupted code, e.g. the action execution
+    of the environment, does not swallow it.
+    """
+
+    def __init__(self, scope: str, seconds: float) -> None:
+        super().__init__(f"The {scope} took longer than {seconds:.0f}s")
+        self.scope = scope
+        self.seconds = seconds
+
+
+class Watchdog(object):
+    def __init__(
+        self, step_seconds: float = 0.0, task_seconds: float = 0.0
+    ) -> None:
+        """Budgets in seconds, 0 for no budget"""
+        self.step_seconds = step_seconds
+        self.task_seconds = task_seconds
+        self.enabled = (
+            hasattr(signal, "SIGALRM")
+            and threading.current_thread() is threading.main_thread()
+        )
+        self._in_task = False
+        self._previous_handler: Any = None
+        # scope -> deadline and budget, of the task and of the current step
+        self._deadlines: dict[str, tuple[float, float]] = {}
+
+    def _arm(self) -> None:
+        if not self._deadlines:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            return
+        deadline = min(d for d, _ in self._deadlines.values())
+        # an expired deadline still fires, right away
+        delay = max(deadline - time.monotonic(), 1e-3)
+        signal.setitimer(signal.ITIMER_REAL, delay)
+
+    def _on_alarm(self, signum: int, frame: FrameType | None) -> None:
+        if not self._deadlines:
+            # fired while the budget was being lifted
+            return
+        scope, (_, seconds) = min(
+            self._deadlines.items(), key=lambda item: item[1][0]
+        )
+        # the budgets are spent, nothing fires again while unwinding
+        self._deadlines.clear()
+        raise EpisodeTimeout(scope, seconds)
+
+    @contextmanager
+    def _budget(self, scope: str, seconds: float) -> Iterator[None]:
+        if not self._in_task or seconds <= 0:
+            yield
+            return
+        self._deadlines[scope] = (time.monotonic() + seconds, seconds)
+        self._arm()
+        try:
+            yield
+        finally:
+            self._deadlines.pop(scope, None)
+            self._arm()
+
+    def start_task(self, seconds: float | None = None) -> None:
+        """Start the task budget, or a budget of `seconds`"""
+        if not self.enabled or self._in_task:
+            return
+        self._previous_handler = signal.signal(signal.SIGALRM, self._on_alarm)
+        self._in_task = True
+        seconds = self.task_seconds if seconds is None else seconds
+        if seconds > 0:
+            self._deadlines["task"] = (time.monotonic() + seconds, seconds)
+            self._arm()
+
+    def end_task(self) -> None:
+        if not self._in_task:
+            return
+        self._in_task = False
+        self._deadlines.clear()
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, self._previous_handler)
+
+    @contextmanager
+    def task(self, seconds: float | None = None) -> Iterator[None]:
+        """Enforce the task budget, or `seconds`, on the block"""
+        self.start_task(seconds)
+        try:
+            yield
+        finally:
+            self.end_task()
+
+    def step(
+        self, seconds: float | None = None
+    ) -> AbstractContextManager[None]:
+        """Enforce the step budget, or `seconds`, on the block
+
+        Only effective within a task, the task deadline still applies.
+        """
+        return self._budget(
+            "step", self.step_seconds if seconds is None else seconds
+        )
@@ -0,0 +1,151 @@
+"""Microbenchmarks of the per-step prompt construction path.
+
+Times prompt construction, url rewriting and action extraction, and the
+previous regex-based action extraction for comparison. Run from the
+repository root:
+
+python scripts/bench_prompt_constructor.py --obs_lines 2000
+"""
+import argparse
+import json
+import re
+import tempfile
+import timeit
+from pathlib import Path
+from typing import Callable
+
+from agent.prompts import CoTPromptConstructor
+from agent.prompts.prompt_constructor import find_between
+from agent.prompts.raw.p_cot_id_actree_2s import prompt as cot_prompt
+from browser_env import DetachedPage
+from browser_env.env_config import URL_MAPPINGS
+from llms.lm_config import LMConfig
+from llms.tokenizers import Tokenizer
+
+
+class WhitespaceTokenizer(Tokenizer):
+    """Offline stand-in, one token per whitespace separated word"""
+
+    def __init__(self) -> None:
+        self.provider = "whitespace"
+
+    def encode(self, text: str) -> list[int]:
+        return [len(word) for word in text.split()]
+
+    def decode(self, ids: list[int]) -> str:
+        return " ".join("x" * i for i in ids)
+
+
+def regex_extract_action(response: str, action_splitter: str) -> str | None:
+    pattern = rf"{action_splitter}((.|\n)*?){action_splitter}"
+    match = re.search(pattern, response)
+    return match.group(1).strip() if match else None
+
+
+def report(name: str, fn: Callable[[], object], number: int) -> None:
+    best = min(timeit.repeat(fn, number=number, repeat=5)) / number
+    print(f"{name:<32} {best * 1e6:>12.1f} us")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--mode", choices=["chat", "completion"], default="chat"
+    )
+    parser.add_argument("--obs_lines", type=int, default=1000)
+    parser.add_argument("--reasoning_lines", type=int, default=200)
+    parser.add_argument("--number", type=int, default=100)
+    parser.add_argument(
+        "--tokenizer",
+        type=str,
+        default="",
+        help="OpenAI model whose tokenizer is used, a whitespace tokenizer if empty",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        instruction_path = Path(tmp_dir) / "p_cot_id_actree_2s.json"
+        with open(instruction_path, "w") as f:
+            json.dump(cot_prompt, f)
+        lm_config = LMConfig(
+            provider="openai",
+            model=args.tokenizer or "gpt-3.5-turbo",
+            mode=args.mode,
+            gen_config={
+                "max_obs_length": 0,
+                "context_length": 4096,
+                "max_tokens": 384,
+            },
+        )
+        tokenizer = (
+            Tokenizer("openai", args.tokenizer)
+            if args.tokenizer
+            else WhitespaceTokenizer()
+        )
+        constructor = CoTPromptConstructor(
+            instruction_path, lm_config, tokenizer
+        )
+
+    local_url = next(iter(URL_MAPPINGS))
+    obs = "\n".join(
+        f"[{i}] link 'Product number {i} ({local_url}/item/{i})'"
+        for i in range(args.obs_lines)
+    )
+    trajectory = [
+        {
+            "observation": {"text": obs},
+            "info": {
+                "page": DetachedPage(f"{local_url}/catalog?page=2", ""),
+                "observation_metadata": {},
+            },
+        }
+    ]
+    meta_data = {"action_history": ["None"]}
+    action_splitter: str = cot_prompt["meta_data"]["action_splitter"]  # type: ignore[index]
+    reasoning = (
+        "Let's think step-by-step. The page lists products.\n"
+        * args.reasoning_lines
+    )
+    action = f"goto [{URL_MAPPINGS[local_url]}/item/3]"
+    responses = {
+        "answer last": f"{reasoning}In summary, the next action I will "
+        f"perform is {action_splitter}{action}{action_splitter}",
+        "long action": f"{action_splitter}type [12] [{reasoning}] [1]"
+        f"{action_splitter}",
+        "unterminated": f"{action_splitter}{reasoning}",
+    }
+    real_url = constructor.map_url_to_real(obs)
+
+    constructor.construct(trajectory, "Buy a product", meta_data)  # type: ignore[arg-type]
+    print(f"observation lines: {args.obs_lines}")
+    print(f"prompt tokens: {constructor.prompt_stats['prompt_tokens']}")
+    report(
+        "construct",
+        lambda: constructor.construct(trajectory, "Buy a product", meta_data),  # type: ignore[arg-type]
+        args.number,
+    )
+    report(
+        "map_url_to_real (observation)",
+        lambda: constructor.map_url_to_real(obs),
+        args.number,
+    )
+    report(
+        "map_url_to_local (observation)",
+        lambda: constructor.map_url_to_local(real_url),
+        args.number,
+    )
+    for name, response in responses.items():
+        report(
+            f"find_between ({name})",
+            lambda: find_between(response, action_splitter),
+            args.number,
+        )
+        report(
+            f"regex extraction ({name})",
+            lambda: regex_extract_action(response, action_splitter),
+            args.number,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,8 @@ import os
 import shutil
 import sys
 
+from runner import RunStore
+
 
 def merge_logs(result_folder: str, args: argparse.Namespace) -> str:
     if not os.path.exists(f"{result_folder}/log_files.txt"):
@@ -84,7 +86,25 @@ def merge_logs(result_folder: str, args: argparse.Namespace) -> str:
     return merged_log_path
 
 
+def get_run_store(result_folder: str) -> RunStore | None:
+    db_path = f"{result_folder}/run_store.sqlite3"
+    return RunStore(db_path) if os.path.exists(db_path) else None
+
+
 def check_unhandled_errors(args: argparse.Namespace) -> int:
+    run_store = get_run_store(args.result_folder)
+    if run_store is not None:
+        # tasks whose last attempt failed with an error are claimed again
+        # by the next run, nothing needs to be deleted
+        error_examples = run_store.error_tasks()
+        summary = run_store.summary()
+        run_store.close()
+        print(f"Number of examples: {summary['num_tasks']}")
+        print(f"Average score: {summary['average_score']}")
+        print(f"Number of unhandled errors: {len(error_examples)}")
+        print(error_examples)
+        return len(error_examples)
+
     log_path = merge_logs(args.result_folder, args)
     with open(log_path, "r") as f:
         logs = f.read()
@@ -138,6 +158,10 @@ def check_unexpected_logout(args: argparse.Namespace) -> int:
         for idx in error_examples:
             if os.path.exists(f"{args.result_folder}/render_{idx}.html"):
                 os.remove(f"{args.result_folder}/render_{idx}.html")
+        run_store = get_run_store(args.result_folder)
+        if run_store is not None:
+            run_store.discard(error_examples)
+            run_store.close()
 
     return num_errors
 
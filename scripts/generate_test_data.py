@@ -2,25 +2,17 @@
 Generate the test data"""
 import json
 
-from browser_env.env_config import *
+from evaluation_harness.task_catalog import TaskCatalog
 
 
 def main() -> None:
-    with open("config_files/test.raw.json", "r") as f:
-        raw = f.read()
-    raw = raw.replace("__GITLAB__", GITLAB)
-    raw = raw.replace("__REDDIT__", REDDIT)
-    raw = raw.replace("__SHOPPING__", SHOPPING)
-    raw = raw.replace("__SHOPPING_ADMIN__", SHOPPING_ADMIN)
-    raw = raw.replace("__WIKIPEDIA__", WIKIPEDIA)
-    raw = raw.replace("__MAP__", MAP)
+    catalog = TaskCatalog("config_files/test.raw.json")
+    task_ids = catalog.task_ids()
     with open("config_files/test.json", "w") as f:
-        f.write(raw)
+        json.dump([catalog[task_id] for task_id in task_ids], f, indent=2)
     # split to multiple files
-    data = json.loads(raw)
-    for idx, item in enumerate(data):
-        with open(f"config_files/{idx}.json", "w") as f:
-            json.dump(item, f, indent=2)
+    for task_id in task_ids:
+        catalog.write_config_file(task_id, "config_files")
 
 
 if __name__ == "__main__":
@@ -8,8 +8,12 @@ from typing import Any
 
 from bs4 import BeautifulSoup
 
+from browser_env.trajectory_log import trajectory_log_to_messages
 
-def main(result_folder: str, config_json: str) -> None:
+
+def main(
+    result_folder: str, config_json: str, trajectory_logs: bool = False
+) -> None:
     all_data = {}
     template_to_id: dict[str, Any] = defaultdict(lambda: len(template_to_id))
 
@@ -35,6 +39,22 @@ def main(result_folder: str, config_json: str) -> None:
             else:
                 v["achievable"] = True
 
+    if trajectory_logs:
+        # read the structured logs instead of parsing the renders
+        for log_path in sorted(
+            glob.glob(f"{result_folder}/trajectories/*.jsonl")
+        ):
+            task_id = int(os.path.basename(log_path).split(".")[0])
+            messages, success = trajectory_log_to_messages(log_path)
+            all_data[f"example_{task_id}"] = {
+                **data_configs[task_id],
+                "messages": messages,
+                "success": success,
+            }
+        with open(f"{result_folder}/json_dump.json", "w+") as f:
+            json.dump(all_data, f, indent=4)
+        return
+
     with open(f"{result_folder}/merged_log.txt", "r") as f:
         results = {}
         for line in f:
@@ -56,15 +76,19 @@ def main(result_folder: str, config_json: str) -> None:
                     obv.find("pre").text
                     for obv in soup.find_all("div", {"class": "state_obv"})
                 ]
-                base64_images = [
-                    img["src"].split(",")[1] for img in soup.find_all("img")
-                ]
+                image_srcs = [str(img["src"]) for img in soup.find_all("img")]
                 image_observations = []
-                # save image to file and change the value to be path
+                # save embedded images to file and change the value to be path
                 image_folder = f"images/{os.path.basename(result_folder)}"
                 os.makedirs(image_folder, exist_ok=True)
-                for i, image in enumerate(base64_images):
-                    image_data = base64.b64decode(image)
+                for i, image_src in enumerate(image_srcs):
+                    if not image_src.startswith("data:"):
+                        # already stored as a file next to the render
+                        image_observations.append(
+                            os.path.join(result_folder, image_src)
+                        )
+                        continue
+                    image_data = base64.b64decode(image_src.split(",")[1])
                     filename = f"{image_folder}/image_{task_id}_{i}.png"
                     with open(filename, "wb") as f:  # type: ignore[assignment]
                         f.write(image_data)  # type: ignore[arg-type]
@@ -122,5 +146,10 @@ if __name__ == "__main__":
     parser.add_argument(
         "--config_json", type=str, default="config_files/test.raw.json"
     )
+    parser.add_argument(
+        "--trajectory_logs",
+        action="store_true",
+        help="Read the trajectory logs of the result folder instead of the html renders",
+    )
     args = parser.parse_args()
-    main(args.result_folder, args.config_json)
+    main(args.result_folder, args.config_json, args.trajectory_logs)
@@ -0,0 +1,126 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from agent.prompts import CoTPromptConstructor
+from agent.prompts.prompt_constructor import compile_url_rewriter
+from agent.prompts.raw.p_cot_id_actree_2s import prompt as cot_prompt
+from browser_env import ActionParsingError, DetachedPage
+from llms.lm_config import LMConfig
+from llms.tokenizers import Tokenizer
+
+
+class WordTokenizer(Tokenizer):
+    """One token per whitespace separated word"""
+
+    def __init__(self) -> None:
+        self.provider = "word"
+
+    def encode(self, text: str) -> list[int]:
+        return [len(word) for word in text.split()]
+
+    def decode(self, ids: list[int]) -> str:
+        return " ".join("x" * i for i in ids)
+
+
+@pytest.fixture
+def instruction_path(tmp_path: Path) -> Path:
+    path = tmp_path / "p_cot_id_actree_2s.json"
+    with open(path, "w") as f:
+        json.dump(cot_prompt, f)
+    return path
+
+
+def make_trajectory(num_lines: int) -> list[dict[str, object]]:
+    obs = "\n".join(f"[{i}] link 'Link number {i}'" for i in range(num_lines))
+    return [
+        {
+            "observation": {"text": obs},
+            "info": {
+                "page": DetachedPage("http://localhost/page", ""),
+                "observation_metadata": {},
+            },
+        }
+    ]
+
+
+@pytest.mark.parametrize("mode", ["chat", "completion"])
+def test_observation_fills_the_context(
+    instruction_path: Path, mode: str
+) -> None:
+    lm_config = LMConfig(
+        provider="openai",
+        model="gpt-3.5-turbo",
+        mode=mode,
+        gen_config={
+            "max_obs_length": 0,
+            "context_length": 2000,
+            "max_tokens": 100,
+        },
+    )
+    constructor = CoTPromptConstructor(
+        instruction_path, lm_config, WordTokenizer()
+    )
+    trajectory = make_trajectory(1000)
+    prompt = constructor.construct(
+        trajectory, "intent", {"action_history": ["None"]}  # type: ignore[arg-type]
+    )
+
+    stats = constructor.prompt_stats
+    assert 0 < stats["observation_tokens"] <= stats["observation_budget"]
+    assert stats["prompt_tokens"] == constructor.count_prompt_tokens(prompt)
+    # the prompt leaves room for the generation, with less than a line to spare
+    assert 2000 - 100 - 10 < stats["prompt_tokens"] <= 2000 - 100
+
+
+def test_max_obs_length_without_context_length(
+    instruction_path: Path,
+) -> None:
+    lm_config = LMConfig(
+        provider="openai",
+        model="gpt-3.5-turbo",
+        mode="chat",
+        gen_config={"max_obs_length": 50, "context_length": 0},
+    )
+    constructor = CoTPromptConstructor(
+        instruction_path, lm_config, WordTokenizer()
+    )
+    constructor.construct(
+        make_trajectory(1000), "intent", {"action_history": ["None"]}  # type: ignore[arg-type]
+    )
+    assert constructor.prompt_stats["observation_budget"] == 50
+    assert constructor.prompt_stats["observation_tokens"] <= 50
+
+
+def test_action_extraction(instruction_path: Path) -> None:
+    lm_config = LMConfig(provider="openai", model="gpt-3.5-turbo", mode="chat")
+    constructor = CoTPromptConstructor(
+        instruction_path, lm_config, WordTokenizer()
+    )
+    reasoning = "Let's think step-by-step.\n" * 2000
+    response = f"{reasoning} In summary, the next action I will perform is ```click [1234]``` and ```stop```"
+    assert constructor._extract_action(response) == "click [1234]"
+    assert constructor._extract_action("``` \ntype [1] [a] [1]\n```") == (
+        "type [1] [a] [1]"
+    )
+    with pytest.raises(ActionParsingError):
+        constructor._extract_action(f"{reasoning} ```click [1234]")
+
+
+def test_url_rewriter_prefers_longer_keys() -> None:
+    rewrite = compile_url_rewriter(
+        {
+            "http://localhost:7780": "http://shop.com",
+            "http://localhost:7780/admin": "http://admin.com",
+            "": "http://ignored.com",
+        }
+    )
+    assert rewrite("http://localhost:7780/admin/a") == "http://admin.com/a"
+    assert (
+        rewrite(
+            "go from http://localhost:7780/x to http://localhost:7780/admin"
+        )
+        == "go from http://shop.com/x to http://admin.com"
+    )
+    assert rewrite("http://other.com") == "http://other.com"
@@ -0,0 +1,94 @@
+from typing import Any
+
+from browser_env.processors import (
+    ObservationBudget,
+    TextObervationProcessor,
+)
+
+
+def make_accessibility_tree(num_links: int) -> Any:
+    tree: list[dict[str, Any]] = [
+        {
+            "nodeId": "0",
+            "role": {"value": "RootWebArea"},
+            "name": {"value": "Page"},
+            "properties": [],
+            "childIds": [str(i) for i in range(1, num_links + 1)],
+            "backendDOMNodeId": 0,
+            "union_bound": [0.0, 0.0, 10.0, 10.0],
+        }
+    ]
+    for i in range(1, num_links + 1):
+        tree.append(
+            {
+                "nodeId": str(i),
+                "parentId": "0",
+                "role": {"value": "link"},
+                "name": {"value": f"Link {i}"},
+                "properties": [],
+                "childIds": [],
+                "backendDOMNodeId": i,
+                "union_bound": [0.0, 0.0, 10.0, 10.0],
+            }
+        )
+    return tree
+
+
+def test_parse_accessibility_tree_without_budget() -> None:
+    tree = make_accessibility_tree(3)
+    (
+        tree_str,
+        obs_nodes_info,
+    ) = TextObervationProcessor.parse_accessibility_tree(tree)
+    assert tree_str == (
+        "[0] RootWebArea 'Page'\n"
+        "\t[1] link 'Link 1'\n"
+        "\t[2] link 'Link 2'\n"
+        "\t[3] link 'Link 3'"
+    )
+    assert list(obs_nodes_info) == ["0", "1", "2", "3"]
+
+
+def test_parse_accessibility_tree_with_budget() -> None:
+    tree = make_accessibility_tree(100)
+    full_str, _ = TextObervationProcessor.parse_accessibility_tree(tree)
+
+    budget = ObservationBudget(max_length=100)
+    (
+        tree_str,
+        obs_nodes_info,
+    ) = TextObervationProcessor.parse_accessibility_tree(tree, budget)
+    # a prefix that ends on a whole line
+    assert len(tree_str) <= 100
+    assert full_str.startswith(tree_str + "\n")
+    assert (
+        budget.kept_lines == len(tree_str.split("\n")) == len(obs_nodes_info)
+    )
+    assert budget.summary()["truncated"]
+    assert budget.dropped_nodes == len(tree) - budget.kept_lines
+
+
+def test_parse_html_with_token_budget() -> None:
+    dom_tree: Any = [
+        {
+            "nodeId": str(i),
+            "nodeName": "a",
+            "attributes": f'href="/page/{i}"',
+            "nodeValue": "",
+            "backendNodeId": str(i),
+            "parentId": str(i - 1),
+            "childIds": [str(i + 1)] if i < 9 else [],
+            "union_bound": None,
+        }
+        for i in range(10)
+    ]
+    # count whitespace separated words as tokens, each line is 3 words
+    # and a line break
+    budget = ObservationBudget(
+        max_length=16, length_fn=lambda text: len(text.split())
+    )
+    html, obs_nodes_info = TextObervationProcessor.parse_html(dom_tree, budget)
+    assert html.count("\n") == 4
+    assert html.endswith("\n")
+    assert list(obs_nodes_info) == ["0", "1", "2", "3"]
+    assert budget.dropped_nodes == 6
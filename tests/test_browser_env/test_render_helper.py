@@ -0,0 +1,102 @@
+import json
+import re
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from browser_env import DetachedPage, create_stop_action
+from browser_env.helper_functions import (
+    HTML_HEAD,
+    HTML_TAIL,
+    HTML_TEMPLATE,
+    RenderHelper,
+)
+
+
+def make_state_info(url: str) -> Any:
+    return {
+        "observation": {
+            "text": f"[1] RootWebArea '{url}'",
+            "image": np.zeros((4, 4, 3), dtype=np.uint8),
+        },
+        "info": {
+            "page": DetachedPage(url, ""),
+            "observation_metadata": {"text": {"obs_nodes_info": {}}},
+        },
+    }
+
+
+def write_config(tmp_path: Path) -> Path:
+    config_file = tmp_path / "1.json"
+    with open(config_file, "w") as f:
+        json.dump({"task_id": 1, "intent": "Find the page"}, f)
+    return config_file
+
+
+def test_render_is_appended_step_by_step(tmp_path: Path) -> None:
+    config_file = write_config(tmp_path)
+    render_helper = RenderHelper(
+        str(config_file),
+        str(tmp_path),
+        "id_accessibility_tree",
+        image_format=None,
+    )
+    render_file = tmp_path / "render_1.html"
+
+    action = create_stop_action("done")
+    action["raw_prediction"] = "```stop [done]```"
+    for step, url in enumerate(["http://a.com", "http://b.com"]):
+        render_helper.render(
+            action,
+            make_state_info(url),
+            {"action_history": [f"step {step}"]},
+            render_screenshot=step == 1,
+        )
+        # the partial output is readable while the episode runs
+        partial = render_file.read_text()
+        assert partial.startswith(HTML_HEAD)
+        assert f"URL: {url}" in partial
+    render_helper.close()
+
+    html = render_file.read_text()
+    assert html.endswith(HTML_TAIL)
+    body = html[len(HTML_HEAD) : -len(HTML_TAIL)]
+    assert html == HTML_TEMPLATE.format(body=body)
+    assert body.startswith("<pre>task_id: 1\nintent: Find the page\n</pre>")
+    assert body.count("<h2>New Page</h2>") == 2
+    assert body.count("data:image/png;base64,") == 1
+
+
+@pytest.mark.parametrize("image_format", ["png", "webp", "jpeg"])
+def test_screenshots_are_stored_once(
+    tmp_path: Path, image_format: str
+) -> None:
+    render_helper = RenderHelper(
+        str(write_config(tmp_path)),
+        str(tmp_path),
+        "id_accessibility_tree",
+        image_format=image_format,
+    )
+    action = create_stop_action("done")
+    action["raw_prediction"] = "```stop [done]```"
+    for url in ["http://a.com", "http://a.com", "http://b.com"]:
+        state_info = make_state_info(url)
+        if url == "http://b.com":
+            state_info["observation"]["image"][0, 0] = 255
+        render_helper.render(
+            action, state_info, {"action_history": ["None"]}, True
+        )
+    render_helper.close()
+
+    images = sorted((tmp_path / "images").iterdir())
+    assert [image.suffix for image in images] == [f".{image_format}"] * 2
+    html = (tmp_path / "render_1.html").read_text()
+    assert "base64" not in html
+    srcs = re.findall(r"<img src='(.*?)'", html)
+    assert len(srcs) == 3 and srcs[0] == srcs[1] != srcs[2]
+    assert sorted(tmp_path / src for src in srcs[1:]) == images
+    with Image.open(tmp_path / srcs[0]) as image:
+        assert image.size == (4, 4)
@@ -0,0 +1,97 @@
+import json
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from browser_env import DetachedPage, create_id_based_action
+from browser_env.run_dataset import RunDataset, export_run_dataset
+from browser_env.trajectory_log import TrajectoryLogger
+
+
+def make_state_info(url: str, pixel: int) -> Any:
+    return {
+        "observation": {
+            "text": f"[3] link 'Next' at {url}",
+            "image": np.full((4, 6, 3), pixel, dtype=np.uint8),
+        },
+        "info": {
+            "page": DetachedPage(url, ""),
+            "observation_metadata": {
+                "text": {"obs_nodes_info": {"3": {"text": "[3] link 'Next'"}}}
+            },
+        },
+    }
+
+
+def log_task(result_dir: Path, task_id: int, num_steps: int) -> None:
+    config_file = result_dir / f"{task_id}.json"
+    with open(config_file, "w") as f:
+        json.dump({"task_id": task_id, "intent": f"Task {task_id}"}, f)
+    trajectory_logger = TrajectoryLogger(
+        str(config_file), str(result_dir), "id_accessibility_tree"
+    )
+    for step in range(num_steps):
+        action = create_id_based_action("click [3]")
+        action["raw_prediction"] = f"step {step} ```click [3]```"
+        trajectory_logger.log_step(
+            action,
+            make_state_info(f"http://a.com/{task_id}/{step}", step),
+            {"action_history": ["None"]},
+            "click [3]",
+            screenshot=True,
+            prompt_stats={"prompt_tokens": 100 + step},
+            timings={"env": 0.25, "agent": 1.0},
+        )
+    trajectory_logger.log_result(float(task_id % 2))
+    trajectory_logger.close()
+
+
+def test_export_and_load_one_step(tmp_path: Path) -> None:
+    result_dir = tmp_path / "result"
+    result_dir.mkdir()
+    log_task(result_dir, 12, 3)
+    log_task(result_dir, 7, 2)
+
+    num_steps = export_run_dataset(result_dir, tmp_path / "dataset")
+    assert num_steps == 5
+
+    dataset = RunDataset(tmp_path / "dataset")
+    assert list(dataset.index["task_id"]) == [7, 7, 12, 12, 12]
+    # both tasks share the screenshots of their first two steps
+    assert dataset.screenshots.shape == (3, 4, 6, 3)
+    assert isinstance(dataset.screenshots, np.memmap)
+    assert dataset.tasks[7]["score"] == 1.0
+
+    step = dataset.get_step(12, 2)
+    assert step["url"] == "http://a.com/12/2"
+    assert step["raw_prediction"] == "step 2 ```click [3]```"
+    assert step["prompt_tokens"] == 102
+    assert step["score"] == 0.0
+    assert step["screenshot"] is not None
+    assert int(step["screenshot"][0, 0, 0]) == 2
+    assert list(dataset.rows_of_task(12)) == [2, 3, 4]
+    with pytest.raises(KeyError):
+        dataset.get_step(12, 3)
+    dataset.close()
+
+
+def test_export_converts_mismatched_screenshots(tmp_path: Path) -> None:
+    result_dir = tmp_path / "result"
+    result_dir.mkdir()
+    log_task(result_dir, 7, 2)
+    # the screenshot of the second step becomes a larger RGBA image
+    for path in (result_dir / "images").iterdir():
+        with Image.open(path) as image:
+            pixel = np.asarray(image)[0, 0, 0]
+        if pixel == 1:
+            Image.new("RGBA", (10, 8), (1, 1, 1, 255)).save(path)
+
+    with pytest.warns(UserWarning, match="resized"):
+        export_run_dataset(result_dir, tmp_path / "dataset")
+    dataset = RunDataset(tmp_path / "dataset")
+    assert dataset.screenshots.shape == (2, 4, 6, 3)
+    assert int(dataset.screenshots[1][0, 0, 0]) == 1
+    dataset.close()
@@ -0,0 +1,117 @@
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from beartype import beartype
+
+from browser_env import (
+    DetachedPage,
+    MemoryBoundedTrajectory,
+    StateInfo,
+    Trajectory,
+    create_stop_action,
+)
+
+
+def make_state_info(step: int) -> StateInfo:
+    return {
+        "observation": {
+            "text": f"[1] RootWebArea 'Page {step}'",
+            "image": np.full((8, 6, 3), step, dtype=np.uint8),
+        },
+        "info": {
+            "page": DetachedPage(f"http://a.com/{step}", "<html></html>"),
+            "observation_metadata": {"text": {"obs_nodes_info": {}}},
+        },
+    }
+
+
+@beartype
+def num_actions(trajectory: Trajectory) -> int:
+    return len(trajectory[1::2])
+
+
+def test_old_states_are_spilled_and_loaded_back(tmp_path: Path) -> None:
+    trajectory: Any = MemoryBoundedTrajectory(2, spill_dir=tmp_path)
+    for step in range(5):
+        trajectory.append(make_state_info(step))
+        trajectory.append(create_stop_action(str(step)))
+
+    # only the last two states are kept in memory
+    raw_items = list.__iter__(trajectory)
+    assert sum(isinstance(item, dict) for item in raw_items) == 5 + 2
+
+    state = trajectory[0]
+    assert state["observation"]["text"] == "[1] RootWebArea 'Page 0'"
+    assert isinstance(state["observation"]["image"], np.memmap)
+    assert state["observation"]["image"].shape == (8, 6, 3)
+    assert int(state["observation"]["image"][0, 0, 0]) == 0
+    assert trajectory[4]["info"]["page"].url == "http://a.com/2"
+    assert trajectory[-2]["observation"]["text"].endswith("'Page 4'")
+
+    assert [action["answer"] for action in trajectory[1::2]] == [
+        "0",
+        "1",
+        "2",
+        "3",
+        "4",
+    ]
+    assert [item["info"]["page"].url for item in trajectory[::2]] == [
+        item["info"]["page"].url for item in list(trajectory)[::2]
+    ]
+    assert num_actions(trajectory) == 5
+
+    trajectory.close()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_list_methods_load_spilled_states(tmp_path: Path) -> None:
+    trajectory: Any = MemoryBoundedTrajectory(1, spill_dir=tmp_path)
+    # plain actions, the equality of actions with arrays is ambiguous
+    actions: list[Any] = [{"answer": str(step)} for step in range(3)]
+    trajectory.extend([make_state_info(0), actions[0]])
+    trajectory += [make_state_info(1), actions[1]]
+    trajectory.append(make_state_info(2))
+    assert not isinstance(list.__getitem__(trajectory, 0), dict)
+
+    # new lists hold the loaded items
+    for items in [
+        trajectory.copy(),
+        trajectory + [actions[2]],
+        [actions[2]] + trajectory,
+        trajectory * 1,
+    ]:
+        assert type(items) is list
+        assert all(isinstance(item, dict) for item in items)
+    assert (trajectory + [actions[2]])[0]["info"]["page"].url == (
+        "http://a.com/0"
+    )
+
+    assert actions[1] in trajectory
+    assert trajectory.index(actions[1]) == 3
+    assert trajectory.count(actions[0]) == 1
+    first_state = trajectory[0]
+    assert first_state["info"]["page"].url == "http://a.com/0"
+
+    # spilled states stay on disk as the items move
+    popped = trajectory.pop()
+    assert popped["info"]["page"].url == "http://a.com/2"
+    assert not isinstance(list.__getitem__(trajectory, 2), dict)
+    assert trajectory.pop(0)["info"]["page"].url == "http://a.com/0"
+    trajectory.insert(0, make_state_info(3))
+    assert [isinstance(item, dict) for item in list.__iter__(trajectory)] == [
+        True,
+        True,
+        False,
+        True,
+    ]
+    assert trajectory[2]["info"]["page"].url == "http://a.com/1"
+
+    trajectory.remove(actions[0])
+    del trajectory[0]
+    assert trajectory[0]["info"]["page"].url == "http://a.com/1"
+    assert trajectory[1] == actions[1]
+    trajectory.clear()
+    assert len(trajectory) == 0
+
+    trajectory.close()
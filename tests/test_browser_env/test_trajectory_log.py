@@ -0,0 +1,116 @@
+import json
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pytest
+
+from browser_env import DetachedPage, create_id_based_action
+from browser_env.helper_functions import RenderHelper
+from browser_env.trajectory_log import (
+    TrajectoryLogger,
+    get_trajectory_log_path,
+    main,
+    read_trajectory_log,
+    trajectory_log_to_html,
+    trajectory_log_to_messages,
+)
+
+
+def make_state_info(url: str, pixel: int) -> Any:
+    return {
+        "observation": {
+            "text": "[3] link 'Next'",
+            "image": np.full((4, 4, 3), pixel, dtype=np.uint8),
+        },
+        "info": {
+            "page": DetachedPage(url, ""),
+            "observation_metadata": {
+                "text": {"obs_nodes_info": {"3": {"text": "[3] link 'Next'"}}}
+            },
+        },
+    }
+
+
+def run_episode(tmp_path: Path) -> Path:
+    config_file = tmp_path / "1.json"
+    with open(config_file, "w") as f:
+        json.dump({"task_id": 1, "intent": "Go next"}, f)
+    render_helper = RenderHelper(
+        str(config_file), str(tmp_path), "id_accessibility_tree"
+    )
+    trajectory_logger = TrajectoryLogger(
+        str(config_file),
+        str(tmp_path),
+        "id_accessibility_tree",
+        screenshot_writer=render_helper.screenshot_writer,
+    )
+    meta_data = {"action_history": ["None"]}
+    for step in range(2):
+        action = create_id_based_action("click [3]")
+        action["raw_prediction"] = "Let's click. ```click [3]```"
+        state_info = make_state_info(f"http://a.com/{step}", step)
+        render_helper.render(action, state_info, meta_data, True)
+        trajectory_logger.log_step(
+            action,
+            state_info,
+            meta_data,
+            "click [3] where [3] is link 'Next'",
+            screenshot=True,
+            prompt_stats={"prompt_tokens": 10},
+            timings={"env": 0.5, "agent": 1.5},
+        )
+        meta_data["action_history"].append("click [3]")
+    trajectory_logger.log_result(1.0)
+    trajectory_logger.close()
+    render_helper.close()
+    return get_trajectory_log_path(tmp_path, 1)
+
+
+def test_log_converts_to_the_render(tmp_path: Path) -> None:
+    log_path = run_episode(tmp_path)
+    records = list(read_trajectory_log(log_path))
+    assert [r["type"] for r in records] == ["task", "step", "step", "result"]
+    assert records[2]["previous_action"] == "click [3]"
+    assert records[2]["timings"] == {"env": 0.5, "agent": 1.5}
+    assert len(list((tmp_path / "images").iterdir())) == 2
+
+    render = (tmp_path / "render_1.html").read_text()
+    assert trajectory_log_to_html(log_path) == render
+
+
+def test_existing_renders_are_kept(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    run_episode(tmp_path)
+    render_path = tmp_path / "render_1.html"
+    render_path.write_text("saved during the run")
+
+    monkeypatch.setattr("sys.argv", ["", "--result_dir", str(tmp_path)])
+    main()
+    assert render_path.read_text() == "saved during the run"
+
+    monkeypatch.setattr(
+        "sys.argv", ["", "--result_dir", str(tmp_path), "--overwrite"]
+    )
+    main()
+    assert render_path.read_text() == trajectory_log_to_html(
+        get_trajectory_log_path(tmp_path, 1)
+    )
+
+
+def test_log_converts_to_messages(tmp_path: Path) -> None:
+    log_path = run_episode(tmp_path)
+    messages, success = trajectory_log_to_messages(log_path)
+    assert success
+    assert len(messages) == 4
+    assert messages[0]["user"] == (
+        "URL: http://a.com/0\n\nobservation:\n[3] link 'Next'"
+    )
+    assert Path(messages[0]["image"] or "").exists()
+    assert messages[1] == {"assistant": "Let's click. ```click [3]```"}
+
+    # a record cut by a crash is skipped
+    with open(log_path, "a") as f:
+        f.write('{"type": "st')
+    assert len(list(read_trajectory_log(log_path))) == 4
@@ -0,0 +1,78 @@
+from typing import Any
+
+import pytest
+
+from evaluation_harness import StringEvaluator
+from evaluation_harness.eval_plan import (
+    HelperCall,
+    HTMLTarget,
+    get_eval_plan,
+)
+
+
+def test_helper_calls_are_parsed_not_evaluated() -> None:
+    call = HelperCall.parse("reddit_get_post_url('__last_url__')")
+    assert call.name == "reddit_get_post_url"
+    assert (
+        call(last_url="http://r.com/f/books/12/it-s-a-post")
+        == "http://r.com/f/books/12/"
+    )
+
+    call = HelperCall.parse(
+        "gitlab_get_project_memeber_role(__page__, 'byteblaze')"
+    )
+    assert call.args[1] == "byteblaze"
+    assert repr(call.args[0]) == "__page__"
+
+    for source in [
+        "__import__('os').system('true')",
+        "reddit_get_post_url(open('/etc/passwd').read())",
+        "reddit_get_post_url(url='x')",
+        "exec('1')",
+        "reddit_get_post_url(",
+    ]:
+        with pytest.raises(ValueError):
+            HelperCall.parse(source)
+
+
+def test_html_target_scores_like_the_evaluator() -> None:
+    target = HTMLTarget.compile(
+        {
+            "url": "func:reddit_get_post_url('__last_url__')",
+            "locator": "document.querySelector('.title').outerText",
+            "required_contents": {
+                "must_include": ["Hello |OR| Hi", "'World'"]
+            },
+        }
+    )
+    assert isinstance(target.url, HelperCall)
+    assert target.kind == "js"
+    assert target.score("Hi there, world") == 1.0
+    assert target.score("Hey there, world") == 0.0
+
+    with pytest.raises(ValueError):
+        HTMLTarget.compile(
+            {"url": "last", "locator": "x", "required_contents": {}}
+        )
+
+
+def test_plan_matches_string_evaluator() -> None:
+    configs: dict[str, Any] = {
+        "intent": "How many?",
+        "eval": {
+            "eval_types": ["string_match"],
+            "reference_answers": {"must_include": ["10", "'Items'"]},
+        },
+    }
+    plan = get_eval_plan(configs)
+    assert plan.must_include == (("10", False), ("items", False))
+    # compiled once per distinct eval config
+    assert get_eval_plan(dict(configs)) is plan
+
+    evaluator = StringEvaluator()
+    for answer in ["10 items", "'10 Items'", "1 item", "items: 100"]:
+        pred = StringEvaluator.clean_answer(answer)
+        assert evaluator.score_answer(answer, configs) == (
+            StringEvaluator.must_include(ref="10", pred=pred)
+            * StringEvaluator.must_include(ref="'Items'", pred=pred)
+        )
@@ -0,0 +1,99 @@
+from typing import Any
+
+import pytest
+
+from evaluation_harness import HTMLContentEvaluator, StringEvaluator
+from evaluation_harness.eval_plan import HTMLTarget
+from evaluation_harness.evaluators import evaluator_router
+from evaluation_harness.helper_functions import PseudoPage
+
+
+def test_html_content_batches_js_locators() -> None:
+    class RecordingPage:
+        def __init__(self) -> None:
+            self.scripts: list[str] = []
+
+        def evaluate(self, script: str) -> Any:
+            self.scripts.append(script)
+            if script.startswith("async"):
+                return [
+                    [True, f"value {i}"] for i in range(script.count("try"))
+                ]
+            return None
+
+        def content(self) -> str:
+            return "<html></html>"
+
+    page = RecordingPage()
+    targets: list[dict[str, Any]] = [
+        {"locator": "document.querySelector('.a').outerText"},
+        {"locator": "document.querySelector('.b').outerText"},
+        {
+            "locator": "document.querySelector('.c').value",
+            "prep_actions": ["document.querySelector('.d').click()"],
+        },
+        {"locator": ""},
+    ]
+    selected = HTMLContentEvaluator.select_elements(
+        page,  # type: ignore[arg-type]
+        [
+            HTMLTarget.compile(
+                {
+                    "url": "last",
+                    "required_contents": {"must_include": []},
+                    **target,
+                }
+            )
+            for target in targets
+        ],
+    )
+    assert selected == ["value 0", "value 1", "value 0", "<html></html>"]
+    # the prep action runs after the locators of the targets before it
+    assert [script.split(" ")[0] for script in page.scripts] == [
+        "async",
+        "()",
+        "async",
+    ]
+
+
+def test_evaluator_comb_stops_at_first_zero(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    judged: list[str] = []
+
+    def fuzzy_match(ref: str, pred: str, intent: str) -> float:
+        judged.append(ref)
+        return 1.0
+
+    monkeypatch.setattr(
+        StringEvaluator, "fuzzy_match", staticmethod(fuzzy_match)
+    )
+    configs = {
+        "intent": "How long does it take?",
+        "eval": {
+            "eval_types": ["url_match", "string_match"],
+            "reference_answers": {
+                "must_include": ["Acadia"],
+                "fuzzy_match": ["1h 23min"],
+            },
+            "reference_url": "http://a.com/park",
+            "url_note": "GOLD in PRED",
+        },
+    }
+    trajectory: list[Any] = [{"answer": "Yosemite, 1h 23min"}]
+    page = PseudoPage(None, "http://a.com/park")
+
+    evaluator = evaluator_router(configs)
+    assert [type(e).__name__ for e in evaluator.evaluators] == [
+        "StringEvaluator",
+        "URLEvaluator",
+        "StringEvaluator",
+    ]
+    assert evaluator(trajectory, configs, page) == 0.0
+    assert evaluator.scores == [("StringEvaluator", 0.0)]
+    assert judged == []
+
+    evaluator = evaluator_router(configs, evaluate_all=True)
+    assert evaluator(trajectory, configs, page) == 0.0
+    assert [score for _, score in evaluator.scores] == [0.0, 1.0, 1.0]
+    assert judged == ["1h 23min"]
@@ -1,10 +1,14 @@
 import json
 import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
+from typing import Any
 
 from browser_env import ScriptBrowserEnv
 from browser_env.env_config import *
 from evaluation_harness.helper_functions import (
+    ShoppingAPIClient,
     gitlab_get_project_memeber_role,
 )
 
@@ -29,3 +33,72 @@ def test_gitlab_get_project_memeber_role(
 
     # remove tmp config file
     os.remove(config_file)
+
+
+class FakeShoppingAPI(BaseHTTPRequestHandler):
+    """Issues tokens and serves the reviews of a product"""
+
+    requests: list[str] = []
+    valid_token = ""
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+    def reply(self, status: int, body: Any) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.requests.append("token")
+        FakeShoppingAPI.valid_token = f"token-{len(self.requests)}"
+        self.reply(200, self.valid_token)
+
+    def do_GET(self) -> None:
+        self.requests.append(self.path)
+        if self.headers["Authorization"] != f"Bearer {self.valid_token}":
+            self.reply(401, {"message": "unauthorized"})
+            return
+        reviews = [
+            {"nickname": "first", "ratings": [{"rating_name": "Rating"}]},
+            {
+                "nickname": "Emma",
+                "ratings": [{"rating_name": "Rating", "percent": 80}],
+            },
+        ]
+        self.reply(200, reviews)
+
+
+def test_shopping_client_reuses_token_and_responses() -> None:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeShoppingAPI)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    FakeShoppingAPI.requests = []
+    try:
+        client = ShoppingAPIClient(f"http://127.0.0.1:{server.server_port}")
+        reviews = client.get("products/SKU1/reviews")
+        assert reviews[-1]["nickname"] == "Emma"
+        # memoized within one evaluation
+        assert client.get("products/SKU1/reviews") is reviews
+        assert FakeShoppingAPI.requests == [
+            "token",
+            "/rest/V1/products/SKU1/reviews",
+        ]
+
+        # the site revoked the token, the client logs in again
+        client.clear_cache()
+        FakeShoppingAPI.valid_token = "revoked"
+        client.get("products/SKU1/reviews")
+        assert FakeShoppingAPI.requests[2:] == [
+            "/rest/V1/products/SKU1/reviews",
+            "token",
+            "/rest/V1/products/SKU1/reviews",
+        ]
+        client.session.close()
+    finally:
+        server.shutdown()
+        server.server_close()
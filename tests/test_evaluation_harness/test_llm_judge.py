@@ -0,0 +1,79 @@
+from pathlib import Path
+from typing import Any
+
+import pytest
+from playwright.sync_api import sync_playwright
+
+from evaluation_harness.evaluators import get_judge_messages
+from evaluation_harness.helper_functions import llm_fuzzy_match
+from evaluation_harness.llm_judge import JudgeRequestError, LLMJudge
+
+
+@pytest.fixture
+def asked(monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    """Answer correct to the judge requests, fail those about flaky"""
+    asked: list[str] = []
+
+    async def request(self: LLMJudge, messages: Any) -> dict[str, Any]:
+        asked.append(messages[-1]["content"])
+        content = "" if "flaky" in messages[-1]["content"] else "correct"
+        return {
+            "choices": [{"message": {"content": content}}],
+            "usage": {"prompt_tokens": 1000, "completion_tokens": 100},
+        }
+
+    monkeypatch.setattr(LLMJudge, "_request", request)
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    return asked
+
+
+def test_verdicts_are_batched_and_cached(
+    tmp_path: Path, asked: list[str]
+) -> None:
+    configs = {
+        "intent": "How long does it take?",
+        "eval": {"reference_answers": {"fuzzy_match": ["1h", "60 min"]}},
+    }
+    messages = get_judge_messages([{"answer": "One hour"}], configs)  # type: ignore[list-item]
+    assert len(messages) == 2
+    assert "student answer: one hour" in messages[0][-1]["content"]
+
+    judge = LLMJudge(tmp_path / "judge.sqlite3")
+    flaky = [{"role": "user", "content": "flaky"}]
+    verdicts = judge.judge_many(messages + [messages[0], flaky])
+    assert verdicts == ["correct", "correct", "correct", ""]
+    # each distinct question is asked once
+    assert len(asked) == 3
+    assert judge.usage["requests"] == 3
+    assert judge.cost == pytest.approx(3 * (0.01 + 0.1 * 0.03))
+    judge.close()
+
+    # verdicts survive the process, failed requests are asked again
+    judge = LLMJudge(tmp_path / "judge.sqlite3")
+    assert judge.judge_many(messages + [flaky]) == ["correct", "correct", ""]
+    assert len(asked) == 4
+    assert judge.usage["cache_hits"] == 2
+    judge.close()
+
+
+def test_judge_runs_under_sync_playwright(
+    monkeypatch: pytest.MonkeyPatch, asked: list[str]
+) -> None:
+    judge = LLMJudge(None)
+    monkeypatch.setattr(
+        "evaluation_harness.helper_functions.get_llm_judge", lambda: judge
+    )
+    # the sync API runs an event loop in this thread
+    playwright = sync_playwright().start()
+    try:
+        assert llm_fuzzy_match("1h", "one hour", "How long?") == 1.0
+        limiter = judge._limiter
+        assert llm_fuzzy_match("60 min", "one hour", "How long?") == 1.0
+        with pytest.raises(JudgeRequestError):
+            judge.judge([{"role": "user", "content": "flaky"}])
+    finally:
+        playwright.stop()
+    assert len(asked) == 3
+    # the rate limit spans the requests of all the calls
+    assert limiter is not None and judge._limiter is limiter
+    judge.close()
@@ -0,0 +1,178 @@
+import json
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from browser_env.trajectory_log import TrajectoryLogger
+from evaluation_harness import rescore
+from evaluation_harness.llm_judge import LLMJudge
+
+CONFIGS: dict[int, dict[str, Any]] = {
+    # string match only
+    1: {
+        "intent": "What is the price?",
+        "eval": {
+            "eval_types": ["string_match"],
+            "reference_answers": {"must_include": ["$25"]},
+        },
+    },
+    # url match
+    2: {
+        "intent": "Open the orders",
+        "eval": {
+            "eval_types": ["url_match"],
+            "reference_url": "http://a.com/orders",
+            "url_note": "GOLD in PRED",
+        },
+    },
+    # needs the live site, the url already fails
+    3: {
+        "intent": "Post a comment",
+        "eval": {
+            "eval_types": ["url_match", "program_html"],
+            "reference_url": "http://a.com/post",
+            "url_note": "GOLD in PRED",
+            "program_html": [
+                {
+                    "url": "last",
+                    "locator": "",
+                    "required_contents": {"must_include": ["hi"]},
+                }
+            ],
+        },
+    },
+    # needs the live site
+    4: {
+        "intent": "Post a comment",
+        "eval": {
+            "eval_types": ["program_html"],
+            "program_html": [
+                {
+                    "url": "last",
+                    "locator": "",
+                    "required_contents": {"must_include": ["hi"]},
+                }
+            ],
+        },
+    },
+    # needs the judge
+    5: {
+        "intent": "Who made it?",
+        "eval": {
+            "eval_types": ["string_match"],
+            "reference_answers": {"fuzzy_match": ["Alice"]},
+            "string_note": "",
+        },
+    },
+}
+
+OUTCOMES = {
+    1: ("It is $25.", "http://a.com/item", 0.0),
+    2: ("", "http://a.com/orders/", 1.0),
+    3: ("", "http://a.com/home", 0.0),
+    4: ("", "http://a.com/post", 1.0),
+    5: ("alice", "http://a.com", 1.0),
+}
+
+
+def write_logs(tmp_path: Path) -> None:
+    for task_id, (answer, url, score) in OUTCOMES.items():
+        config_file = tmp_path / f"{task_id}.json"
+        with open(config_file, "w") as f:
+            json.dump({"task_id": task_id, **CONFIGS[task_id]}, f)
+        trajectory_logger = TrajectoryLogger(
+            str(config_file), str(tmp_path), "id_accessibility_tree"
+        )
+        trajectory_logger.log_result(score, answer=answer, url=url)
+        trajectory_logger.close()
+
+
+def test_rescore_result_dir(tmp_path: Path) -> None:
+    write_logs(tmp_path)
+    rescored = {
+        task["task_id"]: task
+        for task in rescore.rescore_result_dir(
+            tmp_path, num_workers=2, use_judge=False
+        )
+    }
+    assert {k: v["status"] for k, v in rescored.items()} == {
+        1: rescore.SCORED,
+        2: rescore.SCORED,
+        3: rescore.SCORED,
+        4: rescore.NEEDS_LIVE_SITE,
+        5: rescore.NEEDS_JUDGE,
+    }
+    # the old score of task 1 was wrong
+    assert rescored[1]["score"] == 1.0
+    assert rescored[1]["old_score"] == 0.0
+    assert rescored[2]["score"] == 1.0
+    # a failed url settles the score without the live site
+    assert rescored[3]["score"] == 0.0
+    assert rescored[4]["score"] is None
+    assert rescored[4]["offline_score"] == 1.0
+    assert len(rescored[5]["judge_messages"]) == 1
+
+    # a fresh config changes the reference answer
+    config_dir = tmp_path / "configs"
+    config_dir.mkdir()
+    for task_id, config in CONFIGS.items():
+        with open(config_dir / f"{task_id}.json", "w") as f:
+            json.dump({"task_id": task_id, **config}, f)
+    CONFIGS[1]["eval"]["reference_answers"] = {"must_include": ["$26"]}
+    with open(config_dir / "1.json", "w") as f:
+        json.dump({"task_id": 1, **CONFIGS[1]}, f)
+    task = rescore.rescore_log(
+        str(tmp_path / "trajectories" / "1.jsonl"), str(config_dir)
+    )
+    assert task["score"] == 0.0
+
+
+def test_failed_judge_requests_leave_the_task_to_judge(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    async def request(self: LLMJudge, messages: Any) -> dict[str, Any]:
+        # the response to a request that failed after its retries
+        return {"choices": [{"message": {"content": ""}}]}
+
+    judge = LLMJudge(None)
+    monkeypatch.setattr(LLMJudge, "_request", request)
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(rescore, "get_llm_judge", lambda: judge)
+    monkeypatch.setattr(
+        "evaluation_harness.helper_functions.get_llm_judge", lambda: judge
+    )
+    write_logs(tmp_path)
+    rescored = {
+        task["task_id"]: task
+        for task in rescore.rescore_result_dir(tmp_path, num_workers=2)
+    }
+    judge.close()
+    assert rescored[5]["status"] == rescore.NEEDS_JUDGE
+    assert rescored[5]["score"] is None
+    assert rescored[2]["status"] == rescore.SCORED
+
+
+def test_saved_outcome_falls_back_to_the_last_step(tmp_path: Path) -> None:
+    log_path = tmp_path / "7.jsonl"
+    records = [
+        {"type": "task", "task_id": 7, "config": CONFIGS[1]},
+        {"type": "step", "answer": "$25", "url": "http://a.com/item"},
+        {"type": "result", "score": 1.0, "num_steps": 1},
+    ]
+    with open(log_path, "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    outcome = rescore.load_saved_outcome(log_path)
+    assert outcome["answer"] == "$25"
+    assert outcome["url"] == "http://a.com/item"
+
+    missing = tmp_path / "8.jsonl"
+    with open(missing, "w") as f:
+        f.write(
+            json.dumps({"type": "task", "task_id": 8, "config": CONFIGS[1]})
+            + "\n"
+        )
+    assert rescore.rescore_log(str(missing))["status"] == (
+        rescore.MISSING_RESULT
+    )
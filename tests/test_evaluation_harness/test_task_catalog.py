@@ -0,0 +1,73 @@
+import json
+from pathlib import Path
+
+from evaluation_harness.evaluators import (
+    StringEvaluator,
+    evaluator_router,
+)
+from evaluation_harness.task_catalog import TaskCatalog
+
+URLS = {
+    "GITLAB": "http://gitlab.test",
+    "SHOPPING": "http://shop.test",
+    "SHOPPING_ADMIN": "http://shop.test/admin",
+}
+
+
+def make_catalog(tmp_path: Path) -> TaskCatalog:
+    tasks = [
+        {
+            "task_id": task_id,
+            "sites": sites,
+            "start_url": start_url,
+            "intent_template_id": task_id // 2,
+            "intent": f"task {task_id}",
+            "eval": {
+                "eval_types": eval_types,
+                "reference_answers": {"must_include": ["42"]},
+                "reference_url": f"{start_url}/done",
+                "program_html": [],
+            },
+        }
+        for task_id, sites, start_url, eval_types in [
+            (0, ["gitlab"], "__GITLAB__", ["string_match"]),
+            (1, ["shopping_admin"], "__SHOPPING_ADMIN__", ["url_match"]),
+            (2, ["shopping"], "__SHOPPING__", ["string_match"]),
+        ]
+    ]
+    raw_path = tmp_path / "test.raw.json"
+    with open(raw_path, "w") as f:
+        json.dump(tasks, f)
+    return TaskCatalog(raw_path, urls=URLS)
+
+
+def test_urls_are_filled_lazily(tmp_path: Path) -> None:
+    catalog = make_catalog(tmp_path)
+    assert len(catalog) == 3
+    assert catalog.get_raw(1)["start_url"] == "__SHOPPING_ADMIN__"
+    assert catalog[1]["start_url"] == "http://shop.test/admin"
+    assert catalog[1]["eval"]["reference_url"] == "http://shop.test/admin/done"
+    assert catalog[2]["start_url"] == "http://shop.test"
+    # the filled config is cached
+    assert catalog[1] is catalog[1]
+
+    config_file = catalog.write_config_file(0, tmp_path)
+    with open(config_file) as f:
+        assert json.load(f) == catalog[0]
+
+
+def test_indexes(tmp_path: Path) -> None:
+    catalog = make_catalog(tmp_path)
+    assert catalog.task_ids() == [0, 1, 2]
+    assert catalog.task_ids(eval_type="string_match") == [0, 2]
+    assert catalog.task_ids(template_id=0) == [0, 1]
+    assert catalog.task_ids(template_id=0, eval_type="string_match") == [0]
+    assert catalog.task_ids(site="reddit") == []
+
+
+def test_evaluators_accept_parsed_configs(tmp_path: Path) -> None:
+    catalog = make_catalog(tmp_path)
+    evaluator = evaluator_router(catalog[0])
+    assert isinstance(evaluator.evaluators[0], StringEvaluator)
+    trajectory = [{"answer": "The answer is 42"}]
+    assert evaluator.evaluators[0](trajectory, catalog[0]) == 1.0  # type: ignore[arg-type]
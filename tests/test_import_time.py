@@ -0,0 +1,66 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+PACKAGES = ["agent", "browser_env", "evaluation_harness", "llms", "runner"]
+# loaded on first use, never by importing the packages
+HEAVY_MODULES = [
+    "aiolimiter",
+    "nltk",
+    "openai",
+    "requests",
+    "text_generation",
+    "tiktoken",
+    "transformers",
+]
+# seconds to import all the packages, about 0.6s when this was written,
+# the heavy modules add more than a second
+IMPORT_TIME_BUDGET = 1.5
+
+
+def run_python(code: str) -> str:
+    # importing must not need the urls of the websites either
+    env = {
+        k: v
+        for k, v in os.environ.items()
+        if k
+        not in [
+            "REDDIT",
+            "SHOPPING",
+            "SHOPPING_ADMIN",
+            "GITLAB",
+            "WIKIPEDIA",
+            "MAP",
+            "HOMEPAGE",
+        ]
+    }
+    return subprocess.run(
+        [sys.executable, "-W", "ignore", "-c", code],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+
+
+@pytest.mark.parametrize("package", PACKAGES)
+def test_heavy_modules_load_on_first_use(package: str) -> None:
+    loaded = run_python(
+        f"import json, sys, {package}; "
+        f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    )
+    assert json.loads(loaded) == []
+
+
+def test_import_time() -> None:
+    code = (
+        "import time; start = time.perf_counter(); "
+        f"import {', '.join(PACKAGES)}; "
+        "print(time.perf_counter() - start)"
+    )
+    # the first run may compile the modules
+    seconds = min(float(run_python(code)) for _ in range(3))
+    assert seconds < IMPORT_TIME_BUDGET
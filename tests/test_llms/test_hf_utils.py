@@ -0,0 +1,148 @@
+import asyncio
+import threading
+from typing import Generator
+
+import pytest
+from aiohttp import web
+
+from llms.providers.hf_utils import (
+    TGIBatchScheduler,
+    generate_n_from_huggingface_completion,
+)
+
+
+class FakeTGI(object):
+    """A fake text-generation-inference endpoint on an ephemeral port
+
+    The generation of the prompt "slow" waits until `release_slow` is set.
+    """
+
+    def __init__(self) -> None:
+        self.url = ""
+        self.slow_received = threading.Event()
+        self.release_slow = threading.Event()
+        self._ready = threading.Event()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, daemon=True
+        )
+
+    async def generate(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if body["inputs"] == "slow":
+            self.slow_received.set()
+            while not self.release_slow.is_set():
+                await asyncio.sleep(0.01)
+        best_of = body["parameters"].get("best_of") or 1
+        details = {
+            "finish_reason": "length",
+            "generated_tokens": 1,
+            "prefill": [],
+            "tokens": [],
+        }
+        if best_of > 1:
+            details["best_of_sequences"] = [
+                dict(details, generated_text=f"alt{i}")
+                for i in range(best_of - 1)
+            ]
+        return web.json_response(
+            [{"generated_text": f"gen:{body['inputs']}", "details": details}]
+        )
+
+    async def _start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/", self.generate)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}"
+
+    def start(self) -> None:
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result(
+            timeout=10
+        )
+
+    def stop(self) -> None:
+        self.release_slow.set()
+        asyncio.run_coroutine_threadsafe(
+            self._runner.cleanup(), self._loop
+        ).result(timeout=10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+
+@pytest.fixture
+def tgi() -> Generator[FakeTGI, None, None]:
+    server = FakeTGI()
+    server.start()
+    yield server
+    server.stop()
+
+
+def test_batch_scheduler_routes_responses(tgi: FakeTGI) -> None:
+    scheduler = TGIBatchScheduler(
+        tgi.url, max_batch_delay=10.0, max_batch_size=4
+    )
+    futures = [
+        scheduler.submit(f"p{i}", temperature=1.0, top_p=0.9, max_new_tokens=5)
+        for i in range(8)
+    ]
+    generations = [future.result(timeout=10) for future in futures]
+    scheduler.close()
+
+    assert [g.generated_text for g in generations] == [
+        f"gen:p{i}" for i in range(8)
+    ]
+    # the pending prompts are sent together instead of one after another
+    assert scheduler.batch_sizes == [4, 4]
+
+
+def test_batch_scheduler_does_not_wait_for_inflight_batch(
+    tgi: FakeTGI,
+) -> None:
+    scheduler = TGIBatchScheduler(tgi.url, max_batch_delay=0.0)
+    slow = scheduler.submit(
+        "slow", temperature=1.0, top_p=0.9, max_new_tokens=5
+    )
+    assert tgi.slow_received.wait(timeout=10)
+
+    fast = scheduler.submit(
+        "fast", temperature=1.0, top_p=0.9, max_new_tokens=5
+    )
+    assert fast.result(timeout=10).generated_text == "gen:fast"
+    assert not slow.done()
+
+    tgi.release_slow.set()
+    assert slow.result(timeout=10).generated_text == "gen:slow"
+    scheduler.close()
+    assert scheduler.batch_sizes == [1, 1]
+
+
+def test_close_fails_the_pending_prompts(tgi: FakeTGI) -> None:
+    scheduler = TGIBatchScheduler(tgi.url, max_batch_delay=0.0)
+    slow = scheduler.submit(
+        "slow", temperature=1.0, top_p=0.9, max_new_tokens=5
+    )
+    assert tgi.slow_received.wait(timeout=10)
+    scheduler.close()
+
+    with pytest.raises(RuntimeError):
+        slow.result(timeout=10)
+    with pytest.raises(RuntimeError):
+        scheduler.submit("p", temperature=1.0, top_p=0.9, max_new_tokens=5)
+
+
+def test_best_of_returns_all_candidates(tgi: FakeTGI) -> None:
+    generations = generate_n_from_huggingface_completion(
+        "q",
+        tgi.url,
+        temperature=1.0,
+        top_p=0.9,
+        max_new_tokens=5,
+        n=3,
+        max_batch_delay=0.0,
+    )
+    assert generations == ["gen:q", "alt0", "alt1"]
@@ -0,0 +1,115 @@
+from typing import Any
+
+from browser_env.processors import ObservationBudget
+from llms.tokenizers import TokenCounter, Tokenizer
+
+
+class CharTokenizer(Tokenizer):
+    """One token per character, counts the calls to encode"""
+
+    def __init__(self) -> None:
+        self.provider = "char"
+        self.num_encode_calls = 0
+
+    def encode(self, text: str) -> list[int]:
+        self.num_encode_calls += 1
+        return [ord(c) for c in text]
+
+    def decode(self, ids: list[int]) -> str:
+        return "".join(chr(i) for i in ids)
+
+
+def test_fit_lines_keeps_whole_lines() -> None:
+    counter = TokenCounter(CharTokenizer())
+    text = "aaaa\nbbbb\ncccc"
+    assert counter.count_text(text) == 14
+    assert counter.fit_lines(text, 14) == text
+    assert counter.fit_lines(text, 13) == "aaaa\nbbbb"
+    assert counter.fit_lines(text, 9) == "aaaa\nbbbb"
+    assert counter.fit_lines(text, 8) == "aaaa"
+    # the first line is cut when no whole line fits
+    assert counter.fit_lines(text, 2) == "aa"
+
+
+def test_line_counts_are_cached() -> None:
+    tokenizer = CharTokenizer()
+    counter = TokenCounter(tokenizer)
+    first_obs = "\n".join(f"[{i}] link 'Link {i}'" for i in range(100))
+    counter.fit_lines(first_obs, 10000)
+    assert tokenizer.num_encode_calls == 100
+
+    # only the new lines of the next observation are encoded
+    next_obs = "\n".join(f"[{i}] link 'Link {i}'" for i in range(10, 120))
+    counter.fit_lines(next_obs, 10000)
+    assert tokenizer.num_encode_calls == 120
+
+
+def test_cache_misses_are_encoded_in_one_batch() -> None:
+    tokenizer = CharTokenizer()
+    batches: list[list[str]] = []
+    encode_many = tokenizer.encode_many
+
+    def record(
+        texts: list[str], num_threads: int | None = None
+    ) -> list[list[int]]:
+        batches.append(texts)
+        return encode_many(texts, num_threads)
+
+    tokenizer.encode_many = record  # type: ignore[method-assign]
+    counter = TokenCounter(tokenizer)
+    assert counter.count_lines(["ab", "c", "ab"]) == [2, 1, 2]
+    assert counter.count_lines(["c", "def"]) == [1, 3]
+    # repeated lines are encoded once, cached lines are not encoded again
+    assert batches == [["ab", "c"], ["def"]]
+
+
+def test_encode_many_uses_a_thread_pool() -> None:
+    tokenizer = CharTokenizer()
+    texts = [f"line {i}" for i in range(100)]
+    assert tokenizer.encode_many(texts, num_threads=4) == [
+        tokenizer.encode(t) for t in texts
+    ]
+
+
+def test_small_batches_skip_the_batch_encoder() -> None:
+    class BatchTokenizer(CharTokenizer):
+        def __init__(self) -> None:
+            super().__init__()
+            self.provider = "openai"
+            self.num_batches = 0
+
+        @property
+        def tokenizer(self) -> Any:
+            return self
+
+        def encode_batch(
+            self, texts: list[str], num_threads: int = 8
+        ) -> list[list[int]]:
+            self.num_batches += 1
+            return [CharTokenizer.encode(self, text) for text in texts]
+
+    tokenizer = BatchTokenizer()
+    counter = TokenCounter(tokenizer)
+    # a line at a time, as the observation budget counts them
+    for i in range(100):
+        assert counter.count_tokens(f"[{i}]") == len(f"[{i}]")
+    assert tokenizer.num_batches == 0
+    tokenizer.encode_many([f"line {i}" for i in range(100)])
+    assert tokenizer.num_batches == 1
+
+
+def test_observation_budget_shares_the_line_cache() -> None:
+    tokenizer = CharTokenizer()
+    counter = TokenCounter(tokenizer)
+    lines = [f"[{i}] link 'Link {i}'" for i in range(10)]
+    budget = ObservationBudget(
+        max_length=10000, length_fn=counter.count_tokens
+    )
+    assert all(budget.consume(line) for line in lines)
+    assert tokenizer.num_encode_calls == 10
+
+    # the prompt constructor counts the same lines without encoding them
+    obs = "\n".join(lines)
+    assert counter.fit_lines(obs, 10000) == obs
+    assert tokenizer.num_encode_calls == 10
+    assert budget.used_length == counter.count_text(obs) + 1
@@ -0,0 +1,231 @@
+import threading
+import time
+from typing import Any
+
+import pytest
+from playwright.sync_api import sync_playwright
+
+from browser_env import create_stop_action
+from evaluation_harness import (
+    Evaluator,
+    EvaluatorComb,
+    HTMLContentEvaluator,
+    evaluator_router,
+)
+from evaluation_harness.eval_plan import HELPERS
+from evaluation_harness.helper_functions import (
+    PseudoPage,
+    ShoppingAPIClient,
+    get_shopping_client,
+)
+from evaluation_harness.llm_judge import LLMJudge
+from runner import EvaluationJob, EvaluationStage
+
+CONFIG: dict[str, Any] = {
+    "intent": "Open the orders and tell the total",
+    "eval": {
+        "eval_types": ["string_match", "url_match"],
+        "reference_answers": {"must_include": ["$25"]},
+        "reference_url": "http://a.com/orders",
+    },
+}
+
+
+def make_job(
+    answer: str, url: str, done: list[tuple[EvaluationJob, str]]
+) -> EvaluationJob:
+    return EvaluationJob(
+        evaluator_router(CONFIG),
+        [create_stop_action(answer)],
+        CONFIG,
+        url,
+        None,
+        on_done=lambda job: done.append(
+            (job, threading.current_thread().name)
+        ),
+    )
+
+
+def test_stage_evaluates_in_its_thread() -> None:
+    done: list[tuple[EvaluationJob, str]] = []
+    stage = EvaluationStage(max_pending=1)
+    stage.start()
+    stage.submit(make_job("It is $25", "http://a.com/orders", done))
+    stage.submit(make_job("It is $25", "http://a.com/home", done))
+    bad_job = make_job("", "http://a.com/orders", done)
+    bad_job.config = {}
+    stage.submit(bad_job)
+    stage.close()
+
+    assert [job.score for job, _ in done[:2]] == [1.0, 0.0]
+    assert isinstance(done[2][0].error, KeyError)
+    assert "KeyError" in done[2][0].traceback
+    # the results are recorded by the worker
+    assert {name for _, name in done} == {threading.current_thread().name}
+
+
+def test_last_page_is_selected_before_the_hand_over() -> None:
+    class FinishedPage:
+        url = "http://a.com/post/1"
+
+        def content(self) -> str:
+            return "<p>hello world</p>"
+
+    configs: dict[str, Any] = {
+        "intent": "Post hello",
+        "eval": {
+            "eval_types": ["program_html"],
+            "program_html": [
+                {
+                    "url": "last",
+                    "locator": "",
+                    "required_contents": {"must_include": ["hello"]},
+                }
+            ],
+        },
+    }
+    evaluator = evaluator_router(configs)
+    evaluator.select_last_page(configs, FinishedPage())  # type: ignore[arg-type]
+    html_evaluator = evaluator.evaluators[0]
+    assert isinstance(html_evaluator, HTMLContentEvaluator)
+    assert html_evaluator.last_page_elements == ["<p>hello world</p>"]
+    # the evaluation no longer reads the page of the episode
+    score = evaluator(
+        [create_stop_action("")],
+        configs,
+        PseudoPage(None, "http://a.com/post/1"),
+    )
+    assert score == 1.0
+
+
+def test_helper_urls_are_resolved_before_the_hand_over(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    posts = ["http://a.com/post/1"]
+    monkeypatch.setitem(
+        HELPERS, "reddit_get_post_url", lambda last_url: posts[-1]
+    )
+
+    class FinishedPage:
+        url = "http://a.com/forum"
+
+        def content(self) -> str:
+            return "<p>hello world</p>"
+
+    configs: dict[str, Any] = {
+        "intent": "Post hello",
+        "eval": {
+            "eval_types": ["program_html"],
+            "program_html": [
+                {
+                    "url": "func:reddit_get_post_url('__last_url__')",
+                    "locator": "",
+                    "required_contents": {"must_include": ["hello"]},
+                },
+                {
+                    "url": "last",
+                    "locator": "",
+                    "required_contents": {"must_include": ["hello"]},
+                },
+            ],
+        },
+    }
+    evaluator = evaluator_router(configs)
+    evaluator.select_last_page(configs, FinishedPage())  # type: ignore[arg-type]
+    # the next episode posts again before the evaluation runs
+    posts.append("http://a.com/post/2")
+    html_evaluator = evaluator.evaluators[0]
+    assert isinstance(html_evaluator, HTMLContentEvaluator)
+    assert html_evaluator.target_urls == ["http://a.com/post/1", "last"]
+
+
+def test_close_gives_up_on_a_stuck_evaluation() -> None:
+    release = threading.Event()
+
+    class StuckEvaluator(Evaluator):
+        def __call__(self, *args: Any, **kwargs: Any) -> float:
+            release.wait()
+            return 1.0
+
+    done: list[EvaluationJob] = []
+    stage = EvaluationStage()
+    stage.start()
+    stage.submit(
+        EvaluationJob(
+            EvaluatorComb([StuckEvaluator()]),
+            [create_stop_action("")],
+            {},
+            "",
+            None,
+            on_done=done.append,
+        )
+    )
+    start = time.monotonic()
+    assert stage.close(timeout=0.2) == []
+    assert time.monotonic() - start < 1.0
+    assert stage.running
+    release.set()
+
+
+def test_judge_and_shopping_client_in_the_stage_thread(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    class PlaywrightStage(EvaluationStage):
+        def _run(self) -> None:
+            # as after a program_html job, the sync API of the browser runs
+            # an event loop in the thread
+            self._playwright = sync_playwright().start()
+            super()._run()
+
+    async def request(self: LLMJudge, messages: Any) -> dict[str, Any]:
+        return {"choices": [{"message": {"content": "correct"}}]}
+
+    judge = LLMJudge(None)
+    monkeypatch.setattr(LLMJudge, "_request", request)
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(
+        "evaluation_harness.helper_functions.get_llm_judge", lambda: judge
+    )
+    configs: dict[str, Any] = {
+        "intent": "How long does it take?",
+        "eval": {
+            "eval_types": ["string_match"],
+            "reference_answers": {"fuzzy_match": ["1h"]},
+        },
+    }
+    clients: list[ShoppingAPIClient] = []
+
+    class ClientRecorder(Evaluator):
+        def __call__(self, *args: Any, **kwargs: Any) -> float:
+            clients.append(get_shopping_client())
+            return 1.0
+
+    done: list[EvaluationJob] = []
+    stage = PlaywrightStage()
+    stage.start()
+    stage.submit(
+        EvaluationJob(
+            evaluator_router(configs),
+            [create_stop_action("one hour")],
+            configs,
+            "http://a.com",
+            None,
+            on_done=done.append,
+        )
+    )
+    stage.submit(
+        EvaluationJob(
+            EvaluatorComb([ClientRecorder()]),
+            [create_stop_action("")],
+            {},
+            "",
+            None,
+            on_done=done.append,
+        )
+    )
+    stage.close()
+    judge.close()
+
+    assert [(job.error, job.score) for job in done] == [(None, 1.0)] * 2
+    # the stage thread does not share the client of the worker
+    assert clients[0] is not get_shopping_client()
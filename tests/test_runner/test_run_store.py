@@ -0,0 +1,157 @@
+import threading
+import time
+from pathlib import Path
+
+from runner import (
+    LeaseHeartbeat,
+    RunStore,
+    build_report,
+    default_worker_id,
+    merge_run_stores,
+)
+
+
+def test_workers_never_claim_the_same_task(tmp_path: Path) -> None:
+    db_path = tmp_path / "run_store.sqlite3"
+    config_files = [f"config_files/{i}.json" for i in range(50)]
+    claimed: dict[str, list[int]] = {}
+
+    def work(worker: str) -> None:
+        run_store = RunStore(db_path)
+        claimed[worker] = []
+        for attempt_id, config_file in run_store.claim_tasks(
+            config_files, worker
+        ):
+            claimed[worker].append(int(config_file.split("/")[1][:-5]))
+            run_store.finish(attempt_id, "passed", score=1.0)
+        run_store.close()
+
+    threads = [
+        threading.Thread(target=work, args=(f"worker-{i}",)) for i in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    all_claimed = sorted(sum(claimed.values(), []))
+    assert all_claimed == list(range(50))
+
+
+def test_errors_are_retried_and_summarized(tmp_path: Path) -> None:
+    run_store = RunStore(tmp_path / "run_store.sqlite3")
+    config_files = [f"config_files/{i}.json" for i in range(4)]
+    outcomes = {
+        0: ("passed", 1.0),
+        1: ("failed", 0.0),
+        2: ("error", None),
+        3: ("running", None),
+    }
+    for attempt_id, config_file in run_store.claim_tasks(config_files, "a"):
+        status, score = outcomes[int(config_file.split("/")[1][:-5])]
+        if status != "running":
+            run_store.finish(
+                attempt_id, status, score=score, error_class="TimeoutError"
+            )
+
+    assert run_store.error_tasks() == [2]
+    assert run_store.unfinished(config_files) == config_files[2:]
+    # the error is retried, the running task is left to its worker
+    assert [c for _, c in run_store.claim_tasks(config_files, "b")] == [
+        "config_files/2.json"
+    ]
+    # a restarted worker gives up its running attempts
+    assert run_store.abandon_running("a") == 1
+    assert run_store.error_tasks() == [3]
+
+    summary = run_store.summary()
+    assert summary["num_tasks"] == 2
+    assert summary["average_score"] == 0.5
+
+    run_store.discard([0])
+    assert run_store.results() == {1: 0.0}
+    run_store.close()
+
+
+def test_expired_leases_are_reclaimed(tmp_path: Path) -> None:
+    db_path = tmp_path / "run_store.sqlite3"
+    dead_host = RunStore(db_path, lease_seconds=0.05)
+    (dead_id, _), *_ = dead_host.claim_tasks(["config_files/0.json"], "a")
+    live_host = RunStore(db_path, lease_seconds=60.0)
+    # the lease of the attempt is still valid
+    assert live_host.claim("config_files/0.json", "b") is None
+
+    time.sleep(0.1)
+    attempt_id = live_host.claim("config_files/0.json", "b")
+    assert attempt_id is not None
+    assert live_host.error_tasks() == []
+    # the dead worker lost its lease and cannot renew it
+    assert not dead_host.heartbeat(dead_id)
+    assert live_host.heartbeat(attempt_id)
+    # nor overwrite the result of the new attempt
+    assert live_host.finish(attempt_id, "failed", score=0.0)
+    assert not dead_host.finish(dead_id, "passed", score=1.0)
+    assert live_host.results() == {0: 0.0}
+    dead_host.close()
+    live_host.close()
+
+
+def test_heartbeat_keeps_the_lease(tmp_path: Path) -> None:
+    db_path = tmp_path / "run_store.sqlite3"
+    run_store = RunStore(db_path, lease_seconds=0.2)
+    attempt_id = run_store.claim("config_files/0.json", "a")
+    assert attempt_id is not None
+    with LeaseHeartbeat(run_store, attempt_id, interval=0.02) as heartbeat:
+        time.sleep(0.4)
+        other = RunStore(db_path)
+        assert other.claim("config_files/0.json", "b") is None
+        other.close()
+    assert not heartbeat.lost
+    run_store.close()
+
+
+def test_merge_and_report(tmp_path: Path) -> None:
+    sources: list[str | Path] = []
+    for node in range(2):
+        sources.append(tmp_path / f"node{node}.sqlite3")
+        run_store = RunStore(sources[-1])
+        config_files = [f"config_files/{node * 2 + i}.json" for i in range(2)]
+        for attempt_id, _ in run_store.claim_tasks(config_files, f"n{node}"):
+            run_store.finish(attempt_id, "passed", score=1.0)
+        run_store.close()
+    # task 0 also errored on node 1 before node 0 ran it
+    run_store = RunStore(sources[1])
+    error_id = run_store.claim("config_files/0.json", "n1")
+    assert error_id is not None
+    run_store.finish(error_id, "error", error_class="TimeoutError")
+    run_store.close()
+
+    merged = tmp_path / "merged.sqlite3"
+    merge_run_stores(sources, merged).close()
+    run_store = merge_run_stores(sources, merged)
+    report = build_report(run_store)
+    run_store.close()
+
+    assert report["summary"]["num_tasks"] == 4
+    assert report["summary"]["attempts"] == {"passed": 4, "error": 1}
+    assert report["workers"] == {"n0": 2, "n1": 2}
+    assert report["tasks"][0]["status"] == "passed"
+    assert report["tasks"][0]["num_attempts"] == 2
+
+
+def test_restarted_worker_takes_over_with_the_default_id(
+    tmp_path: Path,
+) -> None:
+    result_dir = tmp_path / "result"
+    run_store = RunStore(tmp_path / "run_store.sqlite3")
+    worker = default_worker_id(result_dir)
+    assert run_store.claim("config_files/0.json", worker) is not None
+    run_store.close()
+
+    # the same result dir, given as another path, after a restart
+    run_store = RunStore(tmp_path / "run_store.sqlite3")
+    worker = default_worker_id(f"{tmp_path}/./result")
+    assert worker != default_worker_id(tmp_path / "other")
+    assert run_store.abandon_running(worker) == 1
+    assert run_store.claim("config_files/0.json", worker) is not None
+    run_store.close()
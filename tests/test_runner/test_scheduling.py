@@ -0,0 +1,78 @@
+from pathlib import Path
+from typing import Any
+
+from runner import (
+    RunStore,
+    estimate_costs,
+    get_worker_order,
+    group_tasks,
+    schedule_tasks,
+)
+from runner.scheduling import get_task_group_key
+
+CONFIGS: dict[int, dict[str, Any]] = {
+    0: {"sites": ["shopping"], "storage_state": "./.auth/shopping_state.json"},
+    1: {"sites": ["gitlab"], "storage_state": "./.auth/gitlab_state.json"},
+    2: {"sites": ["shopping"], "storage_state": "./.auth/shopping_state.json"},
+    3: {
+        "sites": ["reddit", "gitlab"],
+        "storage_state": "./.auth/gitlab.reddit_state.json",
+    },
+    4: {"sites": ["shopping"], "storage_state": "./.auth/shopping_state.json"},
+    5: {"sites": ["wikipedia"], "storage_state": None},
+    6: {"sites": ["shopping"], "storage_state": "./.auth/shopping_state.json"},
+    7: {"sites": ["gitlab"], "storage_state": "./.auth/gitlab_state.json"},
+}
+
+
+def test_group_and_estimate_costs() -> None:
+    groups = group_tasks(list(CONFIGS), CONFIGS.__getitem__)
+    assert groups[get_task_group_key(CONFIGS[0])] == [0, 2, 4, 6]
+    assert get_task_group_key(CONFIGS[3]) == (
+        "gitlab",
+        "reddit",
+        "gitlab.reddit_state.json",
+    )
+    assert get_task_group_key(CONFIGS[5]) == ("wikipedia", "")
+    assert len(groups) == 4
+
+    costs = estimate_costs(groups, {0: 10.0, 2: 20.0, 1: 3.0})
+    assert costs[0] == 10.0
+    # unknown tasks cost the mean of their group, or of all known tasks
+    assert costs[4] == costs[6] == 15.0
+    assert costs[7] == 3.0
+    assert costs[5] == 11.0
+
+
+def test_schedule_balances_and_keeps_groups() -> None:
+    groups = group_tasks(list(CONFIGS), CONFIGS.__getitem__)
+    costs = {task_id: 1.0 for task_id in CONFIGS}
+    schedule = schedule_tasks(groups, costs, 2)
+    assert sorted(t for tasks in schedule for t in tasks) == list(CONFIGS)
+    assert [len(tasks) for tasks in schedule] == [4, 4]
+    # the shopping group is exactly one share and stays on one worker
+    assert any(tasks[:4] == [0, 2, 4, 6] for tasks in schedule)
+
+    # a group larger than a share is split over the workers
+    schedule = schedule_tasks(groups, costs, 4)
+    assert [len(tasks) for tasks in schedule] == [2, 2, 2, 2]
+
+    order = get_worker_order(schedule, 1)
+    assert order[:2] == schedule[1]
+    assert order[2:4] == schedule[2][::-1]
+    assert sorted(order) == list(CONFIGS)
+
+
+def test_task_durations(tmp_path: Path) -> None:
+    store = RunStore(tmp_path / "run.db")
+    for config_file, status in [
+        ("config_files/1.json", "passed"),
+        ("config_files/2.json", "error"),
+    ]:
+        attempt_id = store.claim(config_file, "w0")
+        assert attempt_id is not None
+        store.finish(attempt_id, status)
+    durations = store.task_durations()
+    assert list(durations) == [1]
+    assert durations[1] >= 0.0
+    store.close()
@@ -0,0 +1,63 @@
+import signal
+import time
+
+import pytest
+
+from runner import EpisodeTimeout, Watchdog
+
+
+def test_step_and_task_budgets() -> None:
+    watchdog = Watchdog(step_seconds=0.05, task_seconds=0.3)
+
+    with pytest.raises(EpisodeTimeout) as exc_info:
+        with watchdog.task():
+            with watchdog.step():
+                time.sleep(0.01)
+            with watchdog.step():
+                time.sleep(5)
+    assert exc_info.value.scope == "step"
+
+    start = time.monotonic()
+    with pytest.raises(EpisodeTimeout) as exc_info:
+        with watchdog.task():
+            for _ in range(100):
+                with watchdog.step():
+                    time.sleep(0.02)
+    assert exc_info.value.scope == "task"
+    assert time.monotonic() - start < 1.0
+
+
+def test_timeout_is_not_swallowed_and_timer_is_lifted() -> None:
+    watchdog = Watchdog(step_seconds=0.05)
+    swallowed = False
+    watchdog.start_task()
+    try:
+        with watchdog.step():
+            try:
+                time.sleep(5)
+            except Exception:
+                swallowed = True
+    except EpisodeTimeout:
+        pass
+    watchdog.end_task()
+    assert not swallowed
+    assert signal.getitimer(signal.ITIMER_REAL) == (0.0, 0.0)
+    assert signal.getsignal(signal.SIGALRM) is signal.SIG_DFL
+
+    # a step outside a task has no budget
+    with watchdog.step():
+        time.sleep(0.1)
+
+
+def test_handlers_outside_the_task_run_without_the_alarm() -> None:
+    watchdog = Watchdog(task_seconds=0.05)
+    handled = False
+    try:
+        with watchdog.task():
+            raise ValueError("step failed")
+    except ValueError:
+        # e.g. writing the error log after the deadline
+        time.sleep(0.1)
+        handled = True
+    assert handled
+    assert signal.getitimer(signal.ITIMER_REAL) == (0.0, 0.0)